@@ -0,0 +1,359 @@
+from __future__ import print_function
+from collections import deque
+import os
+import selectors
+import socket
+
+from telemetry.parser import TelemetrySerial, TelemetrySocket, DataPacket, HeaderPacket, \
+    frame_packet, SOF_BYTE, DATAID_TERMINATOR, OPCODE_SUBSCRIBE
+
+class FrameSplitter(object):
+  """Splits the byte stream sent by a broker client into destuffed packet
+  payloads and out-of-band bytes, without decoding the packets (set packets
+  carry no sequence number, so they can't go through TelemetryDeserializer).
+  """
+  def __init__(self):
+    self.buffer = bytearray()
+
+  def process_data(self, data):
+    """Returns a list of (is_packet, bytes) in stream order, where packets are
+    destuffed payloads. Incomplete trailing frames are kept for the next call.
+    """
+    self.buffer += data
+    out = []
+    while self.buffer:
+      next_sof = self.buffer.find(bytes(SOF_BYTE))
+      if next_sof == -1:
+        # hold back a trailing byte that may be the start of a SOF
+        end = len(self.buffer) - 1 if self.buffer[-1] == SOF_BYTE[0] else len(self.buffer)
+        if end > 0:
+          out.append((False, bytes(self.buffer[:end])))
+          del self.buffer[:end]
+        break
+      elif next_sof > 0:
+        out.append((False, bytes(self.buffer[:next_sof])))
+        del self.buffer[:next_sof]
+
+      if len(self.buffer) < len(SOF_BYTE) + 2:
+        break
+      length = self.buffer[2] << 8 | self.buffer[3]
+      payload = bytearray()
+      i = len(SOF_BYTE) + 2
+      while len(payload) < length and i < len(self.buffer):
+        payload.append(self.buffer[i])
+        if self.buffer[i] == SOF_BYTE[0]:
+          i += 1  # skip the stuffing byte
+        i += 1
+      if len(payload) < length or i > len(self.buffer):
+        break  # wait for the rest of the packet
+      out.append((True, bytes(payload)))
+      del self.buffer[:i]
+    return out
+
+
+class BrokerClient(object):
+  """A connected broker client, with its subscription and a bounded queue of
+  outgoing frames. When the queue is full, the oldest data is dropped so a slow
+  client never holds up the link or the other clients.
+
+  Arguments:
+    sock: connected, non-blocking client socket
+    max_queue_bytes: maximum number of bytes queued for this client
+  """
+  def __init__(self, sock, max_queue_bytes):
+    self.socket = sock
+    self.max_queue_bytes = max_queue_bytes
+    self.splitter = FrameSplitter()
+
+    self.subscription = None  # set of subscribed data IDs, or None for all
+
+    self.queue = deque()  # of (frame bytes, droppable)
+    self.queued_bytes = 0
+    self.sent_offset = 0  # bytes of the first queued frame already sent
+    self.dropped_frames = 0
+
+  def enqueue(self, frame, droppable=True):
+    if not droppable:
+      # a new header obsoletes everything queued before it
+      while len(self.queue) > (1 if self.sent_offset else 0):
+        dropped, _ = self.queue.pop()
+        self.queued_bytes -= len(dropped)
+    self.queue.append((frame, droppable))
+    self.queued_bytes += len(frame)
+
+    while self.queued_bytes > self.max_queue_bytes:
+      # never drop a partially sent frame, or the stream would be corrupted
+      for i in range(1 if self.sent_offset else 0, len(self.queue)):
+        if self.queue[i][1]:
+          dropped, _ = self.queue[i]
+          del self.queue[i]
+          self.queued_bytes -= len(dropped)
+          self.dropped_frames += 1
+          break
+      else:
+        break
+
+  def flush(self):
+    """Sends as much of the queue as the socket accepts without blocking.
+    """
+    while self.queue:
+      frame, _ = self.queue[0]
+      try:
+        sent = self.socket.send(memoryview(frame)[self.sent_offset:])
+      except BlockingIOError:
+        return
+      self.sent_offset += sent
+      if self.sent_offset < len(frame):
+        return
+      self.queue.popleft()
+      self.queued_bytes -= len(frame)
+      self.sent_offset = 0
+
+
+def filter_data_payload(payload, data_defs, data_ids):
+  """Returns a data packet payload containing only the fields in data_ids.
+  Packets with none of them are kept (empty) so clients can still track
+  sequence numbers. Fields are sliced out of the raw payload by their
+  lengths, so nothing is decoded or re-encoded.
+  """
+  out = bytearray(payload[:2])  # opcode, sequence
+  pos = 2
+  while payload[pos] != DATAID_TERMINATOR:
+    data_id = payload[pos]
+    end = pos + 1 + data_defs[data_id].get_payload_length()
+    if data_id in data_ids:
+      out += payload[pos:end]
+    pos = end
+  out.append(DATAID_TERMINATOR)
+  return bytes(out)
+
+
+def split_set_payload(payload, data_defs):
+  """Returns the (data ID, serialized value) fields of a set packet payload
+  (which has no sequence number), or None if it has undefined data IDs or is
+  malformed.
+  """
+  fields = []
+  pos = 1  # opcode
+  while pos < len(payload) and payload[pos] != DATAID_TERMINATOR:
+    data_id = payload[pos]
+    if data_id not in data_defs:
+      return None
+    end = pos + 1 + data_defs[data_id].get_payload_length()
+    fields.append((data_id, payload[pos + 1:end]))
+    pos = end
+  if pos != len(payload) - 1:
+    return None
+  return fields
+
+
+class TelemetryBroker(object):
+  """Owns the telemetry transport and republishes its headers, data packets and
+  out-of-band lines to any number of clients on a Unix-domain socket. Packets
+  and bytes received from clients are forwarded to the car, except subscription
+  packets, which set which data IDs that client receives. Set packets from all
+  clients go through the transport's set queue, so they are coalesced and
+  rate-limited together. Once the transport is closed, the clients are
+  disconnected (after flushing what they can take) and poll returns False.
+
+  Arguments:
+    telemetry: transport to the car, TelemetrySerial or TelemetrySocket
+    path: filesystem path to listen on
+    max_queue_bytes: per-client queue limit
+    ring: optional ShmRingWriter that all data packets are also written to
+  """
+  def __init__(self, telemetry, path, max_queue_bytes, ring=None):
+    self.telemetry = telemetry
+    self.path = path
+    self.max_queue_bytes = max_queue_bytes
+    self.ring = ring
+
+    self.header_frame = None  # replayed to clients connecting mid-stream
+    self.data_defs = {}
+    self.oob_line = bytearray()
+
+    self.clients = []
+    self.selector = selectors.DefaultSelector()
+    try:  # wake up as soon as the car sends data
+      self.selector.register(telemetry, selectors.EVENT_READ, telemetry)
+    except (ValueError, OSError):  # select doesn't support serial ports on Windows, so it's read every poll
+      pass
+    telemetry.subscribe_oob_bytes(self.oob_line.extend)  # forwarded as received, not decoded and re-encoded
+
+    if os.path.exists(path):
+      os.unlink(path)  # stale socket from a previous run
+    self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.listener.bind(path)
+    self.listener.listen()
+    self.listener.setblocking(False)
+    self.selector.register(self.listener, selectors.EVENT_READ)
+
+  def close(self):
+    for client in list(self.clients):
+      self.disconnect(client)
+    self.selector.close()
+    self.listener.close()
+    os.unlink(self.path)
+    if self.ring is not None:
+      self.ring.close()
+
+  def accept(self):
+    sock, _ = self.listener.accept()
+    sock.setblocking(False)
+    client = BrokerClient(sock, self.max_queue_bytes)
+    if self.header_frame is not None:
+      client.enqueue(self.header_frame, droppable=False)
+    self.clients.append(client)
+    self.selector.register(sock, selectors.EVENT_READ, client)
+    print("Client connected (%i total)" % len(self.clients))
+
+  def disconnect(self, client):
+    try:
+      client.flush()  # best effort, without blocking
+    except ConnectionError:
+      pass
+    self.selector.unregister(client.socket)
+    client.socket.close()
+    self.clients.remove(client)
+    print("Client disconnected (%i total, %i frames dropped)"
+          % (len(self.clients), client.dropped_frames))
+
+  def process_client_rx(self, client):
+    try:
+      data = client.socket.recv(4096)
+    except ConnectionError:
+      data = b''
+    if not data:
+      self.disconnect(client)
+      return
+    for is_packet, payload in client.splitter.process_data(data):
+      if not is_packet:
+        if not self.telemetry.transmit_bytes(payload):
+          print("Transmit buffer full, dropped %i bytes from client" % len(payload))
+      elif payload and payload[0] == OPCODE_SUBSCRIBE:
+        try:
+          client.subscription = set(payload[1:payload.index(DATAID_TERMINATOR, 1)])
+        except ValueError:
+          print("Dropped malformed subscribe packet from client")
+      else:
+        fields = split_set_payload(payload, self.data_defs)
+        if fields is None:
+          if not self.telemetry.transmit_packet(payload):
+            print("Transmit buffer full, dropped packet from client")
+        else:
+          for data_id, serialized_value in fields:
+            self.telemetry.tx_queue.set(data_id, serialized_value)
+
+  def publish_packet(self, packet):
+    if isinstance(packet, HeaderPacket):
+      self.header_frame = frame_packet(packet.raw)
+      self.data_defs = packet.get_data_defs()
+      for client in self.clients:
+        client.enqueue(self.header_frame, droppable=False)
+      if self.ring is not None:
+        self.ring.set_header(packet)
+        print(f"Writing data to shared memory ring {self.ring.name}")
+    elif isinstance(packet, DataPacket):
+      if self.ring is not None:
+        self.ring.write(packet)
+      frames = {}  # per distinct subscription, so each is only framed once
+      for client in self.clients:
+        key = None if client.subscription is None else frozenset(client.subscription)
+        if key not in frames:
+          if key is None:
+            frames[key] = frame_packet(packet.raw)
+          else:
+            frames[key] = frame_packet(filter_data_payload(packet.raw, self.data_defs, key))
+        client.enqueue(frames[key])
+
+  def publish_oob(self):
+    end = self.oob_line.rfind(b'\n') + 1
+    if end:
+      lines = bytes(self.oob_line[:end])
+      del self.oob_line[:end]
+      for client in self.clients:
+        client.enqueue(lines)
+
+  def poll(self, timeout):
+    """Waits up to timeout for the link or clients, then services them.
+    Returns whether the link is still open.
+    """
+    for key, _ in self.selector.select(timeout):
+      if key.data is None:
+        self.accept()
+      elif key.data is not self.telemetry:  # the link is read below regardless
+        self.process_client_rx(key.data)
+
+    self.telemetry.process_rx()
+    while True:
+      packet = self.telemetry.next_rx_packet()
+      if packet is None:
+        break
+      self.publish_packet(packet)
+    self.publish_oob()
+    self.telemetry.data_buffer.clear()  # decoded copy of the out-of-band bytes, which are published raw
+
+    for client in list(self.clients):
+      try:
+        client.flush()
+      except ConnectionError:
+        self.disconnect(client)
+
+    if self.telemetry.closed:
+      for client in list(self.clients):
+        self.disconnect(client)
+      return False
+    return True
+
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Telemetry broker, sharing one telemetry link between multiple clients.')
+
+  parser.add_argument('--hostname', metavar='h', help='network hostname')
+  parser.add_argument('--port', metavar='p', type=int, default=1234, help='network port')
+
+  parser.add_argument('--serial', metavar='s', help='serial port to receive on')
+  parser.add_argument('--baud', metavar='b', type=int, default=38400,
+                      help='serial baud rate')
+  parser.add_argument('--tx_rate', type=float,
+                      help='maximum rate to send set packets to the car at, in bytes/s')
+
+  parser.add_argument('--path', default='/tmp/telemetry-broker.sock',
+                      help='Unix-domain socket path clients connect to')
+  parser.add_argument('--max_queue', type=int, default=1024,
+                      help='per-client queue limit, in KiB, before the oldest data is dropped')
+  parser.add_argument('--shm_prefix',
+                      help='also write all data to a shared memory ring, published under this name')
+  parser.add_argument('--shm_rows', type=int, default=65536,
+                      help='number of data packets kept in the shared memory ring')
+  parser.add_argument('--poll_interval', type=float, default=10,
+                      help='maximum time to wait between telemetry reads, in ms, which also paces rate-limited '
+                           'sets, and bounds the latency of links that can\'t be waited on (serial ports on Windows)')
+  args = parser.parse_args()
+
+  telemetry = None
+  if args.serial is not None:
+    assert telemetry is None, "multiple comms methods defined in arguments"
+    telemetry = TelemetrySerial.open(args.serial, args.baud, args.tx_rate)
+    print(f"Opened serial port on {args.serial}: {args.baud}")
+  if args.hostname is not None:
+    assert telemetry is None, "multiple comms methods defined in arguments"
+    telemetry = TelemetrySocket(args.hostname, args.port, args.tx_rate)
+    print(f"Opened network socket on {args.hostname}: {args.port}")
+  assert telemetry is not None, "no comms method defined in arguments"
+
+  ring = None
+  if args.shm_prefix is not None:
+    from telemetry.shmring import ShmRingWriter  # NumPy, only needed for the ring
+    ring = ShmRingWriter(args.shm_prefix, args.shm_rows)
+  broker = TelemetryBroker(telemetry, args.path, args.max_queue * 1024, ring)
+  print(f"Listening on {args.path}")
+  try:
+    while broker.poll(args.poll_interval / 1000):
+      pass
+    print("Connection closed")
+  except KeyboardInterrupt:
+    pass
+  finally:
+    broker.close()
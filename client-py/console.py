@@ -1,48 +1,196 @@
 from __future__ import print_function
+from collections import deque
+import selectors
+import sys
 import time
 
-import serial
+from telemetry.parser import TelemetrySerial, TelemetrySocket, TelemetryBrokerClient, DataPacket, HeaderPacket
 
-from telemetry.parser import TelemetrySerial, TelemetrySocket
+CLEAR_SCREEN = '\x1b[H\x1b[2J'  # ANSI cursor home and clear screen
+STATS_OOB_LINES = 5
+
+def filter_data(packet, data_ids):
+  """Returns the data dict of a packet restricted to data_ids (if not None)."""
+  if data_ids is None:
+    return packet.get_data_dict()
+  return {data_id: value for data_id, value in packet.get_data_dict().items() if data_id in data_ids}
+
+def filter_ids(header, names):
+  """Returns the set of data IDs in a header with the given internal names."""
+  data_ids = set()
+  for data_id, data_def in header.get_data_defs().items():
+    if data_def.internal_name in names:
+      data_ids.add(data_id)
+  for name in set(names) - set(header.get_data_names()):
+    print("Filtered data '%s' not in header" % name)
+  return data_ids
 
 if __name__ == "__main__":
   import argparse
   parser = argparse.ArgumentParser(description='Telemetry packet parser example.')
 
   parser.add_argument('--hostname', metavar='h', help='network hostname')
-  parser.add_argument('--port', metavar='p', help='network port', default=1234)
+  parser.add_argument('--port', metavar='p', type=int, default=1234, help='network port')
 
   parser.add_argument('--serial', metavar='s', help='serial port to receive on')
   parser.add_argument('--baud', metavar='b', type=int, default=38400,
                       help='serial baud rate')
+
+  parser.add_argument('--broker', metavar='path', help='telemetry broker socket path to connect to')
+
+  parser.add_argument('--filter', nargs='+', metavar='name',
+                      help='internal names of the only data to print, with --broker only these are received')
+  parser.add_argument('--max_rate', type=float,
+                      help='maximum data packets printed per second, excess packets are counted but not printed')
+  parser.add_argument('--stats', action='store_true',
+                      help='instead of printing packets, show a periodically redrawn table of per-data statistics')
+  parser.add_argument('--stats_interval', type=float, default=0.5,
+                      help='stats table redraw interval, in seconds')
+  parser.add_argument('--stats_window', type=int, default=1000,
+                      help='number of samples statistics are computed over')
+  parser.add_argument('--indep_name', '-i', default='time',
+                      help='internal name of the device time data, used by --stats to measure latency')
+  parser.add_argument('--time_scale', type=float, default=0.001,
+                      help='seconds per unit of the device time data')
   args = parser.parse_args()
 
   telemetry = None
   if args.serial is not None:
     assert telemetry is None, "multiple comms methods defined in arguments"
-    telemetry = TelemetrySerial(serial.Serial(args.serial, baudrate=args.baud))
+    telemetry = TelemetrySerial.open(args.serial, args.baud)
     print(f"Opened serial port on {args.serial}: {args.baud}")
   if args.hostname is not None:
     assert telemetry is None, "multiple comms methods defined in arguments"
     telemetry = TelemetrySocket(args.hostname, args.port)
     print(f"Opened network socket on {args.hostname}: {args.port}")
+  if args.broker is not None:
+    assert telemetry is None, "multiple comms methods defined in arguments"
+    telemetry = TelemetryBrokerClient(args.broker, args.filter)
+    print(f"Connected to broker on {args.broker}")
 
-  while True:
-    telemetry.process_rx()
-    time.sleep(0.1)
+  sys.stdout.reconfigure(errors='replace')  # don't die on unprintable out-of-band data
 
+  selector = selectors.DefaultSelector()
+  try:
+    selector.register(telemetry, selectors.EVENT_READ)
+    timeout = None  # block until there's data
+  except (ValueError, OSError):  # select doesn't support serial ports on Windows
+    timeout = 0.01
+
+  data_ids = None  # data IDs to print, None for all
+  next_print_time = time.time()
+  skipped = 0
+
+  stats = None
+  if args.stats:
+    from telemetry.stats import StatsEngine, ClockEstimator  # NumPy, only needed for --stats
+    stats = StatsEngine(args.stats_window)
+    clock = ClockEstimator(args.time_scale)
+  indep_id = None
+  next_stats_time = time.time()
+  oob_lines = deque([''], maxlen=STATS_OOB_LINES)  # latest out-of-band lines, shown under the stats table
+
+  try:
     while True:
-      next_packet = telemetry.next_rx_packet()
-      if not next_packet:
-        break
-      print('')
-      print(next_packet)
-    
-    while True:
-      next_byte = telemetry.next_rx_byte()
-      if next_byte is None:
+      if stats is not None:
+        select_timeout = max(0, next_stats_time - time.time())
+        if timeout is not None:
+          select_timeout = min(select_timeout, timeout)
+      else:
+        select_timeout = timeout
+      selector.select(select_timeout)
+      telemetry.process_rx()
+
+      if stats is not None:
+        while True:
+          next_packet = telemetry.next_rx_packet()
+          if not next_packet:
+            break
+          if isinstance(next_packet, HeaderPacket):
+            data_defs = next_packet.get_data_defs()
+            if args.filter is not None:
+              data_defs = {data_id: data_defs[data_id] for data_id in filter_ids(next_packet, args.filter)}
+            stats.set_data_defs(data_defs)
+            indep_id = None
+            for data_id, data_def in next_packet.get_data_defs().items():
+              if data_def.internal_name == args.indep_name:
+                indep_id = data_id
+            clock.reset()
+          elif isinstance(next_packet, DataPacket):
+            stats.update(next_packet)
+            indep_value = next_packet.get_data_by_id(indep_id)
+            if indep_value is not None:
+              clock.add(indep_value, next_packet.rx_time)
+        oob = []
+        while True:
+          next_byte = telemetry.next_rx_byte()
+          if next_byte is None:
+            break
+          oob.append(next_byte)
+        for i, line in enumerate(''.join(oob).split('\n')):
+          if i == 0:
+            oob_lines[-1] += line
+          else:
+            oob_lines.append(line)
+
+        now = time.time()
+        if now >= next_stats_time:
+          next_stats_time = max(next_stats_time + args.stats_interval, now)
+          sys.stdout.write(CLEAR_SCREEN + "Link: %s\nClock: %s\n\n" % (telemetry.decoder.link_stats, clock.format())
+                           + stats.format_table(now) + '\n\n' + '\n'.join(oob_lines))
+          sys.stdout.flush()
+        if telemetry.closed:
+          print("\nConnection closed")
+          break
+        continue
+
+      out = []
+      while True:
+        next_packet = telemetry.next_rx_packet()
+        if not next_packet:
+          break
+        if isinstance(next_packet, HeaderPacket):
+          if args.filter is not None:
+            data_ids = filter_ids(next_packet, args.filter)
+          text = repr(next_packet)
+        elif isinstance(next_packet, DataPacket):
+          shown = filter_data(next_packet, data_ids)
+          if not shown:
+            continue
+          if args.max_rate is not None:
+            now = time.time()
+            if now < next_print_time:
+              skipped += 1
+              continue
+            next_print_time = max(next_print_time + 1 / args.max_rate, now)
+            if skipped:
+              out.append('\n(%i packets not printed)' % skipped)
+              skipped = 0
+          text = "[%i]Data: %s" % (next_packet.sequence, repr(shown))
+        else:
+          text = repr(next_packet)
+        out.append('\n')
+        out.append(text)
+        out.append('\n')
+
+      while True:
+        next_byte = telemetry.next_rx_byte()
+        if next_byte is None:
+          break
+        out.append(next_byte)
+
+      if out:
+        sys.stdout.write(''.join(out))
+        sys.stdout.flush()
+
+      if telemetry.closed:
+        print("\nConnection closed")
         break
-      try:
-        print(next_byte, end='')
-      except UnicodeEncodeError:
-        pass
+  except KeyboardInterrupt:
+    pass
+
+  link_stats = telemetry.decoder.link_stats
+  print("\nLink: %s" % link_stats)
+  if link_stats.burst_histogram:
+    print("Loss bursts (length: count): %s" % ', '.join(
+        "%i: %i" % (length, count) for length, count in sorted(link_stats.burst_histogram.items())))
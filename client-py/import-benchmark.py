@@ -0,0 +1,113 @@
+"""Measures the startup time of the telemetry package and tools, each in a
+fresh interpreter, and checks that heavy dependencies stay lazily imported.
+Exits with an error if any case is over its time budget or imports a module
+it shouldn't, so it can guard against startup regressions.
+"""
+from typing import List, NamedTuple, Optional, Tuple
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+HEAVY_MODULES = ['numpy', 'serial', 'matplotlib', 'tkinter']
+
+# prints the heavy modules loaded by the code before it
+LOADED_PROBE = "\nimport sys; print(','.join(m for m in %r if m in sys.modules))" % HEAVY_MODULES
+
+
+class Case(NamedTuple):
+  name: str
+  args: List[str]  # interpreter arguments
+  budget_ms: float  # maximum median time over bare interpreter startup
+  forbidden: List[str]  # heavy modules that must not be loaded
+
+
+CASES = [
+  Case('import telemetry', ['-c', 'import telemetry'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+  Case('import telemetry.parser', ['-c', 'import telemetry.parser'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+  Case('telemetry.LogData', ['-c', 'import telemetry; telemetry.LogData'], 300, ['serial', 'matplotlib', 'tkinter']),
+  Case('console.py --help', ['console.py', '--help'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+  Case('broker.py --help', ['broker.py', '--help'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+  Case('plotter.py --help', ['plotter.py', '--help'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+  Case('log-visualizer.py --help', ['log-visualizer.py', '--help'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+  Case('log-merge.py --help', ['log-merge.py', '--help'], 100, ['numpy', 'serial', 'matplotlib', 'tkinter']),
+]
+
+
+def time_run(args: List[str], cwd: str) -> Tuple[float, str]:
+  """Returns the wall time in ms and stdout of running the interpreter with args."""
+  start = time.perf_counter()
+  result = subprocess.run([sys.executable] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          universal_newlines=True, check=True)
+  return (time.perf_counter() - start) * 1000, result.stdout
+
+
+def median_time(args: List[str], cwd: str, repeat: int) -> float:
+  time_run(args, cwd)  # warm the filesystem and bytecode caches
+  return statistics.median(time_run(args, cwd)[0] for _ in range(repeat))
+
+
+def check_loaded(case: Case, cwd: str) -> Optional[str]:
+  """Returns an error message if a case loads a forbidden module. Scripts are
+  run as __main__ through runpy, so the probe runs after they exit."""
+  if not case.forbidden:
+    return None
+  if case.args[0] == '-c':
+    code = case.args[1]
+  else:
+    code = ("import runpy, sys; sys.argv = %r\n"
+            "try: runpy.run_path(%r, run_name='__main__')\n"
+            "except SystemExit: pass\n" % (case.args, case.args[0]))
+  _, out = time_run(['-c', code + LOADED_PROBE], cwd)
+  loaded = [name for name in out.splitlines()[-1].split(',') if name in case.forbidden]  # after any help text
+  if loaded:
+    return "loads %s" % ', '.join(loaded)
+  return None
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Startup time benchmark of the telemetry package and tools.')
+  parser.add_argument('--repeat', type=int, default=10,
+                      help='runs per case, the median is reported')
+  parser.add_argument('--budget_scale', type=float, default=1,
+                      help='multiplier on the time budgets, for slower machines, 0 to only report times')
+  parser.add_argument('--importtime', metavar='case',
+                      help='instead, print the slowest imports (from python -X importtime) of the named case')
+  args = parser.parse_args()
+
+  cwd = os.path.dirname(os.path.abspath(__file__))
+
+  if args.importtime is not None:
+    case = {case.name: case for case in CASES}[args.importtime]
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + case.args, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    rows = [line.split('|') for line in result.stderr.splitlines() if line.startswith('import time:')][1:]
+    rows.sort(key=lambda row: -int(row[1]))
+    print("cumulative us  module")
+    for row in rows[:20]:
+      print("%13s  %s" % (row[1].strip(), row[2].rstrip()))
+    sys.exit(0)
+
+  baseline = median_time(['-c', 'pass'], cwd, args.repeat)
+  print("interpreter startup: %.1f ms" % baseline)
+  failures = []
+  for case in CASES:
+    elapsed = median_time(case.args, cwd, args.repeat) - baseline
+    budget = case.budget_ms * args.budget_scale
+    problems = []
+    if budget and elapsed > budget:
+      problems.append("over budget of %.0f ms" % budget)
+    loaded_error = check_loaded(case, cwd)
+    if loaded_error is not None:
+      problems.append(loaded_error)
+    print("%-26s %7.1f ms%s" % (case.name, elapsed, ''.join("  FAIL: " + problem for problem in problems)))
+    if problems:
+      failures.append(case.name)
+
+  if failures:
+    print("%i cases failed" % len(failures))
+    sys.exit(1)
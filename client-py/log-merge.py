@@ -0,0 +1,65 @@
+"""Merges CSV logs and trigger captures recorded on separate time bases (like
+from two cars, or a car and a trackside sensor) into one time-aligned CSV log,
+which log-visualizer.py opens like any other, for example with the columns of
+different logs overlaid using --merge.
+"""
+import os
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Time-aligned merge of telemetry logs.')
+  parser.add_argument('filenames', nargs='+',
+                      help='CSV logs (or plotter trigger captures) to merge, the first sets the time base')
+  parser.add_argument('--output', '-o', required=True,
+                      help='filename of the merged CSV log to write')
+  parser.add_argument('--labels', '-l',
+                      help='comma-separated label for each log, prefixed to its column names, defaults to log1,log2,...')
+  parser.add_argument('--indep_name', '-i', default='time',
+                      help='name of the independent variable column shared by the logs')
+  parser.add_argument('--skip_data_rows', type=int, nargs='+', default=[0],
+                      help='data rows to skip in the CSV logs, one number for all logs or one per log, '
+                           '2 for plotter logs with display names and units')
+  parser.add_argument('--offset', type=float, nargs='+',
+                      help='offset added to the independent variable of each log to align it with the first, '
+                           'or the initial guess with --correlate')
+  parser.add_argument('--correlate', '-c', nargs='+', metavar='name',
+                      help='estimate offsets by cross-correlating these numeric columns, one name for all logs or '
+                           'one per log, eg the speed measured by the car and by the trackside sensor')
+  parser.add_argument('--correlate_step', type=float,
+                      help='resampling interval for --correlate, defaults to the median sample interval of the first log')
+  parser.add_argument('--max_offset', type=float,
+                      help='with --correlate, only search offsets within this distance of --offset (or 0), '
+                           'for signals that repeat, like laps')
+  args = parser.parse_args()
+
+  from telemetry.merge import estimate_offset, open_source, write_merged
+
+  count = len(args.filenames)
+  labels = args.labels.split(',') if args.labels is not None else ['log%i' % (i + 1) for i in range(count)]
+  assert len(labels) == count, "one label is needed per log"
+  offsets = args.offset if args.offset is not None else [0.0] * count
+  assert len(offsets) == count, "one offset is needed per log"
+  assert os.path.abspath(args.output) not in [os.path.abspath(filename) for filename in args.filenames], \
+      "output would overwrite an input"
+
+  skip_data_rows = args.skip_data_rows if len(args.skip_data_rows) > 1 else args.skip_data_rows * count
+  assert len(skip_data_rows) == count, "one number of skipped rows is needed for all logs, or one per log"
+
+  sources = [open_source(filename, args.indep_name, skip) for filename, skip in zip(args.filenames, skip_data_rows)]
+  for source, offset in zip(sources, offsets):
+    source.offset = offset
+
+  if args.correlate is not None:
+    names = args.correlate if len(args.correlate) > 1 else args.correlate * count
+    assert len(names) == count, "one correlated column name is needed for all logs, or one per log"
+    reference = sources[0].read_column(names[0])
+    for source, name, offset in zip(sources[1:], names[1:], offsets[1:]):
+      source.offset, coefficient = estimate_offset(reference, source.read_column(name), args.correlate_step,
+                                                   offset - offsets[0], args.max_offset)
+      source.offset += offsets[0]
+      print(f"{source.name}: offset {source.offset:.6g} (correlation {coefficient:.3f})")
+
+  with open(args.output, 'w', newline='') as file:
+    row_count = write_merged(file, sources, labels, args.indep_name)
+  print(f"finished: merged {row_count} rows into {args.output}")
@@ -1,162 +1,306 @@
 from abc import abstractmethod
-from typing import List, Any, Dict, Tuple, FrozenSet  # need to not alias OrderedDict
+from typing import List, Any, Callable, Dict, Tuple, FrozenSet  # need to not alias OrderedDict
 from collections import OrderedDict
 
-import csv
+import argparse
+import os
+import time
+
+
+def make_parser() -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(description='CSV Telemetry / Logger Visualizer')
+
+  parser.add_argument('filename',
+                      help='filename of CSV (or plotter trigger capture) to open, '
+                           'the first column is treated as the independent axis')
+  parser.add_argument('--merge', '-m', action='append', default=[],
+                      help='column names to merge for each plot, comma-separated without spaces, '
+                           'can be specified multiple times, eg "-m camera,line -m kp,kd"')
+  parser.add_argument('--hide', default='',
+                      help='column names to hide, comma-separated without spaces')
+  parser.add_argument('--skip_data_rows', type=int, default=0,
+                      help='data columns to skip')
+  parser.add_argument('--no_cache', action='store_true',
+                      help='always re-parse the CSV, without reading or writing the parsed-log sidecar cache')
+  parser.add_argument('--jobs', '-j', type=int, default=1,
+                      help='number of processes to parse the CSV with, 0 for one per CPU')
+  parser.add_argument('--start', type=float, default=None,
+                      help='only load data with the independent (first) column at or after this value')
+  parser.add_argument('--end', type=float, default=None,
+                      help='only load data with the independent (first) column at or before this value')
+  parser.add_argument('--follow', action='store_true',
+                      help='keep watching the CSV as it is written (like by the plotter), plotting appended rows, '
+                           'does not use the sidecar cache or parallel parsing')
+  parser.add_argument('--follow_interval', type=int, default=250,
+                      help='milliseconds between checking for and drawing appended rows with --follow')
+  parser.add_argument('--derive', '-d', nargs='+', metavar='name=expr', default=[],
+                      help='derived data to compute and plot, defined by NumPy expressions over column names, '
+                           'eg "speed[m/s]=diff(enc)/diff(time)*1000" "line=centroid(cam)"')
+  parser.add_argument('--spectrum', nargs='+', metavar='name', default=[],
+                      help='numeric column names to also plot the spectrogram of')
+  parser.add_argument('--spectrum_window', type=int, default=256,
+                      help='samples per spectrogram window, windows overlap by 75%%')
+  parser.add_argument('--time_scale', type=float, default=0.001,
+                      help='seconds per unit of the independent (first) column, for spectrogram frequencies, '
+                           '0 to show frequencies per unit')
+  return parser
+
+
+if __name__ == '__main__':
+  # before the imports below, so --help and usage errors don't wait for NumPy (or matplotlib, imported later)
+  parser = make_parser()
+  args = parser.parse_args()
+
+
 import numpy as np  # type: ignore
-import matplotlib.pyplot as plt  # type: ignore
+
+from telemetry.csvlog import LogColumn, LogData, LogFollower, load_log, \
+    COLTYPE_HIDDEN, COLTYPE_NUMERIC, COLTYPE_ARRAY
+from telemetry.capture import is_capture_file, load_capture
+from telemetry.derived import LogDerivedChannels
+from telemetry.spectrum import SlidingSpectrum
+
+
+class AppendableArray:
+  """Array with amortized constant-time appends along the first axis, wrapping
+  an initial (possibly read-only or memory-mapped) array until it is appended to.
+  """
+  def __init__(self, initial: np.ndarray) -> None:
+    self.array = initial
+    self.length = len(initial)
+
+  def append(self, values: np.ndarray) -> None:
+    if len(values) == 0:
+      return
+    if self.length == 0:
+      self.array = np.empty((0, ) + values.shape[1:])
+    if self.length + len(values) > len(self.array) or not self.array.flags.writeable:
+      grown = np.empty((max(self.length + len(values), 2 * self.length), ) + values.shape[1:])
+      grown[:self.length] = self.array[:self.length]
+      self.array = grown
+    self.array[self.length:self.length + len(values)] = values
+    self.length += len(values)
+
+  def view(self) -> np.ndarray:
+    return self.array[:self.length]
 
 
 class BasePlot:
   @abstractmethod
-  def add_cell(self, indep_val: float, data: str) -> None:
+  def render(self, subplot: Any) -> None:
     raise NotImplementedError()
 
   @abstractmethod
-  def render(self, subplot: Any) -> None:
+  def append(self, column: LogColumn) -> None:
+    """Appends newly parsed data, to be drawn on the next update_render."""
+    raise NotImplementedError()
+
+  @abstractmethod
+  def update_render(self) -> None:
+    """Updates the artists created by render with any appended data."""
     raise NotImplementedError()
 
 
 class HiddenPlot(BasePlot):
-  def __init__(self) -> None:
+  def __init__(self, column: LogColumn) -> None:
     pass
 
-  def add_cell(self, indep_val: float, data: str) -> None:
+  def render(self, subplot: Any) -> None:
     pass
 
-  def render(self, subplot: Any) -> None:
+  def append(self, column: LogColumn) -> None:
+    pass
+
+  def update_render(self) -> None:
     pass
 
 
 class LinePlot(BasePlot):
-  def __init__(self) -> None:
-    self.x_values: List[float] = []
-    self.y_values: List[float] = []
-
-  def add_cell(self, indep_val: float, data: str) -> None:
-    self.x_values.append(indep_val)
-    self.y_values.append(float(data))
+  def __init__(self, column: LogColumn) -> None:
+    self.x_values = AppendableArray(column.x_values)
+    self.y_values = AppendableArray(column.y_values)
+    self.line: Any = None
 
   def render(self, subplot: Any) -> None:
-    subplot.plot(self.x_values, self.y_values)
+    self.line, = subplot.plot(self.x_values.view(), self.y_values.view())
+
+  def append(self, column: LogColumn) -> None:
+    self.x_values.append(column.x_values)
+    self.y_values.append(column.y_values)
+
+  def update_render(self) -> None:
+    self.line.set_data(self.x_values.view(), self.y_values.view())
+    self.line.axes.relim()
+    self.line.axes.autoscale_view(scalex=False)
+
+
+def fencepost_edges(x_values: np.ndarray) -> np.ndarray:
+  """Returns the edges surrounding each of the (increasing) x values, which
+  is one more than the values, for pcolor-style images.
+  """
+  if len(x_values) == 1:  # fencepost with arbitrary size of unit 1
+    return np.array([x_values[0] - 0.5, x_values[0] + 0.5])
+  x_edges = np.empty(len(x_values) + 1)
+  x_edges[1:-1] = (x_values[1:] + x_values[:-1]) / 2
+  x_edges[0] = x_values[0] - (x_values[1] - x_values[0]) / 2
+  x_edges[-1] = x_values[-1] + (x_values[-1] - x_values[-2]) / 2
+  return x_edges
+
+
+def add_image(subplot: Any, x_edges: np.ndarray, y_edges: np.ndarray, values: np.ndarray) -> Any:
+  """Adds a grayscale image of values (indexed by y then x) with the given
+  (increasing) cell edges, like pcolorfast, but always as a PcolorImage, which
+  unlike the other pcolorfast artists can take data of a new shape in set_data.
+  """
+  from matplotlib.image import PcolorImage  # type: ignore
+  image = PcolorImage(subplot, x_edges, y_edges, values, cmap='gray')
+  subplot.add_image(image)
+  subplot.update_datalim([(x_edges[0], y_edges[0]), (x_edges[-1], y_edges[-1])])
+  subplot.autoscale_view()
+  return image
+
+
+def set_image_data(image: Any, x_edges: np.ndarray, y_edges: np.ndarray, values: np.ndarray) -> None:
+  """Updates an image from add_image in place with grown data, rescaling its
+  colors and the data limits to the new data like a new image would.
+  """
+  image.set_data(x_edges, y_edges, values)
+  image.autoscale()
+  image.axes.update_datalim([(x_edges[0], y_edges[0]), (x_edges[-1], y_edges[-1])])
 
 
 class WaterfallPlot(BasePlot):
-  def __init__(self) -> None:
-    self.x_values: List[float] = []
-    self.y_values: List[List[float]] = []
-
-  def add_cell(self, indep_val: float, data: str) -> None:
-    arr_data = [float(arr_elt) for arr_elt in data[1:-1].split(',')]
-    if self.y_values:
-      assert len(arr_data) == len(self.y_values[0])
-
-    self.x_values.append(indep_val)
-    self.y_values.append(arr_data)
+  def __init__(self, column: LogColumn) -> None:
+    self.x_values = AppendableArray(column.x_values)
+    self.y_values = AppendableArray(column.y_values)
+    self.subplot: Any = None
+    self.image: Any = None
+    self.rendered_length = 0  # rows drawn by the image
 
   def render(self, subplot: Any) -> None:
-    # note, mesh is the fencepost surrounding the data - so these must be 1 larger in both dimensions than the values
-    arr_len = len(self.y_values[0])
-    val_len = len(self.y_values)
-    x_mesh: List[List[float]] = []
-    y_mesh: List[List[float]] = [[i - 0.5 for i in range(arr_len + 1)]] * (val_len + 1)
-
-    # generate the x_mesh from x_values
-    if val_len == 0:
+    self.subplot = subplot
+    x_values = self.x_values.view()
+    y_values = self.y_values.view()
+
+    if len(x_values) == 0:
       return
-    elif val_len == 1:  # fencepost with arbitrary size of unit 1
-      x_point = self.x_values[0]
-      x_mesh.append([x_point - 0.5] * (arr_len + 1))
-      x_mesh.append([x_point + 0.5] * (arr_len + 1))
-    else:
-      lower_x_size = self.x_values[1] - self.x_values[0]
-      x_mesh.append([self.x_values[0] - lower_x_size / 2] * (arr_len + 1))
-      for i in range(val_len - 1):
-        x_mesh.append([(self.x_values[i+1] + self.x_values[i]) / 2] * (arr_len + 1))
-      upper_x_size = self.x_values[-1] - self.x_values[-2]
-      x_mesh.append([self.x_values[-1] + upper_x_size / 2] * (arr_len + 1))
+    arr_len = y_values.shape[1]
+    y_edges = np.arange(arr_len + 1) - 0.5
+    self.image = add_image(subplot, fencepost_edges(x_values), y_edges, np.asarray(y_values).T)
+    self.rendered_length = len(x_values)
 
-    subplot.pcolorfast(np.array(x_mesh), np.array(y_mesh), np.array(self.y_values),
-                       cmap='gray', interpolation='None')
+  def append(self, column: LogColumn) -> None:
+    self.x_values.append(column.x_values)
+    self.y_values.append(column.y_values)
 
+  def update_render(self) -> None:
+    if self.x_values.length == self.rendered_length:
+      return
+    if self.image is None:
+      self.render(self.subplot)
+      return
+    x_values = self.x_values.view()
+    y_edges = np.arange(self.y_values.view().shape[1] + 1) - 0.5
+    set_image_data(self.image, fencepost_edges(x_values), y_edges, np.asarray(self.y_values.view()).T)
+    self.rendered_length = len(x_values)
+
+
+class SpectrumPlot(BasePlot):
+  """Spectrogram of a numeric column, computed in one vectorized pass over
+  the column (and incrementally over appended data). Frequencies assume evenly
+  spaced samples, with the spacing estimated from the first window.
+  """
+  def __init__(self, column: LogColumn, window_length: int, time_scale: float) -> None:
+    self.spectrum = SlidingSpectrum(window_length)
+    self.time_scale = time_scale
+    self.first_x: Any = None
+    self.y_edges: Any = None
+    self.x_values = AppendableArray(np.empty(0))
+    self.spectra = AppendableArray(np.empty((0, self.spectrum.get_bins())))
+    self.subplot: Any = None
+    self.image: Any = None
+    self.rendered_length = 0  # spectra drawn by the image
+    self.append(column)
+
+  def append(self, column: LogColumn) -> None:
+    finite = np.isfinite(column.y_values)
+    x_values, y_values = column.x_values[finite], column.y_values[finite]
+    if self.first_x is None and len(x_values):
+      self.first_x = x_values[0]
+    ends, spectra = self.spectrum.extend(y_values)
+    if len(ends) and self.y_edges is None:
+      sample_interval = (x_values[ends[0]] - self.first_x) / (self.spectrum.window_length - 1)
+      self.y_edges = self.spectrum.get_frequency_edges((sample_interval if sample_interval > 0 else 1)
+                                                       * (self.time_scale if self.time_scale > 0 else 1))
+    self.x_values.append(x_values[ends])
+    self.spectra.append(spectra)
 
-def str_is_float(input: str) -> bool:
-  if not input:  # TODO: this is a bit hacky, we default empty cell as float
-    return True
-  try:
-    float(input)
-    return True
-  except ValueError:
-    return False
+  def render(self, subplot: Any) -> None:
+    self.subplot = subplot
+    subplot.set_ylabel('Hz' if self.time_scale > 0 else 'cycles / x')
+    x_values = self.x_values.view()
+    if len(x_values) == 0:
+      return
+    self.image = add_image(subplot, fencepost_edges(x_values), self.y_edges, self.spectra.view().T)
+    self.rendered_length = len(x_values)
+    subplot.set_ylim(self.y_edges[0], self.y_edges[-1])
 
+  def update_render(self) -> None:
+    if self.x_values.length == self.rendered_length:
+      return
+    if self.image is None:
+      self.render(self.subplot)
+      return
+    x_values = self.x_values.view()
+    set_image_data(self.image, fencepost_edges(x_values), self.y_edges, self.spectra.view().T)
+    self.rendered_length = len(x_values)
 
-def str_is_array(input: str) -> bool:
-  return len(input) > 1 and input[0] == '[' and input[-1] == ']'
 
+plot_types: Dict[str, Callable[[LogColumn], BasePlot]] = {
+  COLTYPE_HIDDEN: HiddenPlot,
+  COLTYPE_NUMERIC: LinePlot,
+  COLTYPE_ARRAY: WaterfallPlot,
+}
 
-if __name__ == '__main__':
-  import argparse
-  parser = argparse.ArgumentParser(description='CSV Telemetry / Logger Visualizer')
 
-  parser.add_argument('filename',
-                      help='filename of CSV to open, the first column is treated as the independent axis')
-  parser.add_argument('--merge', '-m', action='append', default=[],
-                      help='column names to merge for each plot, comma-separated without spaces, '
-                           'can be specified multiple times, eg "-m camera,line -m kp,kd"')
-  parser.add_argument('--hide', default='',
-                      help='column names to hide, comma-separated without spaces')
-  parser.add_argument('--skip_data_rows', type=int, default=0,
-                      help='data columns to skip')
-  args = parser.parse_args()
+if __name__ == '__main__':
+  # matplotlib is only imported once the arguments are good, so --help and usage errors are quick
+  from matplotlib import animation, pyplot as plt  # type: ignore
 
   #
   # Parse the input CSV
   #
   hide_cols = args.hide.split(',')
 
-  first_x = 0.0
-  last_x = 0.0
-  with open(args.filename, newline='') as csvfile:
-    reader = csv.reader(csvfile)
-    names = next(reader)
-
-    try:
-      for i in range(args.skip_data_rows):  # skip skipped rows
-        next(reader)
-
-      data_row = next(reader)  # infer data type from first row
-      plots: List[BasePlot] = []
-      for col_name, data_cell in zip(names[1:], data_row[1:]):  # discard first col
-        if col_name in hide_cols or col_name.split(' ')[0] in hide_cols:
-          print(f"hiding '{col_name}'")
-          plots.append(HiddenPlot())
-        elif str_is_float(data_cell):
-          print(f"detected numeric / line plot for '{col_name}'")
-          plots.append(LinePlot())
-        elif str_is_array(data_cell):
-          print(f"detected array / waterfall plot for '{col_name}'")
-          plots.append(WaterfallPlot())
-        else:
-          raise ValueError(f"Unable to infer data type for '{col_name}' from data contents '{data_cell}'")
-
-      data_row_idx = 0
-      first_x = float(data_row[0])
-      print(f"working: parsed {data_row_idx} rows", end='\r')
-      while True:
-        indep_value = float(data_row[0])
-        last_x = indep_value
-        for data_col_idx, data_cell in enumerate(data_row[1:]):  # discard first col
-          if data_cell:
-            plots[data_col_idx].add_cell(indep_value, data_cell)
-
-        data_row_idx += 1
-        if data_row_idx % 1000 == 0:
-          print(f"working: parsed {data_row_idx} rows", end='\r')
-
-        data_row = next(reader)
-
-    except StopIteration:
-      print(f"finished: parsed {data_row_idx} rows")
+  logdata: LogData
+  trigger_x = None  # independent value of the trigger, for captures
+  if is_capture_file(args.filename):
+    if args.follow:
+      parser.error("captures can't be followed")
+    logdata, trigger_x = load_capture(args.filename)
+    logdata = logdata.select_range(args.start, args.end)
+    print(f"finished: loaded capture of {logdata.row_count} packets")
+  elif args.follow:
+    follower = LogFollower(args.filename, args.skip_data_rows, hide_cols)
+    followed_logdata = follower.read_new()
+    while followed_logdata is None:
+      print(f"waiting: no data rows in '{args.filename}'", end='\r')
+      time.sleep(args.follow_interval / 1000)
+      followed_logdata = follower.read_new()
+    logdata = followed_logdata
+    print(f"following: parsed {logdata.row_count} rows")
+  else:
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    logdata = load_log(args.filename, args.skip_data_rows, hide_cols, use_cache=not args.no_cache, jobs=jobs,
+                       start=args.start, end=args.end)
+  derived = LogDerivedChannels(args.derive)
+  logdata = derived.process(logdata)
+  if args.follow:  # after deriving, which continues from the rows before (like diff), including out-of-range ones
+    logdata = logdata.select_range(args.start, args.end)
+  names = logdata.names
+  first_x = logdata.first_x if args.start is None else args.start
+  last_x = logdata.last_x if args.end is None else args.end
+  plots: List[BasePlot] = [plot_types[column.coltype](column) for column in logdata.columns]
 
   #
   # Build plots
@@ -180,6 +324,16 @@ if __name__ == '__main__':
     if col_name not in hide_cols and simple_col_name not in hide_cols:
       merged_plots.setdefault(key, []).append((col_name, plot))
 
+  spectrum_plots: List[Tuple[int, BasePlot]] = []  # with column index
+  for name in args.spectrum:
+    col_idx = names.index(name) - 1 if name in names[1:] else None
+    if col_idx is None or logdata.columns[col_idx].coltype != COLTYPE_NUMERIC:
+      print(f"unable to plot spectrum of '{name}': not a numeric column")
+      continue
+    spectrum_plot = SpectrumPlot(logdata.columns[col_idx], args.spectrum_window, args.time_scale)
+    spectrum_plots.append((col_idx, spectrum_plot))
+    merged_plots[frozenset([name + ' spectrum'])] = [(name + ' spectrum', spectrum_plot)]
+
   #
   # Render graphs
   #
@@ -199,6 +353,8 @@ if __name__ == '__main__':
     ax.set_xlim([first_x, last_x])
     ax.text(0.5, 1.0, ", ".join([name for (name, plot) in name_plots]),
             horizontalalignment='center', verticalalignment='top', transform=ax.transAxes)
+    if trigger_x is not None:
+      ax.axvline(trigger_x, color='red', linestyle='--')
     for name, plot in name_plots:
       print(f"working: rendering {name}{' '*(30 - len(name))}", end='\r')  # TODO arbitrary 30-char name "limit"
       plot.render(ax)
@@ -206,4 +362,28 @@ if __name__ == '__main__':
   print(f"finished: rendered {len(merged_plots)} plots{' '*30}")
 
   plt.subplots_adjust(bottom=0.001, left=0.001, top=0.999, right=0.999)  # remove extraneous whitespace around plot
+
+  if args.follow:
+    def follow_update(frame: Any) -> None:
+      new_logdata = follower.read_new()
+      if new_logdata is None:
+        return
+      new_logdata = derived.process(new_logdata).select_range(args.start, args.end)
+      if new_logdata.row_count == 0:
+        return
+      for plot, column in zip(plots, new_logdata.columns):
+        if len(column.x_values):
+          plot.append(column)
+          plot.update_render()
+      for col_idx, spectrum_plot in spectrum_plots:
+        spectrum_plot.append(new_logdata.columns[col_idx])
+        spectrum_plot.update_render()  # only draws when the rows complete a window
+      if args.end is None:
+        for ax in axs:
+          ax.set_xlim([first_x, new_logdata.last_x])
+
+    # redraws are bounded by the animation interval, regardless of how fast rows are appended
+    follow_animation = animation.FuncAnimation(figure, follow_update, interval=args.follow_interval,
+                                               cache_frame_data=False)
+
   plt.show()
@@ -5,26 +5,356 @@ import ast
 from collections import deque
 import csv
 import datetime
+import math
 import sys
+import time
 
-if sys.version_info.major < 3:
-  from Tkinter import *
-  import tkSimpleDialog as simpledialog
-else:
-  from tkinter import *
-  import tkinter.simpledialog as simpledialog
+def parse_args():
+  import argparse
+  parser = argparse.ArgumentParser(description='Telemetry data plotter.')
+
+  parser.add_argument('--hostname', metavar='h', help='network hostname')
+  parser.add_argument('--port', metavar='p', type=int, default=1234, help='network port')
+
+  parser.add_argument('--serial', metavar='s', help='serial port to receive on')
+  parser.add_argument('--baud', metavar='b', type=int, default=38400,
+                      help='serial baud rate')
+  parser.add_argument('--tx_rate', type=float,
+                      help='maximum rate to send set packets to the car at, in bytes/s')
+
+  parser.add_argument('--broker', metavar='path', help='telemetry broker socket path to connect to')
+
+  parser.add_argument('--indep_name', '-i', default='time',
+                      help='internal name of independent axis')
+  parser.add_argument('--span', '-s', type=int, default=10000,
+                      help='independent variable axis span')
+  parser.add_argument('--time_scale', type=float, default=0.001,
+                      help='seconds per unit of the independent variable, used to measure latency, 0 to disable')
+  parser.add_argument('--history_mb', type=float, default=64,
+                      help='megabytes of data older than the span to keep (downsampled with age), which can be '
+                           'scrolled back to by panning or zooming a plot, press End to return to the latest data, '
+                           '0 to disable')
+  parser.add_argument('--derive', '-d', nargs='+', metavar='name=expr', default=[],
+                      help='derived data to compute, plot and log, defined by NumPy expressions over internal names, '
+                           'eg "speed[m/s]=diff(enc)/diff(time)*1000" "line=centroid(cam)"')
+  parser.add_argument('--spectrum', nargs='+', metavar='name', default=[],
+                      help='internal names of numeric data to also plot the spectrogram of')
+  parser.add_argument('--spectrum_window', type=int, default=256,
+                      help='samples per spectrogram window, windows overlap by 75%%')
+  parser.add_argument('--trigger', metavar='condition',
+                      help='capture packets around the condition becoming true to a file, '
+                           'a NumPy expression over internal names like --derive, eg "speed > 2.5" "amax(cam) < 200"')
+  parser.add_argument('--trigger_pre', type=int, default=1000,
+                      help='data packets captured before the trigger')
+  parser.add_argument('--trigger_post', type=int, default=1000,
+                      help='data packets captured from the trigger on')
+  parser.add_argument('--trigger_single', action='store_true',
+                      help='after a capture, freeze the plots and disarm the trigger until space is pressed')
+  parser.add_argument('--capture_prefix', default='capture',
+                      help='filename prefix for trigger captures')
+  parser.add_argument('--log_filename_prefix', '-f', default='telemetry',
+                      help='filename prefix for logging output, set to empty to disable logging')
+  parser.add_argument('--max_fps', type=float, default=30,
+                      help='maximum rendered frames per second')
+  parser.add_argument('--ingest_budget', type=float, default=10,
+                      help='milliseconds per GUI tick to spend processing packets, excess packets are queued')
+  parser.add_argument('--render_budget', type=float, default=0.5,
+                      help='maximum fraction of time spent rendering')
+
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  # before the imports below, so --help and usage errors don't wait for NumPy (or the GUI, imported later)
+  args = parse_args()
 
-from matplotlib import pyplot as plt
-import matplotlib.animation as animation
 import numpy as np
-import serial
 
-from telemetry.parser import TelemetrySerial, TelemetrySocket, DataPacket, HeaderPacket, NumericData, NumericArray
+from telemetry.parser import TelemetrySerial, TelemetrySocket, TelemetryBrokerClient, DataPacket, HeaderPacket, NumericData, NumericArray
+from telemetry.capture import TriggerCapture
+from telemetry.derived import DerivedChannels
+from telemetry.spectrum import SlidingSpectrum
+from telemetry.stats import WindowExtrema, ClockEstimator, latency_percentiles, format_latency_percentiles
+
+# the x axis scrolls in steps of this fraction of the span
+XLIM_STEP_FRACTION = 0.1
+# packets taken from the receive queue at a time, between checks of the ingest deadline
+INGEST_BATCH_PACKETS = 256
+
+class RingBuffer(object):
+  """FIFO of samples backed by a preallocated NumPy array. Each sample is
+  written twice (at i and i + capacity), so the contents are always available
+  as a contiguous view without copying. Capacity doubles when full.
+  """
+  def __init__(self, capacity=1024, shape=(), dtype=np.float64):
+    self.capacity = capacity
+    self.buffer = np.empty((2 * capacity, ) + shape, dtype=dtype)
+    self.start = 0  # buffer index of the oldest sample, in [0, capacity)
+    self.count = 0
+    self.total = 0  # number of samples ever appended
+
+  def __len__(self):
+    return self.count
+
+  def append(self, value):
+    if self.count == self.capacity:
+      self.grow()
+    idx = (self.start + self.count) % self.capacity
+    self.buffer[idx] = value
+    self.buffer[idx + self.capacity] = value
+    self.count += 1
+    self.total += 1
+
+  def extend(self, values):
+    if self.count + len(values) > self.capacity:
+      self.grow(self.count + len(values))
+    idx = (self.start + self.count) % self.capacity
+    first_len = min(len(values), self.capacity - idx)
+    rest_len = len(values) - first_len
+    self.buffer[idx:idx + first_len] = values[:first_len]
+    self.buffer[idx + self.capacity:idx + self.capacity + first_len] = values[:first_len]
+    self.buffer[:rest_len] = values[first_len:]
+    self.buffer[self.capacity:self.capacity + rest_len] = values[first_len:]
+    self.count += len(values)
+    self.total += len(values)
+
+  def set_last(self, value):
+    idx = (self.start + self.count - 1) % self.capacity
+    self.buffer[idx] = value
+    self.buffer[idx + self.capacity] = value
+
+  def popleft(self):
+    self.start = (self.start + 1) % self.capacity
+    self.count -= 1
+
+  def clear(self):
+    self.start = 0
+    self.count = 0
+
+  def grow(self, min_capacity=None):
+    """Doubles the capacity, or until it is at least min_capacity."""
+    contents = self.view()
+    self.capacity *= 2
+    while min_capacity is not None and self.capacity < min_capacity:
+      self.capacity *= 2
+    buffer = np.empty((2 * self.capacity, ) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+    buffer[:self.count] = contents
+    buffer[self.capacity:self.capacity + self.count] = contents
+    self.buffer = buffer
+    self.start = 0
+
+  def first(self):
+    return self.buffer[self.start]
+
+  def last(self):
+    return self.buffer[self.start + self.count - 1]
+
+  def first_index(self):
+    """Returns the sample number (counting all samples ever appended) of the
+    oldest sample.
+    """
+    return self.total - self.count
+
+  def view(self):
+    """Returns a contiguous view of the samples, oldest first. This is only
+    valid until the next append.
+    """
+    return self.buffer[self.start:self.start + self.count]
+
+class MinMaxDecimator(object):
+  """Streaming min/max decimation of a series into fixed-width buckets of the
+  independent variable (like one per pixel column). Each bucket is kept as two
+  points, its minimum and maximum in the order they occurred, so the decimated
+  series draws the same envelope as the raw samples.
+  """
+  def __init__(self, bucket_width, capacity=1024):
+    self.bucket_width = bucket_width
+    self.indep_data = RingBuffer(capacity, shape=(2, ))
+    self.dep_data = RingBuffer(capacity, shape=(2, ))
+
+    # state of the latest bucket
+    self.bucket = None
+    self.lo = None
+    self.hi = None
+    self.lo_first = True
+
+  def __len__(self):
+    return len(self.indep_data)
+
+  def append(self, indep_val, dep_val):
+    bucket = math.floor(indep_val / self.bucket_width)
+    if self.bucket is not None and bucket < self.bucket:  # independent variable reset
+      self.indep_data.clear()
+      self.dep_data.clear()
+      self.bucket = None
+
+    if bucket != self.bucket:
+      self.bucket = bucket
+      self.lo = dep_val
+      self.hi = dep_val
+      self.lo_first = True
+      bucket_center = (bucket + 0.5) * self.bucket_width
+      self.indep_data.append((bucket_center, bucket_center))
+      self.dep_data.append((dep_val, dep_val))
+    else:
+      if dep_val < self.lo:
+        self.lo = dep_val
+        self.lo_first = False
+      elif dep_val > self.hi:
+        self.hi = dep_val
+        self.lo_first = True
+      else:
+        return
+      self.dep_data.set_last((self.lo, self.hi) if self.lo_first else (self.hi, self.lo))
+
+  def append_pair(self, indep_val, dep_pair):
+    """Appends two samples (in order) at the same independent value, like a
+    bucket popped from a finer decimator, with the same result as appending
+    them one at a time.
+    """
+    first, second = dep_pair
+    bucket = math.floor(indep_val / self.bucket_width)
+    if self.bucket is not None and bucket < self.bucket:  # independent variable reset
+      self.indep_data.clear()
+      self.dep_data.clear()
+      self.bucket = None
+
+    if bucket != self.bucket:
+      self.bucket = bucket
+      self.lo = min(first, second)
+      self.hi = max(first, second)
+      self.lo_first = not second < first
+      bucket_center = (bucket + 0.5) * self.bucket_width
+      self.indep_data.append((bucket_center, bucket_center))
+      self.dep_data.append((self.lo, self.hi) if self.lo_first else (self.hi, self.lo))
+    else:
+      # the last sample to set a new extreme decides the order
+      if second < min(self.lo, first):
+        self.lo_first = False
+      elif second > max(self.hi, first):
+        self.lo_first = True
+      elif first < self.lo:
+        self.lo_first = False
+      elif first > self.hi:
+        self.lo_first = True
+      else:
+        return
+      self.lo = min(self.lo, first, second)
+      self.hi = max(self.hi, first, second)
+      self.dep_data.set_last((self.lo, self.hi) if self.lo_first else (self.hi, self.lo))
+
+  def popleft(self):
+    """Removes the oldest bucket, returning its independent and dependent
+    value pairs.
+    """
+    indep = self.indep_data.first().copy()
+    dep = self.dep_data.first().copy()
+    self.indep_data.popleft()
+    self.dep_data.popleft()
+    return indep, dep
+
+  def clear(self):
+    self.indep_data.clear()
+    self.dep_data.clear()
+    self.bucket = None
+
+  def expire(self, indep_cutoff):
+    """Drops buckets entirely before indep_cutoff."""
+    while self.indep_data and self.indep_data.first()[0] + self.bucket_width / 2 < indep_cutoff:
+      self.indep_data.popleft()
+      self.dep_data.popleft()
+
+  def rebuild(self, indep, dep):
+    """Replaces the decimated series with one computed (vectorized) from raw
+    samples, which must have a non-decreasing independent variable.
+    """
+    self.indep_data.clear()
+    self.dep_data.clear()
+    self.bucket = None
+    if not len(indep):
+      return
+
+    buckets = np.floor(indep / self.bucket_width)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(indep))))
+    lo_idx = np.lexsort((dep, segments))[starts]  # index of each bucket's first minimum
+    hi_idx = np.lexsort((-dep, segments))[starts]  # index of each bucket's first maximum
+    lo_first = lo_idx <= hi_idx
+
+    bucket_centers = (buckets[starts] + 0.5) * self.bucket_width
+    self.indep_data.extend(np.stack((bucket_centers, bucket_centers), axis=1))
+    self.dep_data.extend(np.stack((np.where(lo_first, dep[lo_idx], dep[hi_idx]),
+                                   np.where(lo_first, dep[hi_idx], dep[lo_idx])), axis=1))
+
+    self.bucket = int(buckets[-1])
+    self.lo = dep[lo_idx[-1]]
+    self.hi = dep[hi_idx[-1]]
+    self.lo_first = bool(lo_first[-1])
+
+  def get_data(self):
+    """Returns the decimated independent and dependent data, as views valid
+    until the next append.
+    """
+    return self.indep_data.view().ravel(), self.dep_data.view().ravel()
+
+class TieredHistory(object):
+  """Min/max decimated history of a series, for scrolling back past the plot
+  span within a fixed memory budget. Samples (oldest first) go into the finest
+  tier, and each tier's oldest buckets are merged into the next tier (with
+  TIER_FACTOR times wider buckets) once it holds its share of the budget, so
+  resolution decreases with age. The coarsest tier drops its oldest buckets.
+  Tiers cover consecutive, non-overlapping ranges of the independent variable.
+  """
+  NUM_TIERS = 4
+  TIER_FACTOR = 8
+  # two (independent, dependent) float64 pairs per bucket, stored twice by RingBuffer
+  BUCKET_BYTES = 64
+
+  def __init__(self, bucket_width, memory_budget):
+    self.capacity = max(2, int(memory_budget // (self.NUM_TIERS * self.BUCKET_BYTES)))
+    # preallocated (capacity + 1 as each tier briefly overfills), so the buffers never grow
+    self.tiers = [MinMaxDecimator(bucket_width * self.TIER_FACTOR ** i, self.capacity + 1)
+                  for i in range(self.NUM_TIERS)]
+
+  def append(self, indep_val, dep_val):
+    self.tiers[0].append(indep_val, dep_val)
+    for i, tier in enumerate(self.tiers):
+      if len(tier) <= self.capacity:
+        break
+      indep, dep = tier.popleft()
+      if i + 1 < len(self.tiers):
+        self.tiers[i + 1].append_pair(indep[0], dep)  # both points are at the bucket center
+
+  def clear(self):
+    for tier in self.tiers:
+      tier.clear()
+
+  def get_data(self, start, end, before=None):
+    """Returns lists of independent and dependent arrays (oldest first) of the
+    history between start and end (with a bucket of margin on each side), and
+    before the independent value before, if not None. Since merged buckets are
+    recentered, each tier is also cut off before the next finer tier starts.
+    """
+    indep_parts, dep_parts = [], []
+    for tier in self.tiers:
+      indep, dep = tier.get_data()
+      lo = max(0, np.searchsorted(indep, start, side='left') - 2)
+      hi = np.searchsorted(indep, end, side='right') + 2
+      if before is not None:
+        hi = min(hi, np.searchsorted(indep, before, side='left'))
+      if lo < min(hi, len(indep)):
+        indep_parts.insert(0, indep[lo:hi])
+        dep_parts.insert(0, dep[lo:hi])
+      if len(indep):
+        before = indep[0] if before is None else min(before, indep[0])
+    return indep_parts, dep_parts
 
 class BasePlot(object):
   """Base class / interface definition for telemetry plotter plots with a
   dependent variable vs. an scrolling independent variable (like time).
   """
+  # whether set_history_budget keeps history, so the plot gets a share of the budget
+  KEEPS_HISTORY = False
+
   def __init__(self, subplot, indep_def, dep_def, indep_span):
     """Constructor.
 
@@ -50,12 +380,44 @@ class BasePlot(object):
   def update_from_packet(self, packet):
     """Updates my internal data structures from a received packet. Should not do
     rendering - this may be called multiple times per visible update.
+
+    Returns True if the packet contained my data, so I need to be re-rendered.
+    """
+    assert isinstance(packet, DataPacket)
+    indep_val = packet.get_data_by_id(self.indep_id)
+    dep_val = packet.get_data_by_id(self.dep_id)
+    if indep_val is None or dep_val is None:
+      return False
+    return self.update_from_values(indep_val, dep_val)
+
+  def update_from_values(self, indep_val, dep_val):
+    """Like update_from_packet, but with the independent and dependent values
+    already extracted from the packet.
     """
     raise NotImplementedError
 
-  def update_show(self, packet):
+  def update_show(self, view=None):
     """Render my data. This is separated from update_from_packet to allow
     multiple packets to be processed while doing only one time-consuming render.
+
+    Arguments:
+    view -- independent variable limits the plot was scrolled back to, or None
+      when following the latest data.
+
+    Returns True if the axes limits changed, which requires the static
+    background (axes, ticks) to be redrawn.
+    """
+    raise NotImplementedError
+
+  def set_history_budget(self, memory_budget):
+    """Keeps data older than the span, in up to memory_budget bytes, for
+    scrolling back. Plots without history ignore this.
+    """
+    pass
+
+  def get_artists(self):
+    """Returns the matplotlib artists that draw my data, which are redrawn
+    every frame on top of the static background.
     """
     raise NotImplementedError
 
@@ -67,106 +429,436 @@ class BasePlot(object):
 
 class NumericPlot(BasePlot):
   """A plot of a single numeric dependent variable vs. a single independent
-  variable
+  variable. Once the window holds several samples per pixel column, a min/max
+  decimated series is drawn instead of the raw samples.
   """
+  # decimate once the raw samples outnumber the decimated points by this ratio
+  DECIMATE_RATIO = 2
+  # width of the finest history buckets, as a fraction of the span
+  HISTORY_BUCKETS_PER_SPAN = 1000
+  KEEPS_HISTORY = True
+
   def __init__(self, subplot, indep_def, dep_def, indep_span):
     super(NumericPlot, self).__init__(subplot, indep_def, dep_def, indep_span)
     self.line, = subplot.plot([0])
-
-    self.indep_data = deque()
-    self.dep_data = deque()
-
-  def update_from_packet(self, packet):
-    assert isinstance(packet, DataPacket)
-    indep_val = packet.get_data_by_id(self.indep_id)
-    dep_val = packet.get_data_by_id(self.dep_id)
-
-    if indep_val is not None and dep_val is not None:
-      self.indep_data.append(indep_val)
-      self.dep_data.append(dep_val)
-
-      indep_cutoff = indep_val - self.indep_span
-
-      while self.indep_data[0] < indep_cutoff or self.indep_data[0] > indep_val:
-        self.indep_data.popleft()
-        self.dep_data.popleft()
-
-  def update_show(self):
-      self.line.set_xdata(self.indep_data)
-      self.line.set_ydata(self.dep_data)
-
-      if self.limits is not None:
-        minlim = self.limits[0]
-        maxlim = self.limits[1]
+    if self.limits is not None:
+      subplot.set_ylim(*self.padded_limits(self.limits[0], self.limits[1]))
+
+    self.indep_data = RingBuffer()
+    self.dep_data = RingBuffer()
+    self.dep_extrema = WindowExtrema()
+    self.decimator = None  # created on render, once the plot width is known
+    self.decimator_width = None
+    self.history = None  # of samples expired from the span
+    self.shown_view = None  # scrolled back view currently drawn
+
+  def update_from_values(self, indep_val, dep_val):
+    self.indep_data.append(indep_val)
+    self.dep_data.append(dep_val)
+    if math.isfinite(dep_val):  # derived data can be NaN or infinite, which would break autoscaling
+      self.dep_extrema.append(self.dep_data.total - 1, dep_val)
+
+    indep_cutoff = indep_val - self.indep_span
+
+    while self.indep_data.first() < indep_cutoff or self.indep_data.first() > indep_val:
+      if self.history is not None:
+        if self.indep_data.first() > indep_val:  # independent variable reset
+          self.history.clear()
+        elif math.isfinite(self.dep_data.first()):
+          self.history.append(self.indep_data.first(), self.dep_data.first())
+      self.indep_data.popleft()
+      self.dep_data.popleft()
+    self.dep_extrema.expire(self.dep_data.first_index())
+    if self.decimator is not None:
+      self.decimator.append(indep_val, dep_val)
+      self.decimator.expire(self.indep_data.first())
+    return True
+
+  def set_history_budget(self, memory_budget):
+    if memory_budget > 0:
+      self.history = TieredHistory(self.indep_span / self.HISTORY_BUCKETS_PER_SPAN, memory_budget)
+
+  @staticmethod
+  def padded_limits(minlim, maxlim):
+    rangelim = maxlim - minlim
+    return (minlim - rangelim / 20,  # TODO make variable padding
+            maxlim + rangelim / 20)
+
+  def update_show(self, view=None):
+      if view is not None:
+        return self.show_view(view)
+      self.shown_view = None
+
+      width = int(self.subplot.bbox.width)
+      if width != self.decimator_width and width > 0:  # (re)build for the current plot width
+        self.decimator_width = width
+        self.decimator = MinMaxDecimator(self.indep_span / width)
+        self.decimator.rebuild(self.indep_data.view(), self.dep_data.view())
+
+      if self.decimator is not None and \
+          len(self.dep_data) > 2 * len(self.decimator) * self.DECIMATE_RATIO:
+        self.line.set_data(*self.decimator.get_data())
       else:
-        if not self.dep_data:
-          return
-        minlim = min(self.dep_data)
-        maxlim = max(self.dep_data)
-        if minlim < 0 and maxlim < 0:
-          maxlim = 0
-        elif minlim > 0 and maxlim > 0:
-          minlim = 0
-      rangelim = maxlim - minlim
-      minlim -= rangelim / 20 # TODO make variable padding
-      maxlim += rangelim / 20
-      self.subplot.set_ylim(minlim, maxlim)
+        self.line.set_data(self.indep_data.view(), self.dep_data.view())
+
+      if self.limits is not None or not self.dep_data:
+        return False
+
+      minlim = self.dep_extrema.get_min()
+      maxlim = self.dep_extrema.get_max()
+      if minlim is None:
+        return False
+      if minlim < 0 and maxlim < 0:
+        maxlim = 0
+      elif minlim > 0 and maxlim > 0:
+        minlim = 0
+      if minlim == maxlim:
+        return False
+
+      # only change limits (and invalidate the background) when the data leaves
+      # them, or when the data range shrinks to much less than them
+      cur_minlim, cur_maxlim = self.subplot.get_ylim()
+      if cur_minlim <= minlim and maxlim <= cur_maxlim and \
+          (maxlim - minlim) * 2 > cur_maxlim - cur_minlim:
+        return False
+      self.subplot.set_ylim(*self.padded_limits(minlim, maxlim))
+      return True
+
+  def show_view(self, view):
+    """Draws the history and span data within a scrolled back view, decimated
+    to the plot width, autoscaled to the visible data.
+    """
+    if view == self.shown_view:
+      return False
+    self.shown_view = view
+    start, end = view
+
+    indep = self.indep_data.view()
+    if self.history is not None:
+      indep_parts, dep_parts = self.history.get_data(start, end, indep[0] if len(indep) else None)
+    else:
+      indep_parts, dep_parts = [], []
+    lo = max(0, np.searchsorted(indep, start, side='left') - 1)
+    hi = np.searchsorted(indep, end, side='right') + 1
+    indep_parts.append(indep[lo:hi])
+    dep_parts.append(self.dep_data.view()[lo:hi])
+    indep = np.concatenate(indep_parts)
+    dep = np.concatenate(dep_parts)
+
+    width = int(self.subplot.bbox.width)
+    if width > 0 and len(indep) > 2 * width * self.DECIMATE_RATIO:
+      decimator = MinMaxDecimator((end - start) / width)
+      decimator.rebuild(indep, dep)
+      indep, dep = decimator.get_data()
+    self.line.set_data(indep, dep)
+
+    visible = dep[np.isfinite(dep) & (indep >= start) & (indep <= end)]
+    if self.limits is not None or not len(visible):
+      return False
+    minlim, maxlim = float(visible.min()), float(visible.max())
+    if minlim == maxlim:
+      return False
+    self.subplot.set_ylim(*self.padded_limits(minlim, maxlim))
+    return True
+
+  def get_artists(self):
+    return [self.line]
+
+def fencepost_edges(centers):
+  """Returns the edges (one more than the centers) of cells around each
+  center, which must be increasing, for pcolor-style images.
+  """
+  edges = np.empty(len(centers) + 1)
+  if len(centers) == 1:  # fencepost with arbitrary size of unit 1
+    edges[0] = centers[0] - 0.5
+    edges[1] = centers[0] + 0.5
+  else:
+    edges[1:-1] = (centers[1:] + centers[:-1]) / 2
+    edges[0] = centers[0] - (centers[1] - centers[0]) / 2
+    edges[-1] = centers[-1] + (centers[-1] - centers[-2]) / 2
+  return edges
 
 class WaterfallPlot(BasePlot):
+  # number of samples used to estimate the sample rate, to size the buffers for the span
+  SIZING_SAMPLES = 16
+
   def __init__(self, subplot, indep_def, dep_def, indep_span):
     super(WaterfallPlot, self).__init__(subplot, indep_def, dep_def, indep_span)
     self.count = dep_def.count
 
-    self.x_mesh = [0] * (self.count + 1)
-    self.x_mesh = np.array([self.x_mesh])
+    self.indep_data = RingBuffer()
+    self.dep_data = RingBuffer(shape=(self.count, ))
+    self.sized = False
 
-    self.y_array = range(0, self.count + 1)
-    self.y_array = list(map(lambda x: x - 0.5, self.y_array))
-    self.y_mesh = np.array([self.y_array])
+    self.y_edges = np.arange(self.count + 1) - 0.5
+    self.image = None
 
-    self.data_array = None
-    self.indep_data = deque()
-    self.quad = None
+    subplot.set_ylim(self.y_edges[0], self.y_edges[-1])
 
-  def update_from_packet(self, packet):
-    assert isinstance(packet, DataPacket)
-    indep_val = packet.get_data_by_id(self.indep_id)
-    dep_val = packet.get_data_by_id(self.dep_id)
+  def update_from_values(self, indep_val, dep_val):
+    self.indep_data.append(indep_val)
+    self.dep_data.append(dep_val)
 
-    if indep_val is not None and dep_val is not None:
-      self.x_mesh = np.vstack([self.x_mesh, np.array([[indep_val] * (self.count + 1)])])
-      self.y_mesh = np.vstack([self.y_mesh, np.array(self.y_array)])
-      if self.data_array is None:
-        self.data_array = np.array([dep_val])
-      else:
-        self.data_array = np.vstack([self.data_array, dep_val])
+    indep_cutoff = indep_val - self.indep_span
 
-      indep_cutoff = indep_val - self.indep_span
+    while self.indep_data.first() < indep_cutoff or self.indep_data.first() > indep_val:
+      self.indep_data.popleft()
+      self.dep_data.popleft()
 
-      while self.x_mesh[0][0] < indep_cutoff or self.x_mesh[0][0] > indep_val:
-        self.x_mesh = np.delete(self.x_mesh, (0), axis=0)
-        self.y_mesh = np.delete(self.y_mesh, (0), axis=0)
-        self.data_array = np.delete(self.data_array, (0), axis=0)
+    if not self.sized and len(self.indep_data) >= self.SIZING_SAMPLES:
+      self.size_buffers()
+    return True
 
-  def update_show(self):
-    if self.quad is not None:
-      self.quad.remove()
-      del self.quad
+  def size_buffers(self):
+    """Grows the buffers to fit the span at the sample rate seen so far (with
+    some margin), so they don't need to be repeatedly regrown while filling.
+    """
+    self.sized = True
+    indep = self.indep_data.view()
+    interval = (indep[-1] - indep[0]) / (len(indep) - 1)
+    if interval > 0:
+      span_samples = int(self.indep_span / interval * 1.25) + 1
+      if span_samples > self.indep_data.capacity:
+        self.indep_data.grow(span_samples)
+        self.dep_data.grow(span_samples)
+
+  def update_show(self, view=None):
+    if not self.indep_data:
+      return False
+
+    x_edges = fencepost_edges(self.indep_data.view())
+
+    if self.image is None:
+      from matplotlib.image import PcolorImage  # deferred like the other GUI imports
+      self.image = PcolorImage(self.subplot, x_edges, self.y_edges, self.dep_data.view().T,
+                               cmap='gray')
+      if self.limits is not None:
+        self.image.set_clim(self.limits[0], self.limits[1])
+      self.subplot.add_image(self.image)
+    else:
+      self.image.set_data(x_edges, self.y_edges, self.dep_data.view().T)
+    if self.limits is None:
+      self.image.autoscale()
+    return False
+
+  def get_artists(self):
+    if self.image is None:
+      return []
+    return [self.image]
+
+class SpectrumPlot(BasePlot):
+  """A scrolling spectrogram of a single numeric dependent variable: the
+  magnitude spectrum (in dB) of overlapping windows of samples, drawn like a
+  WaterfallPlot with frequency on the vertical axis. Samples are buffered and
+  transformed on render, only for the windows completed since the last render.
+  Frequencies assume evenly spaced samples, with the spacing estimated from the
+  independent variable over the first window.
+  """
+  def __init__(self, subplot, indep_def, dep_def, indep_span, window_length=256, time_scale=0):
+    super(SpectrumPlot, self).__init__(subplot, indep_def, dep_def, indep_span)
+    self.limits = None  # the data limits are for values, not magnitudes
+    self.time_scale = time_scale
+
+    self.spectrum = SlidingSpectrum(window_length)
+    self.pending_indep = []  # samples not yet transformed
+    self.pending_dep = []
+    self.first_indep = None  # of the first sample, to estimate the sample spacing
+
+    self.indep_data = RingBuffer()  # of the last sample of each window
+    self.spectra = RingBuffer(shape=(self.spectrum.get_bins(), ))
+    self.y_edges = None  # frequency bin edges, once the sample spacing is known
+    self.image = None
+
+    subplot.set_ylabel("Hz" if time_scale else "cycles / %s" % indep_def.internal_name)
+
+  def reset(self):
+    self.spectrum.reset()
+    self.pending_indep = []
+    self.pending_dep = []
+    self.first_indep = None
+    self.indep_data.clear()
+    self.spectra.clear()
+
+  def update_from_values(self, indep_val, dep_val):
+    if not math.isfinite(dep_val):
+      return False
+    last_indep = self.pending_indep[-1] if self.pending_indep else \
+        (self.indep_data.last() if self.indep_data else None)
+    if last_indep is not None and indep_val < last_indep:  # independent variable reset
+      self.reset()
+    if self.first_indep is None:
+      self.first_indep = indep_val
+    self.pending_indep.append(indep_val)
+    self.pending_dep.append(dep_val)
+    return len(self.pending_dep) >= self.spectrum.until_frame
+
+  def update_show(self, view=None):
+    limits_changed = False
+    if self.pending_dep:
+      ends, spectra = self.spectrum.extend(self.pending_dep)
+      if len(ends):
+        indep = np.array(self.pending_indep)
+        if self.y_edges is None:
+          sample_interval = (indep[ends[0]] - self.first_indep) / (self.spectrum.window_length - 1)
+          if sample_interval <= 0:
+            sample_interval = 1
+          if self.time_scale:
+            sample_interval *= self.time_scale
+          self.y_edges = self.spectrum.get_frequency_edges(sample_interval)
+          self.subplot.set_ylim(self.y_edges[0], self.y_edges[-1])
+          limits_changed = True
+        self.indep_data.extend(indep[ends])
+        self.spectra.extend(spectra)
+        indep_cutoff = indep[ends[-1]] - self.indep_span
+        while self.indep_data.first() < indep_cutoff:
+          self.indep_data.popleft()
+          self.spectra.popleft()
+      self.pending_indep = []
+      self.pending_dep = []
+
+    if not self.indep_data:
+      return limits_changed
+    x_edges = fencepost_edges(self.indep_data.view())
+    if self.image is None:
+      from matplotlib.image import PcolorImage  # deferred like the other GUI imports
+      self.image = PcolorImage(self.subplot, x_edges, self.y_edges, self.spectra.view().T, cmap='gray')
+      self.subplot.add_image(self.image)
+    else:
+      self.image.set_data(x_edges, self.y_edges, self.spectra.view().T)
+    self.image.autoscale()
+    return limits_changed
+
+  def get_artists(self):
+    if self.image is None:
+      return []
+    return [self.image]
+
+class BlitRenderer(object):
+  """Draws a figure by blitting: the static parts (axes, titles, ticks) are
+  drawn once and cached as a background, and each frame only restores the
+  background and redraws the data artists. The background is redrawn on any
+  full draw (like a window resize), or when invalidated (like when limits change).
+  """
+  def __init__(self, figure):
+    self.figure = figure
+    self.canvas = figure.canvas
+    self.background = None
+    self.artists = []
+    self.canvas.mpl_connect('draw_event', self.on_draw)
+
+  def on_draw(self, event):
+    self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+    self.draw_artists()
+
+  def draw_artists(self):
+    for artist in self.artists:
+      self.figure.draw_artist(artist)
+
+  def invalidate(self):
+    self.background = None
+
+  def render(self, artists):
+    """Renders a frame with the specified data artists, which are excluded from
+    the background.
+    """
+    for artist in artists:
+      artist.set_animated(True)
+    self.artists = artists
 
-    if self.limits is not None:
-      self.quad = self.subplot.pcolorfast(self.x_mesh, self.y_mesh, self.data_array,
-          cmap='gray', vmin=self.limits[0], vmax=self.limits[1],
-          interpolation='None')
+    if self.background is None:
+      self.canvas.draw()  # caches the background in on_draw
     else:
-      self.quad = self.subplot.pcolorfast(self.x_mesh, self.y_mesh, self.data_array,
-          cmap='gray', interpolation='None')
+      self.canvas.restore_region(self.background)
+      self.draw_artists()
+      self.canvas.blit(self.figure.bbox)
+
+class RenderScheduler(object):
+  """Schedules the work in each GUI timer tick, so bursty input can't freeze
+  the GUI. Packets are ingested only until the ingest budget (in seconds) is
+  spent, leaving the rest queued for the next tick. Rendering is limited to the
+  render budget (as a fraction of wall time) and the maximum frame rate, and
+  is deferred while packets are backlogged. A frame is counted as dropped for
+  each frame deadline that passes with changed data left undrawn.
+  """
+  # even when backlogged, render at least this often (in seconds)
+  MAX_FRAME_INTERVAL = 0.5
+
+  def __init__(self, ingest_budget, render_budget, max_fps):
+    self.ingest_budget = ingest_budget
+    self.render_budget = render_budget
+    self.min_frame_interval = 1.0 / max_fps
+
+    self.last_render_time = 0
+    self.next_render_time = 0
+
+    # statistics, over each stats interval
+    self.stats_start_time = time.perf_counter()
+    self.stats_frames = 0
+    self.dropped_frames = 0
+
+  def ingest_deadline(self):
+    return time.perf_counter() + self.ingest_budget
+
+  def should_render(self, backlogged):
+    """Returns whether to render a frame (with changed data) now. Deferring a
+    frame past its deadline because of a backlog counts it as dropped.
+    """
+    now = time.perf_counter()
+    if now < self.next_render_time:
+      return False  # frame rate and render budget limits
+    if backlogged and now < self.last_render_time + self.MAX_FRAME_INTERVAL:
+      missed = int((now - self.next_render_time) / self.min_frame_interval) + 1
+      self.dropped_frames += missed
+      self.next_render_time += missed * self.min_frame_interval
+      return False
+    return True
+
+  def rendered(self, start_time):
+    """Records a frame rendered starting at start_time, scheduling the next
+    frame to keep within the render budget.
+    """
+    now = time.perf_counter()
+    render_time = now - start_time
+    self.last_render_time = now
+    self.next_render_time = start_time + max(self.min_frame_interval, render_time / self.render_budget)
+    self.stats_frames += 1
+
+  def get_stats(self, oldest_rx_time, backlog):
+    """Returns a status string and resets the statistics interval. The ingest
+    lag is the age of the oldest received packet not yet rendered, from its
+    host receive time oldest_rx_time (None if there is none).
+    """
+    now = time.perf_counter()
+    interval = now - self.stats_start_time
+    fps = self.stats_frames / interval
+    dropped_fps = self.dropped_frames / interval
+    self.stats_start_time = now
+    self.stats_frames = 0
+    self.dropped_frames = 0
+    ingest_lag = time.monotonic() - oldest_rx_time if oldest_rx_time is not None else 0
+    return "%.1f fps, %.1f frames/s dropped; ingest lag %.0f ms (%i packets queued)" % (
+        fps, dropped_fps, ingest_lag * 1000, backlog)
 
 plot_registry = {}
 plot_registry[NumericData] = NumericPlot
 plot_registry[NumericArray] = WaterfallPlot
 
+# plots added for data with spectra requested
+spectrum_plot_registry = {}
+spectrum_plot_registry[NumericData] = SpectrumPlot
+
+def get_plot_class(data_def, registry=plot_registry):
+  """Returns the registered plot class for a TelemetryData, or for its nearest
+  registered base class (like for derived data), or None.
+  """
+  for data_cls in data_def.__class__.__mro__:
+    if data_cls in registry:
+      return registry[data_cls]
+  return None
+
 
-def subplots_from_header(packet, figure, indep_def, indep_span=10000):
+def subplots_from_header(packet, figure, indep_def, indep_span=10000, spectrum_names=(), spectrum_window=256,
+                         time_scale=0, history_budget=0):
   """Instantiate subplots and plots from a received telemetry HeaderPacket.
   The default implementation creates a new plot for each dependent variable,
   but you can customize it to do better things.
@@ -176,38 +868,60 @@ def subplots_from_header(packet, figure, indep_def, indep_span=10000):
   figure -- matplotlib figure to draw on
   indep_name -- internal_name of the independent variable.
   indep_span -- span of the independent variable to display.
-
-  Returns: a dict of matplotlib subpolots to list of contained BasePLot objects.
+  spectrum_names -- internal names of data to also plot the spectrum of, below the data.
+  spectrum_window -- samples per spectrum window.
+  time_scale -- seconds per unit of the independent variable, for spectrum frequencies, 0 if unknown.
+  history_budget -- bytes of history older than the span to keep, split between the plots that keep history.
+
+  Returns: a tuple of a dict of matplotlib subplots to list of contained
+  BasePlot objects, and a dispatch dict of dependent data ID to list of BasePlot
+  objects plotting it.
   """
   assert isinstance(packet, HeaderPacket)
 
   if indep_def is None:
     print("No independent variable")
-    return [], []
+    return {}, {}
 
-  data_defs = []
+  subplot_defs = []  # of (data_def, plot class, extra plot arguments, title), bottom first
   for _, data_def in reversed(sorted(packet.get_data_defs().items())):
-    if data_def != indep_def:
-      data_defs.append(data_def)
+    if data_def == indep_def:
+      continue
+    title = "%s: %s (%s)" % (data_def.internal_name, data_def.display_name, data_def.units)
+    if data_def.internal_name in spectrum_names:
+      spectrum_cls = get_plot_class(data_def, spectrum_plot_registry)
+      if spectrum_cls is None:
+        print("Unable to plot spectrum of %s" % data_def.internal_name)
+      else:
+        subplot_defs.append((data_def, spectrum_cls, (spectrum_window, time_scale),
+                             "%s spectrum" % data_def.internal_name))
+    plot_cls = get_plot_class(data_def)
+    assert plot_cls is not None, "Unable to handle TelemetryData type %s" % data_def.__class__.__name__
+    subplot_defs.append((data_def, plot_cls, (), title))
 
   plots_dict = {}
+  history_plots = sum(1 for _, plot_cls, _, _ in subplot_defs if plot_cls.KEEPS_HISTORY)
 
-  for plot_idx, data_def in enumerate(data_defs):
-    ax = figure.add_subplot(len(data_defs), 1, len(data_defs)-plot_idx)
-    ax.set_title("%s: %s (%s)"
-        % (data_def.internal_name, data_def.display_name, data_def.units))
+  for plot_idx, (data_def, plot_cls, plot_args, title) in enumerate(subplot_defs):
+    ax = figure.add_subplot(len(subplot_defs), 1, len(subplot_defs)-plot_idx)
+    ax.set_title(title)
     if plot_idx != 0:
-      plt.setp(ax.get_xticklabels(), visible=False)
+      ax.tick_params(labelbottom=False)
 
-    assert data_def.__class__ in plot_registry, "Unable to handle TelemetryData type %s" % data_def.__class__.__name__
-    plot = plot_registry[data_def.__class__](ax, indep_def, data_def,
-                                             indep_span)
+    plot = plot_cls(ax, indep_def, data_def, indep_span, *plot_args)
+    if plot_cls.KEEPS_HISTORY:
+      plot.set_history_budget(history_budget / history_plots)
     plots_dict[ax] = [plot]
 
     print("Found dependent data %s" % data_def.internal_name)
 
+  dispatch_dict = {}
+  for plot_list in plots_dict.values():
+    for plot in plot_list:
+      dispatch_dict.setdefault(plot.get_dep_def().data_id, []).append(plot)
+
   print("Parsed header")
-  return plots_dict
+  return plots_dict, dispatch_dict
 
 class CsvLogger(object):
   def __init__(self, name, header_packet):
@@ -255,90 +969,141 @@ class CsvLogger(object):
     self.csv_file.close()
 
 if __name__ == "__main__":
-  import argparse
-  parser = argparse.ArgumentParser(description='Telemetry data plotter.')
-
-  parser.add_argument('--hostname', metavar='h', help='network hostname')
-  parser.add_argument('--port', metavar='p', help='network port', default=1234)
-
-  parser.add_argument('--serial', metavar='s', help='serial port to receive on')
-  parser.add_argument('--baud', metavar='b', type=int, default=38400,
-                      help='serial baud rate')
-
-  parser.add_argument('--indep_name', '-i', default='time',
-                      help='internal name of independent axis')
-  parser.add_argument('--span', '-s', type=int, default=10000,
-                      help='independent variable axis span')
-  parser.add_argument('--log_filename_prefix', '-f', default='telemetry',
-                      help='filename prefix for logging output, set to empty to disable logging')
-
-  args = parser.parse_args()
-
+  # the GUI toolkits are only imported once the arguments are good, so --help and usage errors are quick
+  if sys.version_info.major < 3:
+    from Tkinter import Menu
+    import tkSimpleDialog as simpledialog
+  else:
+    from tkinter import Menu
+    import tkinter.simpledialog as simpledialog
+  from matplotlib import pyplot as plt
 
   telemetry = None
   if args.serial is not None:
     assert telemetry is None, "multiple comms methods defined in arguments"
-    telemetry = TelemetrySerial(serial.Serial(args.serial, baudrate=args.baud))
+    telemetry = TelemetrySerial.open(args.serial, args.baud, args.tx_rate)
     print(f"Opened serial port on {args.serial}: {args.baud}")
   if args.hostname is not None:
     assert telemetry is None, "multiple comms methods defined in arguments"
-    telemetry = TelemetrySocket(args.hostname, args.port)
+    telemetry = TelemetrySocket(args.hostname, args.port, args.tx_rate)
     print(f"Opened network socket on {args.hostname}: {args.port}")
+  if args.broker is not None:
+    assert telemetry is None, "multiple comms methods defined in arguments"
+    telemetry = TelemetryBrokerClient(args.broker)
+    print(f"Connected to broker on {args.broker}")
+
+  derived = DerivedChannels(args.derive) if args.derive else None
+  trigger = None
+  if args.trigger is not None:
+    trigger = TriggerCapture(args.trigger, args.trigger_pre, args.trigger_post, args.capture_prefix,
+                             args.trigger_single)
 
   fig = plt.figure()
 
   # note: mutable elements are in lists to allow access from nested functions
   indep_def = [None]  # note: data ID 0 is invalid
   latest_indep = [0]
-  plots_dict = [[]]
+  latest_rx_time = [None]  # host receive time of the packet with latest_indep
+  plots_dict = [{}]
+  dispatch_dict = [{}]
 
   csv_logger = [None]
+  frozen = [False]  # whether plots are frozen on a single-shot trigger capture
 
-  def update(data):
-    telemetry.process_rx()
-    plot_updated = False
+  renderer = BlitRenderer(fig)
 
-    while True:
-      packet = telemetry.next_rx_packet()
-      if not packet:
-        break
+  def stepped_xlim(latest):
+    """Returns the x limits to show latest in, which step in coarse increments
+    so the background doesn't need to be redrawn every frame.
+    """
+    step = args.span * XLIM_STEP_FRACTION
+    right = math.ceil(latest / step) * step
+    return (right - args.span, right)
 
-      if isinstance(packet, HeaderPacket):
-        fig.clf()
-
-        # get independent variable data ID
-        indep_def[0] = None
-        for _, data_def in packet.get_data_defs().items():
-          if data_def.internal_name == args.indep_name:
-            indep_def[0] = data_def
-        # TODO warn on missing indep id or duplicates
-
-        # instantiate plots
-        plots_dict[0] = subplots_from_header(packet, fig, indep_def[0], args.span)
-
-        # prepare CSV file and headers
-        timestring = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-        filename = '%s-%s.csv' %  (args.log_filename_prefix, timestring)
-        if csv_logger[0] is not None:
-          csv_logger[0].finish()
-        if args.log_filename_prefix:
-          csv_logger[0] = CsvLogger(filename, packet)
-
-      elif isinstance(packet, DataPacket):
-        if indep_def[0] is not None:
-          indep_value = packet.get_data_by_id(indep_def[0].data_id)
-          if indep_value is not None:
-            latest_indep[0] = indep_value
-            for plot_list in plots_dict[0].values():
-              for plot in plot_list:
-                plot.update_from_packet(packet)
-            plot_updated = True
+  scheduler = RenderScheduler(args.ingest_budget / 1000, args.render_budget, args.max_fps)
+  dirty_plots = set()  # plots with data changed since the last render
+  oldest_unrendered_rx_time = [None]  # host receive time of the oldest ingested packet not yet rendered
+  followed_xlims = {}  # subplot -> x limits last set to follow the latest data
 
-        if csv_logger[0]:
-          csv_logger[0].write_data(packet)
+  clock = ClockEstimator(args.time_scale) if args.time_scale > 0 else None
+  display_lags = deque(maxlen=100)  # time from receiving the newest plotted packet to it being drawn
 
-      else:
-        raise Exception("Unknown received packet %s" % repr(packet))
+  def update():
+    telemetry.process_rx()
+
+    ingest_deadline = scheduler.ingest_deadline()
+    while time.perf_counter() < ingest_deadline:
+      packets = []
+      while len(packets) < INGEST_BATCH_PACKETS:
+        packet = telemetry.next_rx_packet()
+        if not packet:
+          break
+        packets.append(packet)
+      if not packets:
+        break
+      if derived is not None:
+        derived.process(packets)  # one vectorized evaluation per batch
+      if trigger is not None:
+        for filename in trigger.process(packets):
+          print("Triggered, saved capture to %s" % filename)
+          if args.trigger_single:
+            frozen[0] = True
+            print("Display frozen, press space to re-arm the trigger and resume")
+
+      for packet in packets:
+        if isinstance(packet, HeaderPacket):
+          fig.clf()
+          renderer.invalidate()
+          dirty_plots.clear()
+          oldest_unrendered_rx_time[0] = None
+
+          # get independent variable data ID
+          indep_def[0] = None
+          for _, data_def in packet.get_data_defs().items():
+            if data_def.internal_name == args.indep_name:
+              indep_def[0] = data_def
+          # TODO warn on missing indep id or duplicates
+          if clock is not None:
+            clock.reset()
+
+          # instantiate plots
+          plots_dict[0], dispatch_dict[0] = subplots_from_header(packet, fig, indep_def[0], args.span,
+                                                                 args.spectrum, args.spectrum_window,
+                                                                 args.time_scale, args.history_mb * 1e6)
+          followed_xlims.clear()
+          for ax, plot_list in plots_dict[0].items():
+            # redraw scrolled back plots when panned or zoomed
+            ax.callbacks.connect('xlim_changed', lambda ax, plot_list=plot_list: dirty_plots.update(plot_list))
+
+          # prepare CSV file and headers
+          timestring = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+          filename = '%s-%s.csv' %  (args.log_filename_prefix, timestring)
+          if csv_logger[0] is not None:
+            csv_logger[0].finish()
+          if args.log_filename_prefix:
+            csv_logger[0] = CsvLogger(filename, packet)
+
+        elif isinstance(packet, DataPacket):
+          if indep_def[0] is not None:
+            indep_value = packet.get_data_by_id(indep_def[0].data_id)
+            if indep_value is not None and clock is not None:
+              clock.add(indep_value, packet.rx_time)
+            if indep_value is not None and not frozen[0]:
+              latest_indep[0] = indep_value
+              latest_rx_time[0] = packet.rx_time
+              for data_id, data_value in packet.get_data_dict().items():
+                for plot in dispatch_dict[0].get(data_id, ()):
+                  if plot.update_from_values(indep_value, data_value):
+                    dirty_plots.add(plot)
+              if dirty_plots and oldest_unrendered_rx_time[0] is None:
+                oldest_unrendered_rx_time[0] = packet.rx_time
+
+          if csv_logger[0]:
+            csv_logger[0].write_data(packet)
+
+        else:
+          raise Exception("Unknown received packet %s" % repr(packet))
+    backlog = len(telemetry.rx_packets)
 
     while True:
       next_byte = telemetry.next_rx_byte()
@@ -347,16 +1112,51 @@ if __name__ == "__main__":
       try:
         print(next_byte, end='')
         if csv_logger[0]:
-          csv_logger[0].add_char(chr(next_byte))
+          csv_logger[0].add_char(next_byte)
       except UnicodeEncodeError:
         pass
 
-    if plot_updated:
-      for plot_list in plots_dict[0].values():
+    if dirty_plots and scheduler.should_render(backlog > 0):
+      render_start = time.perf_counter()
+      artists = []
+      xlim = stepped_xlim(latest_indep[0])
+      for subplot, plot_list in plots_dict[0].items():
+        # plots panned or zoomed away from the latest data stay there, until panned back to it
+        view = subplot.get_xlim()
+        following = view == followed_xlims.get(subplot, view) or \
+            (view[1] >= latest_indep[0] and view[0] >= latest_indep[0] - args.span)
+        if following and view != xlim:
+          subplot.set_xlim(xlim)
+          renderer.invalidate()
+        if following:
+          followed_xlims[subplot] = xlim
         for plot in plot_list:
-          plot.update_show()
-      for subplot in plots_dict[0].keys():
-        subplot.set_xlim([latest_indep[0] - args.span, latest_indep[0]])
+          if plot in dirty_plots and plot.update_show(None if following else view):
+            renderer.invalidate()
+          artists.extend(plot.get_artists())
+      dirty_plots.clear()
+      oldest_unrendered_rx_time[0] = None
+      renderer.render(artists)
+      scheduler.rendered(render_start)
+      if latest_rx_time[0] is not None:
+        display_lags.append(time.monotonic() - latest_rx_time[0])
+
+  def update_stats():
+    oldest_rx_time = oldest_unrendered_rx_time[0]
+    if oldest_rx_time is None and telemetry.rx_packets:
+      oldest_rx_time = telemetry.rx_packets[0].rx_time
+    status = "%s; link: %s" % (scheduler.get_stats(oldest_rx_time, len(telemetry.rx_packets)),
+                               telemetry.decoder.link_stats)
+    if clock is not None:
+      status += "; %s" % clock.format()
+    lag_percentiles = latency_percentiles(display_lags)
+    if lag_percentiles is not None:
+      status += "; display lag %s ms" % format_latency_percentiles(lag_percentiles)
+    if trigger is not None:
+      status += "; %i captures%s" % (len(trigger.saved), ", frozen" if frozen[0] else
+                                     ", armed" if trigger.armed else "")
+    if fig.canvas.manager is not None:
+      fig.canvas.manager.set_window_title("Telemetry plotter: %s" % status)
 
   def set_plot_dialog(plot):
     def set_plot_dialog_inner():
@@ -396,13 +1196,29 @@ if __name__ == "__main__":
       else:
         return
 
+  def on_key(event):
+    if event.key == ' ' and trigger is not None:
+      trigger.armed = True
+      frozen[0] = False
+    elif event.key == 'end':  # return scrolled back plots to the latest data
+      xlim = stepped_xlim(latest_indep[0])
+      for subplot in plots_dict[0].keys():
+        subplot.set_xlim(xlim)
+        followed_xlims[subplot] = xlim
+
   def on_exit(event):
       print("Figured closed, exiting.")
       sys.exit()
 
   fig.canvas.mpl_connect('button_press_event', on_click)
+  fig.canvas.mpl_connect('key_press_event', on_key)
   fig.canvas.mpl_connect('close_event', on_exit)
-  ani = animation.FuncAnimation(fig, update, interval=30)
+  timer = fig.canvas.new_timer(interval=10)
+  timer.add_callback(update)
+  timer.start()
+  stats_timer = fig.canvas.new_timer(interval=1000)
+  stats_timer.add_callback(update_stats)
+  stats_timer.start()
   plt.ion()
   plt.draw()
   plt.show()
@@ -410,5 +1226,5 @@ if __name__ == "__main__":
   while True:
     user_in = input("Serial command to send: ").encode()
     # TODO: proper sync semantics
-    telemetry.serial.write(user_in)
-    telemetry.serial.write('\n'.encode())
+    if not telemetry.transmit_bytes(user_in + '\n'.encode()):
+      print("Transmit buffer full, command not sent")
@@ -0,0 +1,58 @@
+"""Telemetry protocol client library.
+
+The parser and transports only need the standard library, and are imported
+with the package. Everything built on NumPy (logs, statistics, derived data,
+spectra, captures, log merging, shared memory rings) is imported on first
+access of one of its names, so programs that only talk to a link start
+quickly. Likewise, pyserial is only imported when TelemetrySerial.open opens
+a serial port.
+"""
+from typing import TYPE_CHECKING, Any, Dict, List
+import importlib
+
+from .parser import TelemetryData, NumericData, NumericArray, \
+    TelemetryPacket, HeaderPacket, DataPacket, TelemetryContext, \
+    TelemetryDeserializationError, LinkStats, TelemetryDeserializer, SetPacketQueue, \
+    TelemetryTransport, TelemetrySerial, TelemetrySocket, TelemetryBrokerClient
+
+if TYPE_CHECKING:
+  from .csvlog import LogColumn, LogData, LogFollower, load_log
+  from .stats import StatsEngine, ClockEstimator
+  from .shmring import ShmRingWriter, ShmRingReader
+  from .derived import DerivedChannel, DerivedChannels, LogDerivedChannels
+  from .spectrum import SlidingSpectrum
+  from .capture import TriggerCapture, read_capture, load_capture
+  from .merge import MergeSource, CsvSource, PacketSource, open_source, estimate_offset, merge_rows, write_merged
+
+
+# public name -> submodule, for names imported on first access
+LAZY_NAMES: Dict[str, str] = {
+  'LogColumn': 'csvlog', 'LogData': 'csvlog', 'LogFollower': 'csvlog', 'load_log': 'csvlog',
+  'StatsEngine': 'stats', 'ClockEstimator': 'stats',
+  'ShmRingWriter': 'shmring', 'ShmRingReader': 'shmring',
+  'DerivedChannel': 'derived', 'DerivedChannels': 'derived', 'LogDerivedChannels': 'derived',
+  'SlidingSpectrum': 'spectrum',
+  'TriggerCapture': 'capture', 'read_capture': 'capture', 'load_capture': 'capture',
+  'MergeSource': 'merge', 'CsvSource': 'merge', 'PacketSource': 'merge', 'open_source': 'merge',
+  'estimate_offset': 'merge', 'merge_rows': 'merge', 'write_merged': 'merge',
+}
+
+__all__ = [
+  'TelemetryData', 'NumericData', 'NumericArray',
+  'TelemetryPacket', 'HeaderPacket', 'DataPacket', 'TelemetryContext',
+  'TelemetryDeserializationError', 'LinkStats', 'TelemetryDeserializer', 'SetPacketQueue',
+  'TelemetryTransport', 'TelemetrySerial', 'TelemetrySocket', 'TelemetryBrokerClient',
+  *LAZY_NAMES,
+]
+
+
+def __getattr__(name: str) -> Any:
+  if name not in LAZY_NAMES:
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+  value = getattr(importlib.import_module('.' + LAZY_NAMES[name], __name__), name)
+  globals()[name] = value  # later accesses skip this
+  return value
+
+
+def __dir__() -> List[str]:
+  return sorted(set(globals()) | set(LAZY_NAMES))
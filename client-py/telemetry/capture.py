@@ -0,0 +1,239 @@
+"""Oscilloscope-style trigger capture: a bounded ring of recent data packets
+is kept while a trigger condition is evaluated on each received batch, and
+when it fires, the packets before and after the trigger are saved to a
+capture file.
+
+Capture files hold the raw (destuffed) packets as received, so they are
+compact and decode exactly like the live stream:
+  CAPTURE_MAGIC
+  uint32 number of data packets before the trigger packet
+  records of: float64 host receive time, uint16 packet length, packet bytes
+all little-endian, where the first record is the header packet.
+"""
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+from collections import deque
+
+import datetime
+import math
+import struct
+
+import numpy as np  # type: ignore
+
+from .csvlog import LogColumn, LogData, COLTYPE_ARRAY, COLTYPE_NUMERIC
+from .derived import DerivedChannel
+from .parser import DataPacket, HeaderPacket, NumericArray, TelemetryContext, TelemetryData, TelemetryPacket
+
+
+CAPTURE_MAGIC = b'TLMCAPT1'
+CAPTURE_SUFFIX = '.tcap'
+CAPTURE_HEADER = struct.Struct('<I')
+CAPTURE_RECORD = struct.Struct('<dH')
+
+
+def write_capture(file: BinaryIO, header: HeaderPacket, packets: Sequence[DataPacket], pre_count: int) -> None:
+  file.write(CAPTURE_MAGIC)
+  file.write(CAPTURE_HEADER.pack(pre_count))
+  for packet in [header, *packets]:
+    rx_time = packet.rx_time if packet.rx_time is not None else math.nan
+    file.write(CAPTURE_RECORD.pack(rx_time, len(packet.raw)))
+    file.write(packet.raw)
+
+
+def is_capture_file(filename: str) -> bool:
+  with open(filename, 'rb') as file:
+    return file.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+
+def read_capture(filename: str) -> Tuple[HeaderPacket, List[DataPacket], int]:
+  """Returns the header, data packets and number of pre-trigger packets of a
+  capture file.
+  """
+  with open(filename, 'rb') as file:
+    contents = file.read()
+  if not contents.startswith(CAPTURE_MAGIC):
+    raise ValueError(f"'{filename}' is not a capture file")
+  pos = len(CAPTURE_MAGIC)
+  pre_count, = CAPTURE_HEADER.unpack_from(contents, pos)
+  pos += CAPTURE_HEADER.size
+
+  context = TelemetryContext({})
+  header: Optional[HeaderPacket] = None
+  packets: List[DataPacket] = []
+  while pos < len(contents):
+    rx_time, length = CAPTURE_RECORD.unpack_from(contents, pos)
+    pos += CAPTURE_RECORD.size
+    packet = TelemetryPacket.decode(bytearray(contents[pos:pos + length]), context)
+    pos += length
+    packet.rx_time = rx_time
+    if isinstance(packet, HeaderPacket):
+      header = packet
+      context = TelemetryContext(packet.get_data_defs())
+    elif isinstance(packet, DataPacket):
+      packets.append(packet)
+  if header is None:
+    raise ValueError(f"capture file '{filename}' has no header")
+  return header, packets, pre_count
+
+
+def load_capture(filename: str) -> Tuple[LogData, Optional[float]]:
+  """Loads a capture file as log data, with the columns ordered by data ID
+  like a CsvLogger log (so the first is the independent variable), and
+  returns it with the independent value at the trigger (or None if unknown).
+  """
+  header, packets, pre_count = read_capture(filename)
+  data_defs: Dict[int, TelemetryData] = header.get_data_defs()
+  data_ids = sorted(data_defs.keys())
+  indep_id, dep_ids = data_ids[0], data_ids[1:]
+
+  x_lists: Dict[int, List[float]] = {data_id: [] for data_id in dep_ids}
+  y_lists: Dict[int, List[float]] = {data_id: [] for data_id in dep_ids}
+  indep_values = []
+  for packet in packets:
+    indep_value = packet.get_data_by_id(indep_id)
+    if indep_value is None:
+      continue
+    indep_values.append(indep_value)
+    for data_id in dep_ids:
+      value = packet.get_data_by_id(data_id)
+      if value is not None:
+        x_lists[data_id].append(indep_value)
+        y_lists[data_id].append(value)
+
+  columns = []
+  for data_id in dep_ids:
+    data_def = data_defs[data_id]
+    coltype = COLTYPE_ARRAY if isinstance(data_def, NumericArray) else COLTYPE_NUMERIC
+    y_values = np.array(y_lists[data_id], dtype=np.float64)
+    if coltype == COLTYPE_ARRAY and not len(y_values):
+      y_values = y_values.reshape(0, data_def.count)  # type: ignore
+    columns.append(LogColumn(data_def.internal_name, coltype, np.array(x_lists[data_id], dtype=np.float64),
+                             y_values))
+
+  trigger_x = None
+  if pre_count < len(packets):
+    trigger_x = packets[pre_count].get_data_by_id(indep_id)
+  return (LogData([data_defs[data_id].internal_name for data_id in data_ids], columns,
+                  min(indep_values, default=0), max(indep_values, default=0),
+                  np.array(indep_values, dtype=np.float64)),
+          trigger_x)
+
+
+class TriggerCapture:
+  """Watches the packet stream for a trigger condition, and saves the data
+  packets around each trigger to a capture file. The condition is an
+  expression over internal names (see DerivedChannel), evaluated once per
+  batch, that fires on each transition from false to true, like:
+    'speed > 2.5' (rising threshold crossing), 'speed < 0.5' (falling)
+    'abs(diff(enc)) > 100' (edge in the data)
+    'amax(cam) < 200' (array condition, like a lost line)
+  Packets without all the inputs of the condition don't change its state.
+  The latest pre_packets data packets are kept in a ring while armed, and
+  triggers during a capture are ignored.
+
+  Arguments:
+    condition: trigger condition expression
+    pre_packets: data packets saved before the trigger packet
+    post_packets: data packets saved from the trigger packet on
+    filename_prefix: prefix of capture filenames, followed by the time and CAPTURE_SUFFIX
+    single: disarm after the first capture, instead of re-arming
+  """
+  def __init__(self, condition: str, pre_packets: int, post_packets: int, filename_prefix: str,
+               single: bool = False) -> None:
+    self.channel = DerivedChannel('trigger=' + condition)
+    self.pre_ring: 'deque[DataPacket]' = deque(maxlen=pre_packets)
+    self.post_packets = max(1, post_packets)
+    self.filename_prefix = filename_prefix
+    self.single = single
+
+    self.armed = True
+    self.header: Optional[HeaderPacket] = None
+    self.input_ids: Optional[List[int]] = None  # None when the header lacks inputs
+    self.last_state = True  # so a condition true from the start doesn't fire
+    self.capture: Optional[List[DataPacket]] = None
+    self.capture_pre_count = 0
+    self.saved: List[str] = []  # capture filenames
+
+  def set_header(self, header: HeaderPacket) -> None:
+    if self.capture is not None:
+      self.save()  # truncated by the new header
+    self.header = header
+    self.pre_ring.clear()
+    self.channel.reset()
+    self.last_state = True
+
+    ids_by_name = {data_def.internal_name: data_id for data_id, data_def in header.get_data_defs().items()}
+    missing = [name for name in self.channel.inputs if name not in ids_by_name]
+    if missing:
+      print(f"Trigger disabled: {', '.join(missing)} not in header")
+      self.input_ids = None
+    else:
+      self.input_ids = [ids_by_name[name] for name in self.channel.inputs]
+
+  def process(self, packets: Sequence[TelemetryPacket]) -> List[str]:
+    """Processes a batch of received packets, returning the filenames of any
+    captures completed by them.
+    """
+    saved_count = len(self.saved)
+    batch: List[DataPacket] = []
+    for packet in packets:
+      if isinstance(packet, HeaderPacket):
+        self.process_data(batch)
+        batch = []
+        self.set_header(packet)
+      elif isinstance(packet, DataPacket):
+        batch.append(packet)
+    self.process_data(batch)
+    return self.saved[saved_count:]
+
+  def find_triggers(self, packets: List[DataPacket]) -> np.ndarray:
+    """Returns the (increasing) indices of the packets the trigger fires on."""
+    if self.input_ids is None:
+      return np.empty(0, dtype=int)
+    rows = [i for i, packet in enumerate(packets)
+            if all(data_id in packet.data for data_id in self.input_ids)]
+    if not rows:
+      return np.empty(0, dtype=int)
+    inputs = {name: np.array([packets[i].data[data_id] for i in rows], dtype=np.float64)
+              for name, data_id in zip(self.channel.inputs, self.input_ids)}
+    state = self.channel.evaluate(inputs, len(rows)) != 0  # NaN counts as true, like in Python
+    if state.ndim > 1:
+      state = state.any(axis=1)
+    previous = np.concatenate(([self.last_state], state[:-1]))
+    self.last_state = bool(state[-1])
+    return np.array(rows)[state & ~previous]
+
+  def process_data(self, packets: List[DataPacket]) -> None:
+    if not packets:
+      return
+    triggers = self.find_triggers(packets) if self.armed else np.empty(0, dtype=int)
+    pos = 0
+    while pos < len(packets):
+      if self.capture is not None:
+        count = min(self.post_packets - (len(self.capture) - self.capture_pre_count), len(packets) - pos)
+        self.capture.extend(packets[pos:pos + count])
+        pos += count
+        if len(self.capture) - self.capture_pre_count >= self.post_packets:
+          self.save()
+        continue
+
+      next_trigger = np.searchsorted(triggers, pos)
+      if not self.armed or next_trigger == len(triggers):
+        self.pre_ring.extend(packets[pos:])
+        break
+      trigger_pos = int(triggers[next_trigger])
+      self.pre_ring.extend(packets[pos:trigger_pos])
+      self.capture = list(self.pre_ring)
+      self.capture_pre_count = len(self.capture)
+      self.pre_ring.clear()
+      pos = trigger_pos
+
+  def save(self) -> None:
+    assert self.capture is not None and self.header is not None
+    timestring = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    filename = '%s-%s-%i%s' % (self.filename_prefix, timestring, len(self.saved), CAPTURE_SUFFIX)
+    with open(filename, 'wb') as file:
+      write_capture(file, self.header, self.capture, self.capture_pre_count)
+    self.saved.append(filename)
+    self.capture = None
+    if self.single:
+      self.armed = False
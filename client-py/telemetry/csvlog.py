@@ -0,0 +1,694 @@
+"""Column-oriented loader for CSV telemetry logs, like those written by the
+plotter's CsvLogger. The first column is treated as the independent axis, and
+each other column is parsed into NumPy arrays of the rows where it is present.
+
+Parsed logs are cached in a binary sidecar directory next to the CSV (one .npy
+file per array, loaded memory-mapped), so reopening an unchanged log skips
+parsing entirely. Loading only a range of the independent variable is served
+from the cache if available, and otherwise from a sparse index (also stored
+next to the CSV) that maps independent values to byte offsets.
+"""
+from typing import List, Dict, Any, BinaryIO, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor, wait
+from itertools import zip_longest
+from multiprocessing import resource_tracker, shared_memory
+
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import numpy as np  # type: ignore
+
+
+COLTYPE_HIDDEN = 'hidden'
+COLTYPE_NUMERIC = 'numeric'
+COLTYPE_ARRAY = 'array'
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.cache'
+CACHE_META_FILENAME = 'meta.json'
+
+INDEX_SUFFIX = '.index.npz'
+INDEX_STRIDE_ROWS = 1024  # data rows between sparse index entries
+
+FOLLOW_HEADER_MAX_BYTES = 1 << 20  # header rows of a followed log must be within this many bytes
+
+PARSE_CHUNK_ROWS = 65536  # rows buffered as strings before being converted to arrays
+PARSE_MIN_RANGE_BYTES = 1 << 20  # smallest byte range worth handing to a parallel parse worker
+
+
+def str_is_float(input: str) -> bool:
+  if not input:  # TODO: this is a bit hacky, we default empty cell as float
+    return True
+  try:
+    float(input)
+    return True
+  except ValueError:
+    return False
+
+
+def str_is_array(input: str) -> bool:
+  return len(input) > 1 and input[0] == '[' and input[-1] == ']'
+
+
+def parse_array_cells(cells: Sequence[str], count: Optional[int] = None) -> np.ndarray:
+  """Parses a sequence of array cells (like '[1, 2, 3]') into a 2-D array with
+  one row per cell, in a single vectorized pass. Raises ValueError if the cells
+  do not all have the same count (or the specified count).
+  """
+  flat = np.fromstring(','.join([cell[1:-1] for cell in cells]), sep=',')
+  if count is None:
+    count = cells[0].count(',') + 1
+  if flat.size != len(cells) * count:
+    raise ValueError(f"Inconsistent array lengths, expected {len(cells)} arrays of {count} elements")
+  return flat.reshape(len(cells), count)
+
+
+class LogColumn:
+  """Parsed data of a single dependent CSV column, containing only the rows where
+  the cell was present. y_values is 1-D for numeric columns and 2-D (one row per
+  sample) for array columns.
+  """
+  def __init__(self, name: str, coltype: str, x_values: np.ndarray, y_values: np.ndarray) -> None:
+    self.name = name
+    self.coltype = coltype
+    self.x_values = x_values
+    self.y_values = y_values
+
+
+class LogData:
+  """Parsed contents of a CSV log: the header names (including the independent
+  column), a LogColumn for each dependent column, and the independent value of
+  every data row (including rows with no dependent data), which defines the
+  row count.
+  """
+  def __init__(self, names: List[str], columns: List[LogColumn], first_x: float, last_x: float,
+               indep_values: np.ndarray) -> None:
+    self.names = names
+    self.columns = columns
+    self.first_x = first_x
+    self.last_x = last_x
+    self.indep_values = indep_values
+
+  @property
+  def row_count(self) -> int:
+    return len(self.indep_values)
+
+  def get_coltypes(self) -> List[str]:
+    return [column.coltype for column in self.columns]
+
+  def select_range(self, start: Optional[float], end: Optional[float]) -> 'LogData':
+    """Returns the data with independent values in [start, end], where None is
+    unbounded. Columns are views into (not copies of) this data's arrays.
+    """
+    if start is None and end is None:
+      return self
+    columns: List[LogColumn] = []
+    for column in self.columns:
+      lo = 0 if start is None else np.searchsorted(column.x_values, start, side='left')
+      hi = len(column.x_values) if end is None else np.searchsorted(column.x_values, end, side='right')
+      columns.append(LogColumn(column.name, column.coltype, column.x_values[lo:hi], column.y_values[lo:hi]))
+    lo = 0 if start is None else np.searchsorted(self.indep_values, start, side='left')
+    hi = len(self.indep_values) if end is None else np.searchsorted(self.indep_values, end, side='right')
+    return LogData(self.names, columns,
+                   self.first_x if start is None else max(self.first_x, start),
+                   self.last_x if end is None else min(self.last_x, end),
+                   self.indep_values[lo:hi])
+
+
+def infer_column_types(names: List[str], data_row: List[str], hide_cols: Sequence[str]) -> List[str]:
+  """Infers the column type of each dependent column from the contents of a
+  data row. Raises ValueError if a type can't be inferred.
+  """
+  coltypes: List[str] = []
+  for col_name, data_cell in zip(names[1:], data_row[1:]):  # discard first col
+    if col_name in hide_cols or col_name.split(' ')[0] in hide_cols:
+      print(f"hiding '{col_name}'")
+      coltypes.append(COLTYPE_HIDDEN)
+    elif str_is_float(data_cell):
+      print(f"detected numeric / line plot for '{col_name}'")
+      coltypes.append(COLTYPE_NUMERIC)
+    elif str_is_array(data_cell):
+      print(f"detected array / waterfall plot for '{col_name}'")
+      coltypes.append(COLTYPE_ARRAY)
+    else:
+      raise ValueError(f"Unable to infer data type for '{col_name}' from data contents '{data_cell}'")
+  return coltypes
+
+
+class LogColumnsBuilder:
+  """Accumulates CSV data rows, converting them into per-column arrays in
+  vectorized batches of PARSE_CHUNK_ROWS rows.
+  """
+  def __init__(self, names: List[str], coltypes: List[str]) -> None:
+    self.names = names
+    self.coltypes = coltypes
+
+    self.pending_rows: List[List[str]] = []
+    self.x_chunks: List[List[np.ndarray]] = [[] for _ in coltypes]
+    self.y_chunks: List[List[np.ndarray]] = [[] for _ in coltypes]
+    self.array_counts: List[Optional[int]] = [None for _ in coltypes]
+
+    self.indep_chunks: List[np.ndarray] = []
+    self.first_x: Optional[float] = None
+    self.last_x: Optional[float] = None
+
+  def add_row(self, row: List[str]) -> None:
+    if not row or not row[0]:  # rows without an independent value (like out-of-band data) can't be plotted
+      return
+    self.pending_rows.append(row)
+    if len(self.pending_rows) >= PARSE_CHUNK_ROWS:
+      self.flush()
+
+  def flush(self) -> None:
+    """Converts all pending rows into arrays."""
+    if not self.pending_rows:
+      return
+    cols = list(zip_longest(*self.pending_rows, fillvalue=''))
+    self.pending_rows = []
+
+    indep = np.array(cols[0], dtype=np.float64)
+    self.indep_chunks.append(indep)
+    if self.first_x is None:
+      self.first_x = float(indep[0])
+    self.last_x = float(indep[-1])
+
+    for col_idx, coltype in enumerate(self.coltypes):
+      if coltype == COLTYPE_HIDDEN or col_idx + 1 >= len(cols):
+        continue
+      cells = np.array(cols[col_idx + 1])
+      mask = cells != ''
+      if not mask.any():
+        continue
+      present = cells[mask]
+      try:
+        if coltype == COLTYPE_NUMERIC:
+          y_values = present.astype(np.float64)
+        else:
+          y_values = parse_array_cells(present, self.array_counts[col_idx])
+          self.array_counts[col_idx] = y_values.shape[1]
+      except ValueError as e:
+        raise ValueError(f"Unable to parse column '{self.names[col_idx + 1]}': {e}")
+      self.x_chunks[col_idx].append(indep[mask])
+      self.y_chunks[col_idx].append(y_values)
+
+  def build(self) -> LogData:
+    self.flush()
+    columns: List[LogColumn] = []
+    for col_idx, coltype in enumerate(self.coltypes):
+      if self.x_chunks[col_idx]:
+        x_values = np.concatenate(self.x_chunks[col_idx])
+        y_values = np.concatenate(self.y_chunks[col_idx])
+      elif coltype == COLTYPE_ARRAY:
+        x_values = np.empty(0)
+        y_values = np.empty((0, 0))
+      else:
+        x_values = np.empty(0)
+        y_values = np.empty(0)
+      columns.append(LogColumn(self.names[col_idx + 1], coltype, x_values, y_values))
+
+    return LogData(self.names, columns,
+                   self.first_x if self.first_x is not None else 0.0,
+                   self.last_x if self.last_x is not None else 0.0,
+                   np.concatenate(self.indep_chunks) if self.indep_chunks else np.empty(0))
+
+
+def read_header_rows(f: BinaryIO, skip_data_rows: int,
+                     hide_cols: Sequence[str]) -> Tuple[List[str], Optional[List[str]], int]:
+  """Reads the names row and skipped rows from a CSV log opened in binary mode,
+  and infers column types from the first data row. Returns the names, column
+  types (or None if there are no data rows) and the byte offset of the first
+  data row.
+  """
+  names = next(csv.reader([f.readline().decode('utf-8')]))
+  for i in range(skip_data_rows):  # skip skipped rows
+    f.readline()
+  data_start = f.tell()
+  data_row_line = f.readline()  # infer data type from first row
+  if not data_row_line:
+    return names, None, data_start
+  coltypes = infer_column_types(names, next(csv.reader([data_row_line.decode('utf-8')])), hide_cols)
+  return names, coltypes, data_start
+
+
+def parse_csv(filename: str, skip_data_rows: int = 0, hide_cols: Sequence[str] = ()) -> LogData:
+  """Parses a CSV log, inferring column types from the first data row after the
+  skipped rows.
+  """
+  with open(filename, newline='') as csvfile:
+    reader = csv.reader(csvfile)
+    names = next(reader)
+
+    try:
+      for i in range(skip_data_rows):  # skip skipped rows
+        next(reader)
+      data_row = next(reader)  # infer data type from first row
+    except StopIteration:
+      return LogColumnsBuilder(names, []).build()
+
+    builder = LogColumnsBuilder(names, infer_column_types(names, data_row, hide_cols))
+    builder.add_row(data_row)
+    data_row_idx = 1
+    for data_row in reader:
+      builder.add_row(data_row)
+      data_row_idx += 1
+      if data_row_idx % PARSE_CHUNK_ROWS == 0:
+        print(f"working: parsed {data_row_idx} rows", end='\r')
+
+  logdata = builder.build()
+  print(f"finished: parsed {logdata.row_count} rows")
+  return logdata
+
+
+# Describes an array passed through shared memory, as (shared memory name, shape)
+SharedArrayDesc = Tuple[str, Tuple[int, ...]]
+
+
+def array_to_shared_memory(array: np.ndarray) -> Optional[SharedArrayDesc]:
+  """Copies a float64 array into a new shared memory block and returns its
+  description, or None for an empty array. Ownership (including unlinking) is
+  passed to the process that calls array_from_shared_memory.
+  """
+  if array.size == 0:
+    return None
+  shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+  np.ndarray(array.shape, dtype=np.float64, buffer=shm.buf)[...] = array
+  desc = (shm.name, array.shape)
+  shm.close()
+  # the receiving process unlinks the block, so don't let this process' tracker clean it up on exit
+  resource_tracker.unregister(shm._name, 'shared_memory')  # type: ignore
+  return desc
+
+
+def array_from_shared_memory(desc: SharedArrayDesc, out: np.ndarray) -> None:
+  """Copies the array described by desc into out, then frees the shared memory block."""
+  shm = shared_memory.SharedMemory(name=desc[0])
+  try:
+    shared = np.ndarray(desc[1], dtype=np.float64, buffer=shm.buf)
+    out[...] = shared
+    del shared  # release the buffer export so the block can be closed
+  finally:
+    shm.close()
+    shm.unlink()
+
+
+def free_shared_array(desc: Optional[SharedArrayDesc]) -> None:
+  """Frees the shared memory block of an array that won't be (or already was)
+  received with array_from_shared_memory.
+  """
+  if desc is None:
+    return
+  try:
+    shm = shared_memory.SharedMemory(name=desc[0])
+  except FileNotFoundError:
+    return  # already received, which frees it
+  shm.close()
+  shm.unlink()
+
+
+# Result of parsing a byte range, as (row independent values, first_x, last_x, per-column (x, y) shared arrays)
+RangeResult = Tuple[Optional[SharedArrayDesc], Optional[float], Optional[float],
+                    List[Tuple[Optional[SharedArrayDesc], Optional[SharedArrayDesc]]]]
+
+
+def parse_csv_range(filename: str, start: int, end: int, names: List[str], coltypes: List[str]) -> RangeResult:
+  """Parses the rows in the byte range [start, end) of a CSV log, which must be
+  aligned to row boundaries. Runs in a parallel parse worker process, so the
+  column arrays are returned through shared memory instead of being pickled.
+  """
+  with open(filename, 'rb') as f:
+    f.seek(start)
+    data = f.read(end - start)
+
+  builder = LogColumnsBuilder(names, coltypes)
+  for row in csv.reader(data.decode('utf-8').splitlines()):
+    builder.add_row(row)
+  logdata = builder.build()
+
+  created: List[Optional[SharedArrayDesc]] = []  # freed if a later block can't be created
+
+  def to_shared(array: np.ndarray) -> Optional[SharedArrayDesc]:
+    created.append(array_to_shared_memory(array))
+    return created[-1]
+
+  try:
+    return (to_shared(logdata.indep_values),
+            builder.first_x, builder.last_x,
+            [(to_shared(column.x_values), to_shared(column.y_values)) for column in logdata.columns])
+  except BaseException:
+    for desc in created:
+      free_shared_array(desc)
+    raise
+
+
+def range_result_descs(result: RangeResult) -> List[Optional[SharedArrayDesc]]:
+  """Returns all the shared arrays of a range result."""
+  return [result[0]] + [desc for column_descs in result[3] for desc in column_descs]
+
+
+def concatenate_shared_arrays(descs: List[Optional[SharedArrayDesc]], inner_shape: Tuple[int, ...]) -> np.ndarray:
+  """Concatenates (in order) and frees arrays returned through shared memory,
+  copying each only once into the output array.
+  """
+  present = [desc for desc in descs if desc is not None]
+  for desc in present:
+    if desc[1][1:] != present[0][1][1:]:
+      raise ValueError(f"Inconsistent array shapes {desc[1]} and {present[0][1]}")
+  if present:
+    inner_shape = present[0][1][1:]
+  out = np.empty((sum([desc[1][0] for desc in present]),) + inner_shape)
+  pos = 0
+  for desc in present:
+    array_from_shared_memory(desc, out[pos:pos + desc[1][0]])
+    pos += desc[1][0]
+  return out
+
+
+def parse_csv_parallel(filename: str, skip_data_rows: int = 0, hide_cols: Sequence[str] = (),
+                       jobs: int = 1) -> LogData:
+  """Parses a CSV log using multiple processes, by splitting the data rows into
+  byte ranges aligned to row boundaries. Column types are inferred from the first
+  data row after the skipped rows, like parse_csv. This assumes rows do not
+  contain embedded newlines, which holds for logs written by CsvLogger.
+  """
+  with open(filename, 'rb') as f:
+    names, coltypes, data_start = read_header_rows(f, skip_data_rows, hide_cols)
+    if coltypes is None:
+      return LogColumnsBuilder(names, []).build()
+
+    data_end = os.fstat(f.fileno()).st_size
+    num_ranges = max(1, min(jobs, (data_end - data_start) // PARSE_MIN_RANGE_BYTES))
+    offsets = [data_start]
+    for range_idx in range(1, num_ranges):
+      f.seek(data_start + (data_end - data_start) * range_idx // num_ranges - 1)
+      f.readline()  # advance to the start of the next row
+      if offsets[-1] < f.tell() < data_end:
+        offsets.append(f.tell())
+    offsets.append(data_end)
+
+  print(f"working: parsing {len(offsets) - 1} ranges with {jobs} jobs", end='\r')
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(parse_csv_range, filename, start, end, names, coltypes)
+               for start, end in zip(offsets[:-1], offsets[1:])]
+    wait(futures)  # every range finishes, so all the shared memory blocks are known before anything can fail
+  results = [future.result() for future in futures if future.exception() is None]
+
+  try:
+    for future in futures:
+      future.result()  # raises the error of the first failed range
+
+    columns: List[LogColumn] = []
+    for col_idx, coltype in enumerate(coltypes):
+      x_descs = [result[3][col_idx][0] for result in results]
+      y_descs = [result[3][col_idx][1] for result in results]
+      try:
+        x_values = concatenate_shared_arrays(x_descs, ())
+        y_values = concatenate_shared_arrays(y_descs, (0, ) if coltype == COLTYPE_ARRAY else ())
+      except ValueError as e:
+        raise ValueError(f"Unable to parse column '{names[col_idx + 1]}': {e}")
+      columns.append(LogColumn(names[col_idx + 1], coltype, x_values, y_values))
+
+    first_xs = [result[1] for result in results if result[1] is not None]
+    last_xs = [result[2] for result in results if result[2] is not None]
+    logdata = LogData(names, columns,
+                      first_xs[0] if first_xs else 0.0,
+                      last_xs[-1] if last_xs else 0.0,
+                      concatenate_shared_arrays([result[0] for result in results], ()))
+  finally:
+    # blocks are unregistered from the workers' resource trackers, so any not received must be freed here
+    for result in results:
+      for desc in range_result_descs(result):
+        free_shared_array(desc)
+  print(f"finished: parsed {logdata.row_count} rows")
+  return logdata
+
+
+class SparseIndex:
+  """Sparse index of a CSV log, mapping the independent value of every
+  INDEX_STRIDE_ROWS-th data row (starting with the first) to its byte offset.
+  This assumes the independent variable is non-decreasing through the log.
+  """
+  def __init__(self, indep_values: np.ndarray, offsets: np.ndarray) -> None:
+    self.indep_values = indep_values
+    self.offsets = offsets
+
+  def seek_offset(self, indep_value: float) -> int:
+    """Returns the byte offset of an indexed row before any row with an
+    independent value of at least indep_value.
+    """
+    idx = int(np.searchsorted(self.indep_values, indep_value, side='left')) - 1
+    return int(self.offsets[max(idx, 0)])
+
+
+def build_index(filename: str, skip_data_rows: int) -> SparseIndex:
+  """Builds a sparse index by scanning only the independent column of the log."""
+  indep_values: List[float] = []
+  offsets: List[int] = []
+  with open(filename, 'rb') as f:
+    f.readline()  # names row
+    for i in range(skip_data_rows):  # skip skipped rows
+      f.readline()
+    data_row_idx = 0
+    offset = f.tell()
+    for line in f:
+      indep_cell = line.split(b',', 1)[0].strip()
+      if indep_cell:  # rows without an independent value aren't indexed or counted
+        if data_row_idx % INDEX_STRIDE_ROWS == 0:
+          indep_values.append(float(indep_cell))
+          offsets.append(offset)
+        data_row_idx += 1
+      offset += len(line)
+  return SparseIndex(np.array(indep_values, dtype=np.float64), np.array(offsets, dtype=np.int64))
+
+
+def load_index(index_filename: str, key: Dict[str, Any]) -> Optional[SparseIndex]:
+  """Loads a sparse index, returning None if there is no index or it does not
+  match the key.
+  """
+  try:
+    with np.load(index_filename) as index_file:
+      if json.loads(str(index_file['key'])) != key:
+        return None
+      return SparseIndex(index_file['indep_values'], index_file['offsets'])
+  except (OSError, ValueError, KeyError):
+    return None
+
+
+def get_index(filename: str, skip_data_rows: int) -> SparseIndex:
+  """Returns the sparse index for a CSV log, building and saving it alongside
+  the log if there isn't an up-to-date one.
+  """
+  key = cache_key(filename, skip_data_rows, ())
+  index_filename = filename + INDEX_SUFFIX
+  index = load_index(index_filename, key)
+  if index is None:
+    print(f"working: building index", end='\r')
+    index = build_index(filename, skip_data_rows)
+    try:
+      np.savez(index_filename, key=np.array(json.dumps(key)),
+               indep_values=index.indep_values, offsets=index.offsets)
+    except OSError as e:
+      print(f"unable to write index '{index_filename}': {e}")
+  return index
+
+
+def parse_csv_window(filename: str, skip_data_rows: int, hide_cols: Sequence[str],
+                     start: Optional[float], end: Optional[float]) -> LogData:
+  """Parses only the rows of a CSV log with independent values in [start, end],
+  where None is unbounded, seeking to the start using the sparse index. Column
+  types are inferred from the first data row of the log, like parse_csv.
+  """
+  index = get_index(filename, skip_data_rows)
+  with open(filename, 'rb') as f:
+    names, coltypes, data_start = read_header_rows(f, skip_data_rows, hide_cols)
+    if coltypes is None:
+      return LogColumnsBuilder(names, []).build()
+
+    builder = LogColumnsBuilder(names, coltypes)
+    f.seek(index.seek_offset(start) if start is not None else data_start)
+    for row in csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline='')):
+      if not row or not row[0]:
+        continue
+      indep_value = float(row[0])
+      if start is not None and indep_value < start:
+        continue
+      if end is not None and indep_value > end:
+        break
+      builder.add_row(row)
+
+  logdata = builder.build()
+  print(f"finished: parsed {logdata.row_count} rows in range")
+  return logdata
+
+
+class LogFollower:
+  """Incrementally parses a CSV log that is still being written (for example,
+  by CsvLogger), returning only newly appended complete rows on each read.
+  """
+  def __init__(self, filename: str, skip_data_rows: int = 0, hide_cols: Sequence[str] = ()) -> None:
+    self.filename = filename
+    self.skip_data_rows = skip_data_rows
+    self.hide_cols = hide_cols
+
+    self.names: Optional[List[str]] = None
+    self.coltypes: Optional[List[str]] = None
+    self.offset = 0  # byte offset of the next unparsed row
+
+  def read_header(self, data: bytes) -> bool:
+    """Parses the names, skipped rows and type inference row once they have
+    been completely written, returning whether they are available.
+    """
+    if data.count(b'\n') < self.skip_data_rows + 2:
+      return False
+    f = io.BytesIO(data)
+    names, coltypes, data_start = read_header_rows(f, self.skip_data_rows, self.hide_cols)
+    self.names = names
+    self.coltypes = coltypes
+    self.offset = data_start
+    return True
+
+  def read_new(self) -> Optional[LogData]:
+    """Returns the complete rows appended since the last read, or None if
+    there are none (or the header rows have not been written yet).
+    """
+    with open(self.filename, 'rb') as f:
+      if self.names is None:
+        if not self.read_header(f.read(FOLLOW_HEADER_MAX_BYTES)):
+          return None
+      if os.fstat(f.fileno()).st_size < self.offset:
+        raise ValueError(f"'{self.filename}' was truncated while being followed")
+      f.seek(self.offset)
+      data = f.read()
+
+    complete_len = data.rfind(b'\n') + 1  # ignore any partially written row
+    if complete_len == 0:
+      return None
+    self.offset += complete_len
+
+    assert self.names is not None and self.coltypes is not None
+    builder = LogColumnsBuilder(self.names, self.coltypes)
+    for row in csv.reader(data[:complete_len].decode('utf-8').splitlines()):
+      builder.add_row(row)
+    logdata = builder.build()
+    if logdata.row_count == 0:
+      return None
+    return logdata
+
+
+def cache_key(filename: str, skip_data_rows: int, hide_cols: Sequence[str]) -> Dict[str, Any]:
+  """Returns the key identifying a parse of the source file, which includes the
+  file size, modification time, a hash of the header rows, and parse options.
+  """
+  stat = os.stat(filename)
+  header_hash = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for i in range(skip_data_rows + 2):  # names row, skipped rows, and type inference row
+      header_hash.update(f.readline())
+  return {
+    'version': CACHE_VERSION,
+    'size': stat.st_size,
+    'mtime_ns': stat.st_mtime_ns,
+    'header_sha1': header_hash.hexdigest(),
+    'skip_data_rows': skip_data_rows,
+    'hide_cols': sorted(hide_cols),
+  }
+
+
+def save_cache(cache_dir: str, key: Dict[str, Any], logdata: LogData) -> None:
+  """Writes the parsed log to a sidecar directory. The metadata file is written
+  last, so an interrupted write leaves an invalid (ignored) cache.
+  """
+  if os.path.isdir(cache_dir):
+    shutil.rmtree(cache_dir)
+  os.makedirs(cache_dir)
+
+  for col_idx, column in enumerate(logdata.columns):
+    if column.coltype != COLTYPE_HIDDEN:
+      np.save(os.path.join(cache_dir, f'{col_idx}_x.npy'), column.x_values)
+      np.save(os.path.join(cache_dir, f'{col_idx}_y.npy'), column.y_values)
+  np.save(os.path.join(cache_dir, 'indep.npy'), logdata.indep_values)
+
+  meta = {
+    'key': key,
+    'names': logdata.names,
+    'coltypes': logdata.get_coltypes(),
+    'first_x': logdata.first_x,
+    'last_x': logdata.last_x,
+  }
+  with open(os.path.join(cache_dir, CACHE_META_FILENAME), 'w') as f:
+    json.dump(meta, f)
+
+
+def load_cached_array(filename: str) -> np.ndarray:
+  try:
+    return np.load(filename, mmap_mode='r')
+  except ValueError:  # empty arrays can't be memory-mapped
+    return np.load(filename)
+
+
+def load_cache(cache_dir: str, key: Dict[str, Any]) -> Optional[LogData]:
+  """Loads a parsed log from a sidecar directory, returning None if there is no
+  cache or it does not match the key.
+  """
+  try:
+    with open(os.path.join(cache_dir, CACHE_META_FILENAME)) as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if meta.get('key') != key:
+    return None
+
+  names = meta['names']
+  columns: List[LogColumn] = []
+  try:
+    for col_idx, coltype in enumerate(meta['coltypes']):
+      if coltype == COLTYPE_HIDDEN:
+        columns.append(LogColumn(names[col_idx + 1], coltype, np.empty(0), np.empty(0)))
+      else:
+        columns.append(LogColumn(names[col_idx + 1], coltype,
+                                 load_cached_array(os.path.join(cache_dir, f'{col_idx}_x.npy')),
+                                 load_cached_array(os.path.join(cache_dir, f'{col_idx}_y.npy'))))
+    indep_values = load_cached_array(os.path.join(cache_dir, 'indep.npy'))
+  except OSError:
+    return None
+
+  return LogData(names, columns, meta['first_x'], meta['last_x'], indep_values)
+
+
+def load_log(filename: str, skip_data_rows: int = 0, hide_cols: Sequence[str] = (),
+             use_cache: bool = True, jobs: int = 1,
+             start: Optional[float] = None, end: Optional[float] = None) -> LogData:
+  """Loads a CSV log, from its sidecar cache if it is up to date, otherwise by
+  parsing it (and then writing the cache). Parsing is done with jobs processes.
+
+  If start or end is specified, only data with independent values in that range
+  is returned. Without an up-to-date cache, this parses only the rows in range
+  (using the sparse index) and does not write the cache.
+  """
+  key = cache_key(filename, skip_data_rows, hide_cols)
+  cache_dir = filename + CACHE_SUFFIX
+
+  if use_cache:
+    logdata = load_cache(cache_dir, key)
+    if logdata is not None:
+      print(f"finished: loaded {logdata.row_count} rows from cache '{cache_dir}'")
+      return logdata.select_range(start, end)
+
+  if start is not None or end is not None:
+    return parse_csv_window(filename, skip_data_rows, hide_cols, start, end)
+
+  if jobs > 1:
+    logdata = parse_csv_parallel(filename, skip_data_rows, hide_cols, jobs)
+  else:
+    logdata = parse_csv(filename, skip_data_rows, hide_cols)
+
+  if use_cache:
+    try:
+      save_cache(cache_dir, key, logdata)
+    except OSError as e:
+      print(f"unable to write cache '{cache_dir}': {e}")
+
+  return logdata
@@ -0,0 +1,388 @@
+"""Derived data: channels computed from expressions over other data, like
+speed from encoder counts, filtered error, or the centroid of a camera array.
+
+Definitions have the form 'name=expression' (or 'name[units]=expression'),
+where the expression is a Python expression over the internal names of other
+data (including earlier derived data) and the functions in DerivedChannel.
+Expressions are evaluated with NumPy on batches of samples: scalar data is a
+1-D array with one element per sample and array data is 2-D with one row per
+sample, so each batch costs one evaluation regardless of its length. Stateful
+functions (like prev and ema) carry their state between batches, so results
+don't depend on how the stream was batched.
+
+Expressions are evaluated with eval, so only use definitions you trust.
+"""
+from typing import Any, Dict, List, Sequence, Tuple
+
+import ast
+import math
+
+import numpy as np  # type: ignore
+
+from .csvlog import LogColumn, LogData, COLTYPE_ARRAY, COLTYPE_HIDDEN, COLTYPE_NUMERIC
+from .parser import DataPacket, HeaderPacket, NumericArray, NumericData, TelemetryData, TelemetryPacket, \
+    DATATYPE_NUMERIC, DATATYPE_NUMERIC_ARRAY, NUMERIC_SUBTYPE_FLOAT
+
+
+DERIVED_DATAID_BASE = 0x100  # above any data ID the car can send, so derived IDs never collide
+
+EMA_MAX_DYNAMIC_RANGE = 1e12  # largest weight ratio between samples in one closed-form EMA block
+
+
+class StreamState:
+  """State of the stateful functions in an expression, carried between
+  batches. Each call site gets a slot, identified by its position in the
+  evaluation order, which is the same for every evaluation of an expression.
+  """
+  def __init__(self) -> None:
+    self.slots: List[Dict[str, Any]] = []
+    self.position = 0
+
+  def reset(self) -> None:
+    self.slots = []
+    self.position = 0
+
+  def begin(self) -> None:
+    self.position = 0
+
+  def next_slot(self) -> Dict[str, Any]:
+    if self.position == len(self.slots):
+      self.slots.append({})
+    slot = self.slots[self.position]
+    self.position += 1
+    return slot
+
+
+def centroid(x: np.ndarray) -> np.ndarray:
+  """Returns the intensity-weighted mean element index of each row, NaN for all-zero rows."""
+  weights = np.sum(x, axis=1)
+  return np.sum(x * np.arange(x.shape[1]), axis=1) / np.where(weights == 0, np.nan, weights)
+
+
+class DerivedChannel:
+  """A derived data definition, compiled. Besides the input data, expressions
+  can use:
+    elementwise: abs, sign, sqrt, exp, log, log10, sin, cos, tan, arcsin,
+      arccos, arctan, arctan2, hypot, floor, ceil, round, minimum, maximum,
+      clip, where, and the constants pi, e, nan
+    per-sample reductions of array data: sum, mean, amin, amax, argmin,
+      argmax, centroid
+    over time: prev(x) (the previous sample, NaN for the first), diff(x),
+      cumsum(x), ema(x, alpha) (exponential moving average, weight alpha on
+      the newest sample)
+
+  Arguments:
+    definition: 'name=expression' or 'name[units]=expression'
+  """
+  def __init__(self, definition: str) -> None:
+    name, sep, expression = definition.partition('=')
+    if not sep:
+      raise ValueError(f"derived data definition '{definition}' is not of the form name=expression")
+    name = name.strip()
+    self.units = ''
+    if name.endswith(']') and '[' in name:
+      name, units = name[:-1].split('[', 1)
+      name, self.units = name.strip(), units.strip()
+    if not name.isidentifier():
+      raise ValueError(f"derived data name '{name}' is not a valid identifier")
+    self.name = name
+    self.expression = expression.strip()
+
+    tree = ast.parse(self.expression, mode='eval')
+    self.code = compile(tree, f"<derived {self.name}>", 'eval')
+    self.state = StreamState()
+    self.functions = self.make_functions()
+    self.inputs: List[str] = []
+    for node in ast.walk(tree):
+      if isinstance(node, ast.Name) and node.id not in self.functions and node.id not in self.inputs:
+        self.inputs.append(node.id)
+    if not self.inputs:
+      raise ValueError(f"derived data '{self.name}' does not use any data")
+
+  def make_functions(self) -> Dict[str, Any]:
+    return {
+      'abs': np.abs, 'sign': np.sign, 'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+      'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+      'arcsin': np.arcsin, 'arccos': np.arccos, 'arctan': np.arctan, 'arctan2': np.arctan2, 'hypot': np.hypot,
+      'floor': np.floor, 'ceil': np.ceil, 'round': np.round,
+      'minimum': np.minimum, 'maximum': np.maximum, 'clip': np.clip, 'where': np.where,
+      'pi': math.pi, 'e': math.e, 'nan': math.nan,
+
+      'sum': lambda x: np.sum(x, axis=1), 'mean': lambda x: np.mean(x, axis=1),
+      'amin': lambda x: np.min(x, axis=1), 'amax': lambda x: np.max(x, axis=1),
+      'argmin': lambda x: np.argmin(x, axis=1), 'argmax': lambda x: np.argmax(x, axis=1),
+      'centroid': centroid,
+
+      'prev': self.prev, 'diff': self.diff, 'cumsum': self.cumsum, 'ema': self.ema,
+    }
+
+  def prev(self, x: Any) -> np.ndarray:
+    slot = self.state.next_slot()
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 0 or len(x) == 0:
+      return x
+    last = slot.get('last', np.full(x.shape[1:], np.nan))
+    slot['last'] = x[-1]
+    return np.concatenate([last[np.newaxis], x[:-1]])
+
+  def diff(self, x: Any) -> np.ndarray:
+    return x - self.prev(x)
+
+  def cumsum(self, x: Any) -> np.ndarray:
+    slot = self.state.next_slot()
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 0 or len(x) == 0:
+      return x
+    out = slot.get('total', 0.0) + np.cumsum(x, axis=0)
+    slot['total'] = out[-1]
+    return out
+
+  def ema(self, x: Any, alpha: float) -> np.ndarray:
+    """Computes y[i] = alpha * x[i] + (1 - alpha) * y[i - 1] without a loop
+    over samples: within a block, y[i] = d^(i+1) * (y[-1] + alpha * cumsum(x[k] / d^(k+1)))
+    where d = 1 - alpha, with blocks short enough that d^-k stays representable.
+    """
+    slot = self.state.next_slot()
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 0 or len(x) == 0:
+      return x
+    last = slot.get('last', x[0])
+    decay = 1.0 - alpha
+    if decay <= 0:
+      out = x.copy()
+    else:
+      out = np.empty_like(x)
+      if decay >= 1:
+        block_length = len(x)
+      else:
+        block_length = max(1, int(math.log(EMA_MAX_DYNAMIC_RANGE) / -math.log(decay)))
+      for start in range(0, len(x), block_length):
+        block = x[start:start + block_length]
+        powers = (decay ** np.arange(1, len(block) + 1)).reshape((-1, ) + (1, ) * (x.ndim - 1))
+        out[start:start + len(block)] = powers * (last + alpha * np.cumsum(block / powers, axis=0))
+        last = out[start + len(block) - 1]
+    slot['last'] = out[-1]
+    return out
+
+  def reset(self) -> None:
+    """Forgets the state of stateful functions, like at a new header."""
+    self.state.reset()
+
+  def evaluate(self, inputs: Dict[str, np.ndarray], samples: int) -> np.ndarray:
+    """Evaluates the expression over a batch of samples of each input, returning
+    a 1-D (numeric) or 2-D (array) result with one row per sample.
+    """
+    namespace: Dict[str, Any] = {'__builtins__': {}}
+    namespace.update(self.functions)
+    namespace.update({name: inputs[name] for name in self.inputs})
+    self.state.begin()
+    with np.errstate(all='ignore'):  # NaN and inf are valid results, like dividing by a zero time step
+      out = np.asarray(eval(self.code, namespace), dtype=np.float64)
+    if out.ndim == 0:
+      out = np.full(samples, out)
+    if out.ndim > 2 or out.shape[0] != samples:
+      raise ValueError(f"derived data '{self.name}' has shape {out.shape[1:]} per sample, "
+                       "expected a number or 1-D array")
+    return out
+
+  def probe(self, shapes: Dict[str, Tuple[int, ...]]) -> Tuple[int, ...]:
+    """Returns the per-sample shape of the result given the per-sample shapes
+    of the inputs, resetting the state. Raises on invalid expressions.
+    """
+    out = self.evaluate({name: np.zeros((2, ) + shapes[name]) for name in self.inputs}, 2)
+    self.reset()
+    return out.shape[1:]
+
+
+class DerivedData:
+  """Mixin for derived data definitions, which have no header on the wire and
+  can't be set on the car. Values are floats.
+  """
+  def init_derived(self, data_id: int, channel: DerivedChannel) -> None:
+    self.data_id = data_id
+    self.internal_name = channel.name
+    self.display_name = channel.name
+    self.units = channel.units
+    self.latest_value: Any = None
+    self.subtype = NUMERIC_SUBTYPE_FLOAT
+    self.length = 4
+    self.limits = [0, 0]  # autoscale
+    self.expression = channel.expression
+
+  def serialize_data(self, value: Any) -> bytes:
+    raise ValueError(f"{self.internal_name} is derived data and can't be set")
+
+
+class DerivedNumericData(DerivedData, NumericData):
+  def __init__(self, data_id: int, channel: DerivedChannel) -> None:
+    self.data_type = DATATYPE_NUMERIC
+    self.init_derived(data_id, channel)
+
+
+class DerivedNumericArray(DerivedData, NumericArray):
+  def __init__(self, data_id: int, channel: DerivedChannel, count: int) -> None:
+    self.data_type = DATATYPE_NUMERIC_ARRAY
+    self.init_derived(data_id, channel)
+    self.count = count
+
+
+class DerivedChannels:
+  """Computes derived data on the live packet stream. Headers passed through
+  process get definitions for the derived data added (with data IDs from
+  DERIVED_DATAID_BASE, in a copy of the definitions, so the decoder's context
+  is left as received), and data packets get the derived values added to their
+  data, so downstream code (plots, CSV logging) treats them like any other
+  data. Derived data is computed for the packets that contain all its inputs.
+
+  Arguments:
+    definitions: derived data definitions, see DerivedChannel
+  """
+  def __init__(self, definitions: Sequence[str]) -> None:
+    self.channels = [DerivedChannel(definition) for definition in definitions]
+    self.active: List[Tuple[DerivedChannel, TelemetryData, List[int]]] = []  # with input data IDs
+
+  def set_header(self, header: HeaderPacket) -> None:
+    # extend a copy, since the decoder's context shares the header's definitions
+    data_defs: Dict[int, TelemetryData] = dict(header.get_data_defs())
+    ids_by_name = {data_def.internal_name: data_id for data_id, data_def in data_defs.items()}
+    shapes: Dict[str, Tuple[int, ...]] = {
+      data_def.internal_name: (data_def.count, ) if isinstance(data_def, NumericArray) else ()  # type: ignore
+      for data_def in data_defs.values()}
+
+    self.active = []
+    next_id = DERIVED_DATAID_BASE
+    for channel in self.channels:
+      missing = [name for name in channel.inputs if name not in ids_by_name]
+      if missing:
+        print(f"Derived data '{channel.name}' not computed: {', '.join(missing)} not in header")
+        continue
+      if channel.name in ids_by_name:
+        print(f"Derived data '{channel.name}' not computed: name already in header")
+        continue
+      try:
+        shape = channel.probe({name: shapes[name] for name in channel.inputs})
+      except Exception as e:
+        print(f"Derived data '{channel.name}' not computed: {e}")
+        continue
+
+      data_def: TelemetryData
+      if shape:
+        data_def = DerivedNumericArray(next_id, channel, shape[0])
+      else:
+        data_def = DerivedNumericData(next_id, channel)
+      data_defs[next_id] = data_def
+      ids_by_name[channel.name] = next_id
+      shapes[channel.name] = shape
+      self.active.append((channel, data_def, [ids_by_name[name] for name in channel.inputs]))
+      next_id += 1
+    header.data = data_defs
+
+  def process(self, packets: Sequence[TelemetryPacket]) -> None:
+    """Adds derived data to a batch of received packets, in place. Data packets
+    are evaluated together, in runs between headers.
+    """
+    batch: List[DataPacket] = []
+    for packet in packets:
+      if isinstance(packet, HeaderPacket):
+        self.compute(batch)
+        batch = []
+        self.set_header(packet)
+      elif isinstance(packet, DataPacket):
+        batch.append(packet)
+    self.compute(batch)
+
+  def compute(self, packets: List[DataPacket]) -> None:
+    for channel, data_def, input_ids in self.active:
+      rows = [packet for packet in packets if all(data_id in packet.data for data_id in input_ids)]
+      if not rows:
+        continue
+      inputs = {name: np.array([packet.data[data_id] for packet in rows], dtype=np.float64)
+                for name, data_id in zip(channel.inputs, input_ids)}
+      values = channel.evaluate(inputs, len(rows)).tolist()
+      for packet, value in zip(rows, values):
+        packet.data[data_def.data_id] = value
+      data_def.set_latest_value(values[-1])
+
+
+def column_rows(indep_values: np.ndarray, x_values: np.ndarray) -> np.ndarray:
+  """Returns the row index of each value of a column, given the independent
+  value of every row, by matching the column's independent values in order to
+  the rows. Repeated (or reset) independent values are kept, and where a column
+  skips some of the rows with a repeated value, the earliest are assumed. Raises
+  ValueError if the column's values can't be rows of the log.
+  """
+  if len(x_values) == len(indep_values) and np.array_equal(x_values, indep_values):
+    return np.arange(len(x_values))  # present in every row, the common case
+  if len(indep_values) < 2 or np.all(indep_values[1:] >= indep_values[:-1]):
+    # sorted rows, so each value's occurrences in the column are its first rows in the log
+    occurrence = np.arange(len(x_values)) - np.searchsorted(x_values, x_values, side='left')
+    rows = np.searchsorted(indep_values, x_values, side='left') + occurrence
+    valid = rows < len(indep_values)
+    if np.all(valid) and np.all(indep_values[rows[valid]] == x_values) and np.all(np.diff(rows) > 0):
+      return rows
+  else:  # the independent variable resets, so match sequentially
+    rows_list: List[int] = []
+    row = 0
+    indep_list = indep_values.tolist()
+    for x_value in x_values.tolist():
+      while row < len(indep_list) and indep_list[row] != x_value:
+        row += 1
+      if row == len(indep_list):
+        break
+      rows_list.append(row)
+      row += 1
+    if len(rows_list) == len(x_values):
+      return np.array(rows_list, dtype=np.intp)
+  raise ValueError("column independent values are not in the order of the log rows")
+
+
+class LogDerivedChannels:
+  """Computes derived data on parsed CSV logs, as extra columns evaluated over
+  the rows where all the inputs are present, lined up by row (so repeated or
+  reset independent values are kept in order). The
+  independent column can also be used as an input. State
+  carries over between calls, so appended data (like from a LogFollower) can
+  be passed in as it arrives.
+
+  Arguments:
+    definitions: derived data definitions, see DerivedChannel
+  """
+  def __init__(self, definitions: Sequence[str]) -> None:
+    self.channels = [DerivedChannel(definition) for definition in definitions]
+
+  def process(self, logdata: LogData) -> LogData:
+    """Returns the log data with the derived columns appended. Raises
+    ValueError if an input is missing, or can't be lined up with the rows.
+    """
+    columns = {column.name: column for column in logdata.columns if column.coltype != COLTYPE_HIDDEN}
+    derived_columns: List[LogColumn] = []
+    for channel in self.channels:
+      if channel.name in logdata.names:
+        raise ValueError(f"derived data '{channel.name}' is already a column in the log")
+      indep_name = logdata.names[0]
+      dep_inputs = [name for name in channel.inputs if name != indep_name]
+      missing = [name for name in dep_inputs if name not in columns]
+      if missing:
+        raise ValueError(f"derived data '{channel.name}' inputs {', '.join(missing)} not in log")
+      if not dep_inputs:
+        raise ValueError(f"derived data '{channel.name}' only uses the independent column")
+
+      rows = column_rows(logdata.indep_values, columns[dep_inputs[0]].x_values)
+      indices = [np.arange(len(rows))]
+      for name in dep_inputs[1:]:
+        rows, common_indices, input_indices = np.intersect1d(
+            rows, column_rows(logdata.indep_values, columns[name].x_values), assume_unique=True, return_indices=True)
+        indices = [index[common_indices] for index in indices] + [input_indices]
+      x_values = logdata.indep_values[rows]
+      inputs = {name: np.asarray(columns[name].y_values, dtype=np.float64)[index]
+                for name, index in zip(dep_inputs, indices)}
+      inputs[indep_name] = np.asarray(x_values, dtype=np.float64)
+      y_values = channel.evaluate(inputs, len(x_values))
+
+      column = LogColumn(channel.name, COLTYPE_ARRAY if y_values.ndim == 2 else COLTYPE_NUMERIC,
+                         x_values, y_values)
+      columns[channel.name] = column
+      derived_columns.append(column)
+
+    return LogData(logdata.names + [channel.name for channel in self.channels],
+                   logdata.columns + derived_columns, logdata.first_x, logdata.last_x, logdata.indep_values)
@@ -0,0 +1,269 @@
+"""Time-aligned merge of multiple logs (and captures, or packets from links),
+like from two cars or a car and a trackside sensor, into one CSV log.
+
+Each source is a stream of rows ordered by a shared independent variable (like
+'time'), shifted by a per-source offset onto the time base of the first
+source. Offsets are given, or estimated by cross-correlating a signal seen by
+both sources. The shifted streams are combined with a heap-based k-way merge,
+so merging holds one pending row per source regardless of log length (only
+offset estimation loads the correlated columns into memory).
+
+The merged log has the aligned independent column followed by every source's
+dependent columns, renamed to 'label_name', with each row filled in only for
+its source's columns. Since log column types are inferred from the first data
+row, that row has no independent value (so loading skips it, like out-of-band
+data) and marks array columns with '[]'.
+"""
+from typing import Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+import csv
+import heapq
+
+import numpy as np  # type: ignore
+
+from .capture import is_capture_file, read_capture
+from .csvlog import infer_column_types, COLTYPE_ARRAY, COLTYPE_NUMERIC
+from .parser import DataPacket, HeaderPacket, NumericArray
+
+
+CORRELATE_MAX_SAMPLES = 1 << 22  # resampled length limit of each correlated signal, the step is widened to fit
+CORRELATE_MIN_OVERLAP = 0.5  # fraction of the shorter signal that must overlap at searched offsets
+MERGE_PROGRESS_ROWS = 65536  # rows between progress messages
+
+# a row of a source, as (independent value, independent cell, dependent cells)
+SourceRow = Tuple[float, str, List[str]]
+
+
+class MergeSource:
+  """A log to merge, which can be read (as rows ordered by the independent
+  variable) any number of times.
+
+  Arguments:
+    name: description for messages, like the filename
+    names: names of the dependent columns
+    coltypes: column type of each dependent column
+  """
+  def __init__(self, name: str, names: List[str], coltypes: List[str]) -> None:
+    self.name = name
+    self.names = names
+    self.coltypes = coltypes
+    self.offset = 0.0  # added to independent values to align them with the first source
+
+  def read_rows(self) -> Iterator[SourceRow]:
+    raise NotImplementedError
+
+  def rows(self) -> Iterator[SourceRow]:
+    """Yields the rows with the offset applied, raising ValueError if the
+    independent variable decreases (like when the car was reset mid-log).
+    """
+    last_x = -np.inf
+    for x, x_cell, cells in self.read_rows():
+      if x < last_x:
+        raise ValueError(f"independent values of '{self.name}' decrease from {last_x} to {x}, "
+                         "split it where the car was reset")
+      last_x = x
+      if self.offset:
+        yield x + self.offset, format(x + self.offset, '.12g'), cells
+      else:
+        yield x, x_cell, cells
+
+  def read_column(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the (unshifted) independent values and values of a numeric
+    column, where present.
+    """
+    if name not in self.names:
+      raise ValueError(f"'{name}' not in '{self.name}'")
+    col_idx = self.names.index(name)
+    if self.coltypes[col_idx] != COLTYPE_NUMERIC:
+      raise ValueError(f"'{name}' in '{self.name}' is not numeric")
+    x_values: List[float] = []
+    y_values: List[float] = []
+    for x, _, cells in self.read_rows():
+      if col_idx < len(cells) and cells[col_idx]:
+        x_values.append(x)
+        y_values.append(float(cells[col_idx]))
+    return np.array(x_values, dtype=np.float64), np.array(y_values, dtype=np.float64)
+
+
+class CsvSource(MergeSource):
+  """A CSV log, like those written by CsvLogger, with column types inferred
+  like load_log. The independent column can be anywhere in the row.
+  """
+  def __init__(self, filename: str, indep_name: str, skip_data_rows: int = 0) -> None:
+    with open(filename, 'rb') as f:
+      names = next(csv.reader([f.readline().decode('utf-8')]))
+      for i in range(skip_data_rows):  # skip skipped rows
+        f.readline()
+      self.data_start = f.tell()
+      data_row = next(csv.reader([f.readline().decode('utf-8')]), [])
+    if indep_name not in names:
+      raise ValueError(f"independent variable '{indep_name}' not in '{filename}'")
+    self.filename = filename
+    self.indep_idx = names.index(indep_name)
+    dep_names = names[:self.indep_idx] + names[self.indep_idx + 1:]
+    dep_cells = data_row[:self.indep_idx] + data_row[self.indep_idx + 1:]
+    # infer_column_types discards the first (independent) column
+    super().__init__(filename, dep_names, infer_column_types([indep_name] + dep_names, [''] + dep_cells, ()))
+
+  def read_rows(self) -> Iterator[SourceRow]:
+    with open(self.filename, 'rb') as f:
+      f.seek(self.data_start)
+      for row in csv.reader(line.decode('utf-8') for line in f):
+        if self.indep_idx >= len(row) or not row[self.indep_idx]:
+          continue  # like out-of-band data
+        x_cell = row[self.indep_idx]
+        yield float(x_cell), x_cell, row[:self.indep_idx] + row[self.indep_idx + 1:]
+
+
+class PacketSource(MergeSource):
+  """Data packets, like from a capture file or a link, with cells formatted
+  like CsvLogger. Packets without the independent variable are skipped. The
+  packets can only be read once, unless they are a sequence.
+  """
+  def __init__(self, name: str, header: HeaderPacket, packets: Iterable[DataPacket], indep_name: str) -> None:
+    data_defs = sorted(header.get_data_defs().items())
+    ids_by_name = {data_def.internal_name: data_id for data_id, data_def in data_defs}
+    if indep_name not in ids_by_name:
+      raise ValueError(f"independent variable '{indep_name}' not in '{name}'")
+    self.indep_id = ids_by_name[indep_name]
+    self.dep_ids = [data_id for data_id, _ in data_defs if data_id != self.indep_id]
+    self.packets = packets
+    super().__init__(name, [header.get_data_defs()[data_id].internal_name for data_id in self.dep_ids],
+                     [COLTYPE_ARRAY if isinstance(header.get_data_defs()[data_id], NumericArray) else COLTYPE_NUMERIC
+                      for data_id in self.dep_ids])
+
+  def read_rows(self) -> Iterator[SourceRow]:
+    for packet in self.packets:
+      x = packet.get_data_by_id(self.indep_id)
+      if x is None:
+        continue
+      values = [packet.get_data_by_id(data_id) for data_id in self.dep_ids]
+      yield float(x), str(x), ['' if value is None else str(value) for value in values]
+
+
+def open_source(filename: str, indep_name: str, skip_data_rows: int = 0) -> MergeSource:
+  """Opens a CSV log or trigger capture file as a merge source."""
+  if is_capture_file(filename):
+    header, packets, _ = read_capture(filename)
+    return PacketSource(filename, header, packets, indep_name)
+  return CsvSource(filename, indep_name, skip_data_rows)
+
+
+def resample(x_values: np.ndarray, y_values: np.ndarray, step: float) -> Tuple[float, np.ndarray]:
+  """Returns the start and values of a signal linearly interpolated every step
+  over its span, without non-finite samples.
+  """
+  finite = np.isfinite(y_values)
+  x_values, y_values = x_values[finite], y_values[finite]
+  if len(x_values) < 2:
+    raise ValueError("at least 2 finite samples are needed to correlate")
+  grid = x_values[0] + np.arange(int((x_values[-1] - x_values[0]) / step) + 1) * step
+  return float(x_values[0]), np.interp(grid, x_values, y_values)
+
+
+def estimate_offset(reference: Tuple[np.ndarray, np.ndarray], signal: Tuple[np.ndarray, np.ndarray],
+                    step: Optional[float] = None, guess: float = 0.0,
+                    max_offset: Optional[float] = None) -> Tuple[float, float]:
+  """Estimates the offset to add to the independent values of signal to align
+  it with reference, both given as (independent values, values) of the same
+  quantity, by the peak of their cross-correlation. Both are resampled every
+  step, by default the median sample interval of reference. Returns the
+  offset, refined to a fraction of a step, and the normalized correlation of
+  the overlapping parts at that offset (1 for a perfect match), as a measure
+  of confidence. Only offsets where at least CORRELATE_MIN_OVERLAP of the
+  shorter signal overlaps the other are searched.
+
+  Arguments:
+    guess, max_offset: only search offsets within max_offset of guess, for signals
+      that repeat (like laps), where None searches all offsets
+  """
+  if step is None:
+    step = float(np.median(np.diff(reference[0])))
+  spans = [x_values[-1] - x_values[0] for x_values, _ in (reference, signal)]
+  step = max(step, max(spans) / CORRELATE_MAX_SAMPLES)
+  if not step > 0:
+    raise ValueError("the correlation step must be positive")
+
+  ref_start, ref_values = resample(reference[0], reference[1], step)
+  start, values = resample(signal[0], signal[1], step)
+  ref_values = ref_values - np.mean(ref_values)
+  values = values - np.mean(values)
+
+  # correlation[lag] = sum(ref_values[i + lag] * values[i]), by FFT with enough padding not to wrap
+  fft_length = 1 << (len(ref_values) + len(values) - 2).bit_length()
+  correlation = np.fft.irfft(np.fft.rfft(ref_values, fft_length) * np.conj(np.fft.rfft(values, fft_length)),
+                             fft_length)
+  lags = np.arange(fft_length)
+  lags[lags >= len(ref_values)] -= fft_length
+
+  # normalize by the energy of the overlapping parts, so offsets with less overlap aren't penalized
+  ref_lo = np.clip(lags, 0, len(ref_values))
+  ref_hi = np.clip(lags + len(values), 0, len(ref_values))
+  ref_energy = np.concatenate(([0], np.cumsum(ref_values ** 2)))
+  energy = np.concatenate(([0], np.cumsum(values ** 2)))
+  lo, hi = np.clip(ref_lo - lags, 0, len(values)), np.clip(ref_hi - lags, 0, len(values))
+  overlap_energy = (ref_energy[ref_hi] - ref_energy[ref_lo]) * (energy[hi] - energy[lo])
+  with np.errstate(divide='ignore', invalid='ignore'):
+    score = correlation / np.sqrt(overlap_energy)
+
+  offsets = ref_start + lags * step - start
+  valid = (ref_hi - ref_lo >= CORRELATE_MIN_OVERLAP * min(len(ref_values), len(values))) & (overlap_energy > 0)
+  if max_offset is not None:
+    valid &= np.abs(offsets - guess) <= max_offset
+  if not valid.any():
+    raise ValueError("no offsets with enough overlap to search")
+  peak = int(np.argmax(np.where(valid, score, -np.inf)))
+
+  # refine by fitting a parabola through the peak and its neighbors
+  fraction = 0.0
+  before, after = (peak - 1) % fft_length, (peak + 1) % fft_length
+  if valid[before] and valid[after]:
+    curvature = score[before] - 2 * score[peak] + score[after]
+    if curvature < 0:
+      fraction = 0.5 * (score[before] - score[after]) / curvature
+  return float(offsets[peak] + fraction * step), float(score[peak])
+
+
+def merge_rows(sources: Sequence[MergeSource]) -> Iterator[Tuple[float, int, str, List[str]]]:
+  """Yields the rows of all sources, with offsets applied, in order of the
+  aligned independent variable (ties in source order), as (independent value,
+  source index, independent cell, dependent cells).
+  """
+  def tagged_rows(source_idx: int, source: MergeSource) -> Iterator[Tuple[float, int, str, List[str]]]:
+    for x, x_cell, cells in source.rows():
+      yield x, source_idx, x_cell, cells
+
+  return heapq.merge(*[tagged_rows(source_idx, source) for source_idx, source in enumerate(sources)],
+                     key=lambda row: row[0])
+
+
+def write_merged(file: TextIO, sources: Sequence[MergeSource], labels: Sequence[str], indep_name: str) -> int:
+  """Writes the merged log of sources (see the module docstring) as CSV to
+  file, which should be opened with newline=''. Returns the number of data
+  rows written.
+  """
+  assert len(labels) == len(sources), "one label is needed per source"
+  names = [indep_name]
+  coltypes = []
+  column_starts = []  # merged column index of the first dependent column of each source
+  for label, source in zip(labels, sources):
+    column_starts.append(len(names))
+    names.extend(f"{label}_{name}" for name in source.names)
+    coltypes.extend(source.coltypes)
+
+  writer = csv.writer(file)
+  writer.writerow(names)
+  writer.writerow([''] + ['[]' if coltype == COLTYPE_ARRAY else '' for coltype in coltypes])
+
+  row_count = 0
+  for _, source_idx, x_cell, cells in merge_rows(sources):
+    row = [''] * len(names)
+    row[0] = x_cell
+    start = column_starts[source_idx]
+    width = len(sources[source_idx].names)
+    row[start:start + min(width, len(cells))] = cells[:width]
+    writer.writerow(row)
+    row_count += 1
+    if row_count % MERGE_PROGRESS_ROWS == 0:
+      print(f"working: merged {row_count} rows", end='\r')
+  return row_count
+
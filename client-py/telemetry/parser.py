@@ -153,6 +153,10 @@ def serialize_numeric(value, subtype, length):
 
 PACKET_LENGTH_BYTES = 2 # number of bytes in the packet length field
 
+# byte stuffing: a zero is inserted after each occurrence of the first SOF byte
+STUFF_FIND = bytes(SOF_BYTE[:1])
+STUFF_REPLACE = bytes([SOF_BYTE[0], 0x00])
+
 class TelemetryDeserializationError(Exception):
   pass
 
@@ -238,6 +242,11 @@ class TelemetryData(object):
     """
     raise NotImplementedError
 
+  def get_payload_length(self):
+    """Returns the number of bytes this data takes up in a data packet.
+    """
+    raise NotImplementedError
+
   def get_latest_value(self):
     return self.latest_value
 
@@ -265,6 +274,9 @@ class NumericData(TelemetryData):
   def serialize_data(self, value):
     return serialize_numeric(value, self.subtype, self.length)
 
+  def get_payload_length(self):
+    return self.length
+
 datatype_registry[DATATYPE_NUMERIC] = NumericData
 
 class NumericArray(TelemetryData):
@@ -293,6 +305,9 @@ class NumericArray(TelemetryData):
       out += serialize_numeric(elt, self.subtype, self.length)
     return out
 
+  def get_payload_length(self):
+    return self.length * self.count
+
 datatype_registry[DATATYPE_NUMERIC_ARRAY] = NumericArray
 
 class PacketSizeError(TelemetryDeserializationError):
@@ -317,6 +332,8 @@ class TelemetryPacket(object):
     return packet_cls(byte_stream, context)
 
   def __init__(self, byte_stream, context):
+    self.raw = bytes(byte_stream)  # destuffed packet bytes, for re-framing without re-encoding
+    self.rx_time = None  # host time.monotonic() when received, set by the deserializer
     self.opcode = deserialize_uint8(byte_stream)
     self.sequence = deserialize_uint8(byte_stream)
     self.decode_payload(byte_stream, context)
@@ -367,6 +384,9 @@ class DataPacket(TelemetryPacket):
       data_def = context.get_data_def(data_id)
       if not data_def:
         raise UndefinedDataIdError("Received DataId %02x not defined in header" % data_id)
+      if context.decode_ids is not None and data_id not in context.decode_ids:
+        del byte_stream[:data_def.get_payload_length()]
+        continue
       data_value = data_def.deserialize_data(byte_stream)
       data_def.set_latest_value(data_value)
       self.data[data_def.data_id] = data_value
@@ -387,8 +407,9 @@ class TelemetryContext(object):
   """Context for telemetry communications, containing the setup information in
   the header.
   """
-  def __init__(self, data_defs):
+  def __init__(self, data_defs, decode_ids=None):
     self.data_defs = data_defs
+    self.decode_ids = decode_ids  # data IDs to decode in data packets, None for all
 
   def get_data_def(self, data_id):
     if data_id in self.data_defs:
@@ -399,6 +420,77 @@ class TelemetryContext(object):
 
 from typing import List, Tuple
 
+SEQUENCE_MODULUS = 256  # sequence numbers are a wrapping uint8
+
+class LinkStats(object):
+  """Link quality statistics from packet sequence numbers: counts of received
+  and lost packets, a histogram of loss burst lengths, and packet and byte
+  rates over a sliding time window. Bursts of SEQUENCE_MODULUS or more lost
+  packets can't be distinguished from shorter ones and are undercounted.
+  Counting restarts after each header, since a header starts a new stream
+  (like after the car restarts, or a broker replaying its latest header to a
+  new client), so the sequence jumps around it aren't losses.
+
+  Arguments:
+    window: length of the rate window, in seconds
+  """
+  def __init__(self, window=1.0):
+    self.window = window
+
+    self.received = 0
+    self.lost = 0
+    self.burst_histogram = {}  # number of consecutive lost packets -> occurrences
+    self.last_sequence = None
+
+    self.window_events = deque()  # of (time, packets, bytes), one per chunk of received data
+    self.window_packets = 0
+    self.window_bytes = 0
+
+  def add_packet(self, sequence, is_header=False):
+    if is_header:
+      self.last_sequence = None  # count from the packet after it
+      self.received += 1
+      return
+    if self.last_sequence is not None:
+      gap = (sequence - self.last_sequence - 1) % SEQUENCE_MODULUS
+      if gap:
+        self.lost += gap
+        self.burst_histogram[gap] = self.burst_histogram.get(gap, 0) + 1
+    self.last_sequence = sequence
+    self.received += 1
+
+  def add_data(self, now, packets, num_bytes):
+    """Records a chunk of received data containing some number of packets."""
+    self.window_events.append((now, packets, num_bytes))
+    self.window_packets += packets
+    self.window_bytes += num_bytes
+    self.expire(now)
+
+  def expire(self, now):
+    while self.window_events and self.window_events[0][0] < now - self.window:
+      _, packets, num_bytes = self.window_events.popleft()
+      self.window_packets -= packets
+      self.window_bytes -= num_bytes
+
+  def get_packet_rate(self, now=None):
+    """Returns the received packets per second over the window."""
+    self.expire(time.time() if now is None else now)
+    return self.window_packets / self.window
+
+  def get_byte_rate(self, now=None):
+    """Returns the received bytes (including out-of-band data) per second over the window."""
+    self.expire(time.time() if now is None else now)
+    return self.window_bytes / self.window
+
+  def get_loss_fraction(self):
+    total = self.received + self.lost
+    return self.lost / total if total else 0.0
+
+  def __str__(self):
+    return "%.0f packets/s, %.1f kB/s, %i received, %i lost (%.2f%%)" % (
+        self.get_packet_rate(), self.get_byte_rate() / 1000, self.received, self.lost,
+        self.get_loss_fraction() * 100)
+
 class TelemetryDeserializer():
   """Telemetry deserializer state machine: separates out telemetry packets
   from the rest of the stream.
@@ -410,13 +502,30 @@ class TelemetryDeserializer():
     self.packet_length = 0
     self.last_destuff_idx = 0
 
-    self.context = TelemetryContext([])
+    self.context = TelemetryContext({})
+    self.decode_names = None  # internal names of data to decode, None for all
+    self.link_stats = LinkStats()
 
     self.buffer: bytearray = bytearray()
 
-  def process_data(self, data: bytes) -> Tuple[List[TelemetryPacket], str]:
-    out_of_band_data = ""
+  def set_decode_names(self, names):
+    """Sets the internal names of the data to decode (others are skipped over
+    and left out of data packets), or None to decode all data.
+    """
+    self.decode_names = names
+    if names is None:
+      self.context.decode_ids = None
+    else:
+      self.context.decode_ids = set(data_id for data_id, data_def in self.context.data_defs.items()
+                                    if data_def.internal_name in names)
+
+  def process_data(self, data: bytes) -> Tuple[List[TelemetryPacket], bytes]:
+    """Returns the packets completed by the received bytes, and the
+    out-of-band (non-telemetry) bytes among them, undecoded.
+    """
+    out_of_band_data = bytearray()
     decoded_packets: List[TelemetryPacket] = []
+    rx_time = time.monotonic()  # packets are stamped per received chunk
 
     self.buffer += data
 
@@ -430,15 +539,15 @@ class TelemetryDeserializer():
         self.last_destuff_idx = 0
       elif not self.in_packet:
         if next_sof != -1:
-          out_of_band_data += self.buffer[:next_sof].decode('utf-8')
+          out_of_band_data += self.buffer[:next_sof]
           self.buffer = self.buffer[next_sof:]
         else:
           if self.buffer[-1] == SOF_BYTE[0]:
-            out_of_band_data += self.buffer[:-1].decode('utf-8')
+            out_of_band_data += self.buffer[:-1]
             del self.buffer[:-1]
             break
           else:
-            out_of_band_data += self.buffer.decode('utf-8')
+            out_of_band_data += self.buffer
             self.buffer = bytearray()
       else:  # in packet, starting at length
         if self.packet_length == 0:
@@ -467,12 +576,13 @@ class TelemetryDeserializer():
           print(f"discarding short packet {self.buffer[:next_sof]}, sof at {next_sof} but expected len {self.packet_length}")
 
         packet_bytearray = self.buffer[:self.packet_length].copy()
-        decoded = TelemetryPacket.decode(packet_bytearray, self.context)
-
         try:
-
+          decoded = TelemetryPacket.decode(packet_bytearray, self.context)
+          decoded.rx_time = rx_time
+          self.link_stats.add_packet(decoded.sequence, isinstance(decoded, HeaderPacket))
           if isinstance(decoded, HeaderPacket):
             self.context = TelemetryContext(decoded.get_data_defs())
+            self.set_decode_names(self.decode_names)
           decoded_packets.append(decoded)
         except TelemetryDeserializationError as e:
           print("Deserialization error: %s" % repr(e)) # TODO prettier cleaner
@@ -481,51 +591,223 @@ class TelemetryDeserializer():
         del self.buffer[:self.packet_length]
         self.in_packet = False
 
-    return (decoded_packets, out_of_band_data)
+    self.link_stats.add_data(time.time(), len(decoded_packets), len(data))
+    return (decoded_packets, bytes(out_of_band_data))
 
 
-class TelemetrySerial(object):
-  def __init__(self, serial):
-    self.serial = serial
+def frame_packet(packet):
+  """Returns the on-the-wire bytes for a packet payload: the start-of-frame
+  sequence and length followed by the byte-stuffed payload.
+  """
+  # TODO: add CRC support
+  return (bytes(SOF_BYTE) + serialize_uint16(len(packet))
+          + bytes(packet).replace(STUFF_FIND, STUFF_REPLACE))
+
+def framed_length(packet):
+  """Returns the length of a packet payload once framed and stuffed."""
+  return len(SOF_BYTE) + PACKET_LENGTH_BYTES + len(packet) + packet.count(SOF_BYTE[0])
+
+
+# Receive buffer size on the car (TELEMETRY_SERIAL_RX_BUFFER_SIZE), so the
+# largest set packet it can take at once.
+CAR_RX_BUFFER_SIZE = 256
+
+class SetPacketQueue(object):
+  """Queue of pending remote set operations, which are sent coalesced into as
+  few data packets as possible. Only the latest value per data ID is kept, and
+  transmission can be rate-limited. The token bucket starts with, and holds at
+  most, one maximum-size packet's worth of bytes, so a burst of sets goes out
+  as one coalesced packet rather than many small ones.
+
+  Arguments:
+    rate: maximum transmit rate in bytes/s (of framed packets), or None for no limit
+    max_packet_size: maximum framed size of a packet, larger single values are
+      sent alone regardless
+  """
+  def __init__(self, rate=None, max_packet_size=CAR_RX_BUFFER_SIZE):
+    self.rate = rate
+    self.max_packet_size = max_packet_size
+
+    self.pending = {}  # data ID -> serialized value, in first-set order
+    self.tokens = max_packet_size  # bytes that may be sent now, one packet's worth
+    self.last_time = time.time()
+
+  def __len__(self):
+    return len(self.pending)
+
+  def set(self, data_id, serialized_value):
+    self.pending[data_id] = serialized_value
+
+  def next_packet(self):
+    """Returns the next packet payload to transmit, or None if nothing is
+    pending or the rate limit doesn't allow sending it yet.
+    """
+    if not self.pending:
+      return None
+
+    packet = bytearray()
+    packet += serialize_uint8(OPCODE_DATA)
+    length = framed_length(packet) + 1  # including the terminator
+    sent_ids = []
+    for data_id, serialized_value in self.pending.items():
+      field = serialize_uint8(data_id) + serialized_value
+      field_length = len(field) + field.count(SOF_BYTE[0])
+      if sent_ids and length + field_length > self.max_packet_size:
+        break
+      packet += field
+      length += field_length
+      sent_ids.append(data_id)
+    packet += serialize_uint8(DATAID_TERMINATOR)
+
+    if self.rate is not None:
+      now = time.time()
+      self.tokens = min(self.max_packet_size, self.tokens + (now - self.last_time) * self.rate)
+      self.last_time = now
+      if self.tokens < min(length, self.max_packet_size):
+        return None
+      self.tokens -= length
+
+    for data_id in sent_ids:
+      del self.pending[data_id]
+    return packet
+
+
+class TelemetryTransport(object):
+  """Base class for telemetry transports, handling decoding of received data
+  and its delivery to consumers.
+
+  Received packets and out-of-band characters are queued for next_rx_packet
+  and next_rx_byte. Consumers can instead (or additionally) subscribe
+  callbacks, called during process_rx, for headers, for data by internal name
+  (resolved on each header) and for out-of-band lines or raw bytes. A callback
+  can also be a queue's put (or a deque's append) method.
+
+  Consumers that only use subscriptions should set queue_rx to False, which
+  stops the queuing and lets the decoder skip data nobody subscribed to.
+  """
+  def __init__(self, tx_queue):
+    self.tx_queue = tx_queue
+    self.closed = False
 
     self.rx_packets = deque()  # queued decoded packets
     self.data_buffer = deque()
+    self.queue_rx = True
 
     # decoder state machine variables
     self.decoder = TelemetryDeserializer()
 
-  def process_rx(self):
-    while self.serial.inWaiting():
-      rx_byte = self.serial.read()
-      (packets, data_bytes) = self.decoder.process_data(rx_byte)
-      for packet in packets:
+    self.header_callbacks = []
+    self.data_callbacks = []  # of (internal name, callback)
+    self.data_callbacks_by_id = {}  # data ID -> list of callbacks, for the current header
+    self.oob_callbacks = []
+    self.oob_line = ""
+    self.oob_bytes_callbacks = []
+
+  def subscribe_header(self, callback):
+    """Calls callback(header_packet) on each received header.
+    """
+    self.header_callbacks.append(callback)
+    return callback
+
+  def subscribe_data(self, name, callback):
+    """Calls callback(value, data_packet) for each received value of the data
+    with the given internal name.
+    """
+    self.data_callbacks.append((name, callback))
+    self.resolve_data_callbacks()
+    return callback
+
+  def subscribe_oob(self, callback):
+    """Calls callback(line) for each complete out-of-band (non-telemetry) line,
+    without its trailing newline.
+    """
+    self.oob_callbacks.append(callback)
+    return callback
+
+  def subscribe_oob_bytes(self, callback):
+    """Calls callback(data) with the out-of-band bytes of each received chunk,
+    exactly as received, for consumers that forward rather than display them.
+    """
+    self.oob_bytes_callbacks.append(callback)
+    return callback
+
+  def unsubscribe(self, callback):
+    """Removes a callback from all subscriptions.
+    """
+    self.header_callbacks = [elt for elt in self.header_callbacks if elt is not callback]
+    self.data_callbacks = [elt for elt in self.data_callbacks if elt[1] is not callback]
+    self.oob_callbacks = [elt for elt in self.oob_callbacks if elt is not callback]
+    self.oob_bytes_callbacks = [elt for elt in self.oob_bytes_callbacks if elt is not callback]
+    self.resolve_data_callbacks()
+
+  def resolve_data_callbacks(self):
+    data_defs = self.decoder.context.data_defs
+    name_to_id = {data_def.internal_name: data_id for data_id, data_def in data_defs.items()}
+    self.data_callbacks_by_id = {}
+    for name, callback in self.data_callbacks:
+      if name in name_to_id:
+        self.data_callbacks_by_id.setdefault(name_to_id[name], []).append(callback)
+
+    if self.queue_rx:
+      self.decoder.set_decode_names(None)
+    else:
+      self.decoder.set_decode_names(set(name for name, _ in self.data_callbacks))
+
+  def process_rx_data(self, data):
+    """Decodes received bytes, queuing and dispatching the results.
+    """
+    if self.queue_rx == (self.decoder.decode_names is not None):
+      self.resolve_data_callbacks()  # queue_rx was changed, so update which data is decoded
+    (packets, oob_bytes) = self.decoder.process_data(data)
+
+    for packet in packets:
+      if self.queue_rx:
         self.rx_packets.append(packet)
-      for data_byte in data_bytes:
-        self.data_buffer.append(data_byte)
+      if isinstance(packet, HeaderPacket):
+        self.resolve_data_callbacks()
+        for callback in self.header_callbacks:
+          callback(packet)
+      elif isinstance(packet, DataPacket) and self.data_callbacks_by_id:
+        for data_id, value in packet.get_data_dict().items():
+          for callback in self.data_callbacks_by_id.get(data_id, ()):
+            callback(value, packet)
+
+    if oob_bytes:
+      for callback in self.oob_bytes_callbacks:
+        callback(oob_bytes)
+    data_bytes = oob_bytes.decode('utf-8', errors='replace')  # for display, forwarders use the raw bytes
+    if self.queue_rx:
+      self.data_buffer.extend(data_bytes)
+    if self.oob_callbacks and data_bytes:
+      lines = (self.oob_line + data_bytes).split('\n')
+      self.oob_line = lines.pop()
+      for line in lines:
+        for callback in self.oob_callbacks:
+          callback(line)
 
   def transmit_set_packet(self, data_def, value):
-    packet = bytearray()
-    packet += serialize_uint8(OPCODE_DATA)
-    packet += serialize_uint8(data_def.data_id)
-    packet += data_def.serialize_data(value)
-    packet += serialize_uint8(DATAID_TERMINATOR)
-    self.transmit_packet(packet)
-
-  def transmit_packet(self, packet):
-    header = bytearray()
-    for elt in SOF_BYTE:
-      header += serialize_uint8(elt)
-    header += serialize_uint16(len(packet))
+    """Queues a remote set, which is sent during the next process_rx (or
+    process_tx), coalesced with the other sets queued until then and as the
+    rate limit allows. Setting the same data again before then only replaces
+    the pending value.
+    """
+    self.tx_queue.set(data_def.data_id, data_def.serialize_data(value))
 
-    modified_packet = bytearray()
-    for packet_byte in packet:
-      modified_packet.append(packet_byte)
-      if packet_byte == SOF_BYTE[0]:
-        modified_packet.append(0x00)
+  def process_tx(self):
+    while True:
+      packet = self.tx_queue.next_packet()
+      if packet is None:
+        break
+      self.transmit_packet(packet)
 
-    self.serial.write(header + modified_packet)
+  def transmit_packet(self, packet):
+    return self.transmit_bytes(frame_packet(packet))
 
-    # TODO: add CRC support
+  def transmit_bytes(self, data):
+    """Transmits raw (out-of-band) bytes, outside any packet framing. Returns
+    whether the data was accepted.
+    """
+    raise NotImplementedError
 
   def next_rx_packet(self):
     if self.rx_packets:
@@ -540,65 +822,153 @@ class TelemetrySerial(object):
       return None
 
 
+class TelemetrySerial(TelemetryTransport):
+  def __init__(self, serial, tx_rate=None):
+    super(TelemetrySerial, self).__init__(SetPacketQueue(tx_rate))
+    self.serial = serial
+
+  @classmethod
+  def open(cls, port, baudrate, tx_rate=None):
+    """Opens the named serial port. pyserial is only imported here, so
+    programs that don't open serial ports neither load nor need it.
+    """
+    import serial  # type: ignore
+    return cls(serial.Serial(port, baudrate=baudrate), tx_rate)
+
+  def process_rx(self):
+    while self.serial.inWaiting():
+      self.process_rx_data(self.serial.read(self.serial.inWaiting()))
+    self.process_tx()
+
+  def transmit_bytes(self, data):
+    """Transmits raw (out-of-band) bytes, outside any packet framing. Returns
+    whether the data was accepted, which is always the case for serial ports.
+    """
+    self.serial.write(data)
+    return True
+
+  def fileno(self):
+    """Returns the serial port's file descriptor, for select (POSIX only).
+    """
+    return self.serial.fileno()
+
+
 import socket
 import errno
-class TelemetrySocket(object):
-  def __init__(self, hostname: str, port: int):
-    self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    self.socket.connect((hostname, port))
+class TelemetrySocket(TelemetryTransport):
+  """Telemetry over a TCP socket. Transmitted data is buffered (up to
+  max_tx_buffer bytes) and sent without blocking as the socket allows, during
+  transmits and process_rx, or on flush_tx for event loops that wait for the
+  socket (fileno) to become writable while wants_write.
+  """
+  def __init__(self, hostname: str, port: int, tx_rate=None, max_tx_buffer=65536):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((hostname, port))
+    self.init_socket(sock, SetPacketQueue(tx_rate), max_tx_buffer)
+
+  def init_socket(self, sock, tx_queue, max_tx_buffer):
+    super(TelemetrySocket, self).__init__(tx_queue)
+    self.socket = sock
     self.socket.setblocking(False)
-
-    self.rx_packets = deque()  # queued decoded packets
-    self.data_buffer = deque()
-
-    # decoder state machine variables
-    self.decoder = TelemetryDeserializer()
+    self.tx_buffer = bytearray()
+    self.max_tx_buffer = max_tx_buffer
 
   def process_rx(self):
+    self.flush_tx()
     msg = bytearray()
     try:
       while True:
-        msg += self.socket.recv(4096)
+        data = self.socket.recv(4096)
+        if not data:  # closed by the other end
+          self.closed = True
+          break
+        msg += data
     except BlockingIOError:
       pass  # nonblocking, ignore timeouts
-    (packets, data_bytes) = self.decoder.process_data(msg)
-    for packet in packets:
-      self.rx_packets.append(packet)
-    for data_byte in data_bytes:
-      self.data_buffer.append(data_byte)
+    except ConnectionResetError:
+      self.closed = True
+    self.process_rx_data(msg)
+    self.process_tx()
+
+  def process_tx(self):
+    # leave sets queued (where they keep coalescing) while the buffer is backed up
+    while self.tx_backlog() + self.tx_queue.max_packet_size <= self.max_tx_buffer:
+      packet = self.tx_queue.next_packet()
+      if packet is None:
+        break
+      self.transmit_packet(packet)
 
-  def transmit_set_packet(self, data_def, value):
-    packet = bytearray()
-    packet += serialize_uint8(OPCODE_DATA)
-    packet += serialize_uint8(data_def.data_id)
-    packet += data_def.serialize_data(value)
-    packet += serialize_uint8(DATAID_TERMINATOR)
-    self.transmit_packet(packet)
+  def transmit_bytes(self, data):
+    """Queues raw (out-of-band) bytes for transmission, outside any packet
+    framing. Returns whether the data was accepted: if the transmit buffer
+    doesn't have room it is rejected whole, so frames are never split.
+    """
+    if len(self.tx_buffer) + len(data) > self.max_tx_buffer:
+      return False
+    self.tx_buffer += data
+    self.flush_tx()
+    return True
+
+  def flush_tx(self):
+    """Sends as much of the transmit buffer as the socket accepts without
+    blocking. If the connection was lost, the buffer is dropped and the
+    transport is marked closed, as when the other end closes it.
+    """
+    while self.tx_buffer:
+      try:
+        sent = self.socket.send(self.tx_buffer)
+      except BlockingIOError:
+        break
+      except (BrokenPipeError, ConnectionResetError):
+        self.closed = True
+        self.tx_buffer.clear()
+        break
+      del self.tx_buffer[:sent]
 
-  def transmit_packet(self, packet):
-    header = bytearray()
-    for elt in SOF_BYTE:
-      header += serialize_uint8(elt)
-    header += serialize_uint16(len(packet))
+  def tx_backlog(self):
+    """Returns the number of bytes waiting to be sent."""
+    return len(self.tx_buffer)
 
-    modified_packet = bytearray()
-    for packet_byte in packet:
-      modified_packet.append(packet_byte)
-      if packet_byte == SOF_BYTE[0]:
-        modified_packet.append(0x00)
+  def wants_write(self):
+    return bool(self.tx_buffer)
 
-    self.socket.send(header + modified_packet)
+  def fileno(self):
+    return self.socket.fileno()
 
-    # TODO: add CRC support
 
-  def next_rx_packet(self):
-    if self.rx_packets:
-      return self.rx_packets.popleft()
-    else:
-      return None
+# Broker-local opcode, used by clients to select which data IDs the broker
+# forwards to them. Never sent to the car.
+OPCODE_SUBSCRIBE = 0xf0
 
-  def next_rx_byte(self):
-    if self.data_buffer:
-      return self.data_buffer.popleft()
-    else:
-      return None
+class TelemetryBrokerClient(TelemetrySocket):
+  """Connects to a telemetry broker (broker.py) over a Unix-domain socket.
+  Behaves like a TelemetrySocket, and can optionally subscribe to a subset of
+  the data (by internal name), in which case the broker only forwards those
+  fields.
+
+  Arguments:
+    path: filesystem path of the broker's socket
+    subscribe_names: internal names of data to receive, or None for all data
+  """
+  def __init__(self, path: str, subscribe_names=None, max_tx_buffer=65536):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    # the broker rate-limits on the way to the car
+    self.init_socket(sock, SetPacketQueue(), max_tx_buffer)
+
+    self.subscribe_names = subscribe_names
+    if subscribe_names is not None:
+      # data IDs can change with each header, so re-subscribe on every header
+      self.subscribe_header(lambda packet: self.transmit_subscribe_packet(packet.get_data_defs()))
+
+  def transmit_subscribe_packet(self, data_defs):
+    name_to_id = {data_def.internal_name: data_id for data_id, data_def in data_defs.items()}
+    packet = bytearray()
+    packet += serialize_uint8(OPCODE_SUBSCRIBE)
+    for name in self.subscribe_names:
+      if name in name_to_id:
+        packet += serialize_uint8(name_to_id[name])
+      else:
+        print("Subscribed data '%s' not in header" % name)
+    packet += serialize_uint8(DATAID_TERMINATOR)
+    self.transmit_packet(packet)
@@ -0,0 +1,316 @@
+"""Shared-memory ring buffer of decoded telemetry data, for local processes
+that need every sample without a per-consumer copy.
+
+A ShmRingWriter stores each DataPacket as one row, with one column per data
+definition in the current header, in a multiprocessing.shared_memory block
+whose name is derived from the header schema. Readers in other processes
+attach with ShmRingReader and get NumPy views straight into the block.
+
+Like the plotter's RingBuffer, each row is written twice (at its slot and one
+capacity later) so any window of up to capacity rows is contiguous. There are
+no locks: the writer bumps a begin counter before writing a row and an end
+counter after. Readers take the rows below the end counter, and after using
+them check the begin counter to find how many were overwritten meanwhile
+(the reader was lapped). This relies on aligned 64-bit stores being atomic
+and becoming visible in program order, which holds on x86-64.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from multiprocessing import resource_tracker, shared_memory
+
+import hashlib
+import json
+
+import numpy as np  # type: ignore
+
+from .parser import DataPacket, HeaderPacket, TelemetryData, NumericArray, \
+    NUMERIC_SUBTYPE_UINT, NUMERIC_SUBTYPE_SINT, NUMERIC_SUBTYPE_FLOAT
+
+
+RING_MAGIC = int.from_bytes(b'TLMRING1', 'little')
+ALIGN = 64
+
+# indices into the control block, an array of uint64 at the start of the ring
+CTRL_MAGIC = 0
+CTRL_CAPACITY = 1
+CTRL_META_LENGTH = 2
+CTRL_BEGIN = 3  # number of rows started, written before the row data
+CTRL_END = 4  # number of rows completed, written after the row data
+CTRL_CLOSED = 5  # set when the writer moves on to another ring
+CTRL_COUNT = ALIGN // 8
+
+# the directory block (named by the prefix) holds a generation counter and the current ring name,
+# the counter is odd while the name is being updated
+DIRECTORY_NAME_BYTES = ALIGN - 8
+
+
+def align(offset: int) -> int:
+  return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def data_def_dtype(data_def: TelemetryData) -> str:
+  """Returns the NumPy dtype string storing values of a numeric data definition."""
+  if data_def.subtype == NUMERIC_SUBTYPE_UINT:  # type: ignore
+    return 'u%i' % data_def.length  # type: ignore
+  elif data_def.subtype == NUMERIC_SUBTYPE_SINT:  # type: ignore
+    return 'i%i' % data_def.length  # type: ignore
+  elif data_def.subtype == NUMERIC_SUBTYPE_FLOAT:  # type: ignore
+    return 'f%i' % data_def.length  # type: ignore
+  else:
+    raise ValueError("Unknown subtype %02x" % data_def.subtype)  # type: ignore
+
+
+def schema_from_header(header: HeaderPacket) -> List[Dict[str, Any]]:
+  """Returns the ring columns for a header, as JSON-compatible dicts."""
+  schema = []
+  for data_id, data_def in sorted(header.get_data_defs().items()):
+    shape = [data_def.count] if isinstance(data_def, NumericArray) else []  # type: ignore
+    schema.append({'name': data_def.internal_name, 'data_id': data_id,
+                   'dtype': data_def_dtype(data_def), 'shape': shape})
+  return schema
+
+
+def ring_name(prefix: str, schema: List[Dict[str, Any]]) -> str:
+  """Returns the shared memory name of the ring for a schema. Kept short, since
+  some platforms limit shared memory names to 31 characters.
+  """
+  digest = hashlib.sha1(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+  return '%s-%s' % (prefix, digest[:12])
+
+
+def ring_layout(schema: List[Dict[str, Any]], capacity: int,
+                meta_length: int) -> Tuple[Dict[str, Tuple[int, np.dtype, Tuple[int, ...]]], int, int]:
+  """Returns the column (offset, dtype, shape) dict, the present mask offset,
+  and the total size of a ring.
+  """
+  offset = align(CTRL_COUNT * 8 + meta_length)
+  columns = {}
+  for column in schema:
+    dtype = np.dtype(column['dtype'])
+    shape = (2 * capacity,) + tuple(column['shape'])
+    columns[column['name']] = (offset, dtype, shape)
+    offset = align(offset + dtype.itemsize * int(np.prod(shape)))
+  present_offset = offset
+  size = present_offset + 2 * capacity * len(schema)
+  return columns, present_offset, size
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+  """Attaches to an existing shared memory block without taking ownership, so
+  it isn't unlinked when this process exits.
+  """
+  shm = shared_memory.SharedMemory(name=name)
+  resource_tracker.unregister(shm._name, 'shared_memory')  # type: ignore
+  return shm
+
+
+class ShmRingWriter:
+  """Writes decoded data packets into a shared-memory ring, starting a new ring
+  (and closing the previous one) on each header.
+
+  Arguments:
+    prefix: shared memory name prefix; the ring for the current header is
+      published under this name for readers using ShmRingReader.latest
+    capacity: number of rows in the ring
+  """
+  def __init__(self, prefix: str, capacity: int) -> None:
+    self.prefix = prefix
+    self.capacity = capacity
+
+    self.directory = self.create(prefix, ALIGN)
+    self.directory_ctrl = np.ndarray((1,), dtype=np.uint64, buffer=self.directory.buf)
+    self.directory_ctrl[0] = 0
+
+    self.name: Optional[str] = None
+    self.shm: Optional[shared_memory.SharedMemory] = None
+    self.ctrl = np.zeros(CTRL_COUNT, dtype=np.uint64)
+    self.columns: Dict[int, Tuple[int, np.ndarray]] = {}  # data ID -> (column index, mirrored buffer)
+    self.present = np.zeros((0, 0), dtype=np.bool_)
+    self.count = 0
+
+  @staticmethod
+  def create(name: str, size: int) -> shared_memory.SharedMemory:
+    try:
+      return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:  # left behind by a writer that didn't exit cleanly
+      stale = attach(name)
+      stale.close()
+      stale.unlink()
+      return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+  def set_header(self, header: HeaderPacket) -> None:
+    self.close_ring()
+
+    schema = schema_from_header(header)
+    meta = json.dumps({'schema': schema}).encode('utf-8')
+    column_layout, present_offset, size = ring_layout(schema, self.capacity, len(meta))
+
+    self.name = ring_name(self.prefix, schema)
+    self.shm = self.create(self.name, size)
+    self.ctrl = np.ndarray((CTRL_COUNT,), dtype=np.uint64, buffer=self.shm.buf)
+    self.ctrl[:] = 0
+    self.ctrl[CTRL_CAPACITY] = self.capacity
+    self.ctrl[CTRL_META_LENGTH] = len(meta)
+    self.shm.buf[CTRL_COUNT * 8:CTRL_COUNT * 8 + len(meta)] = meta  # type: ignore
+
+    self.columns = {}
+    for i, column in enumerate(schema):
+      offset, dtype, shape = column_layout[column['name']]
+      self.columns[column['data_id']] = (i, np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+    self.present = np.ndarray((2 * self.capacity, len(schema)), dtype=np.bool_,
+                              buffer=self.shm.buf, offset=present_offset)
+    self.count = 0
+    self.ctrl[CTRL_MAGIC] = RING_MAGIC  # marks the ring as initialized
+
+    name_bytes = self.name.encode('utf-8')
+    self.directory_ctrl[0] += 1
+    self.directory.buf[8:8 + DIRECTORY_NAME_BYTES] = name_bytes.ljust(DIRECTORY_NAME_BYTES, b'\0')  # type: ignore
+    self.directory_ctrl[0] += 1
+
+  def write(self, packet: DataPacket) -> None:
+    if self.shm is None:
+      return
+    slot = self.count % self.capacity
+    self.ctrl[CTRL_BEGIN] = self.count + 1
+    self.present[slot] = False
+    for data_id, value in packet.get_data_dict().items():
+      column_index, buffer = self.columns[data_id]
+      buffer[slot] = value
+      buffer[slot + self.capacity] = buffer[slot]
+      self.present[slot, column_index] = True
+    self.present[slot + self.capacity] = self.present[slot]
+    self.count += 1
+    self.ctrl[CTRL_END] = self.count
+
+  def close_ring(self) -> None:
+    if self.shm is None:
+      return
+    self.ctrl[CTRL_CLOSED] = 1
+    self.ctrl = np.zeros(CTRL_COUNT, dtype=np.uint64)
+    self.columns = {}
+    self.present = np.zeros((0, 0), dtype=np.bool_)
+    self.shm.close()
+    self.shm.unlink()  # readers still attached keep their mapping until they close
+    self.shm = None
+    self.name = None
+
+  def close(self) -> None:
+    self.close_ring()
+    del self.directory_ctrl
+    self.directory.close()
+    self.directory.unlink()
+
+
+class RingRead:
+  """Rows returned by ShmRingReader.read, as views into the ring.
+
+  Arguments:
+    first_index: ring row index of the first row
+    columns: internal name -> array of values, with rows along the first axis
+    present: internal name -> bool array of whether the row's packet had that data;
+      values in rows without it are stale
+    lapped: number of rows missed since the previous read, because the
+      reader fell more than a ring capacity behind
+  """
+  def __init__(self, first_index: int, columns: Dict[str, np.ndarray],
+               present: Dict[str, np.ndarray], lapped: int) -> None:
+    self.first_index = first_index
+    self.columns = columns
+    self.present = present
+    self.lapped = lapped
+
+  def __len__(self) -> int:
+    return len(next(iter(self.present.values()))) if self.present else 0
+
+
+class ShmRingReader:
+  """Reads rows from a ShmRingWriter ring in another process, without copying.
+
+  Views from read() are only guaranteed valid if overwritten() returns 0 for
+  them after they have been used; they must be released before close().
+
+  Arguments:
+    name: shared memory name of the ring
+    from_start: whether to start at the oldest row in the ring, instead of
+      only reading rows written after attaching
+  """
+  def __init__(self, name: str, from_start: bool = False) -> None:
+    self.name = name
+    self.shm = attach(name)
+    self.ctrl = np.ndarray((CTRL_COUNT,), dtype=np.uint64, buffer=self.shm.buf)
+    if int(self.ctrl[CTRL_MAGIC]) != RING_MAGIC:
+      self.close()
+      raise ValueError("%s is not an initialized telemetry ring" % name)
+
+    self.capacity = int(self.ctrl[CTRL_CAPACITY])
+    meta_length = int(self.ctrl[CTRL_META_LENGTH])
+    meta = json.loads(bytes(self.shm.buf[CTRL_COUNT * 8:CTRL_COUNT * 8 + meta_length]).decode('utf-8'))  # type: ignore
+    self.schema: List[Dict[str, Any]] = meta['schema']
+
+    column_layout, present_offset, _ = ring_layout(self.schema, self.capacity, meta_length)
+    self.columns = {name: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+                    for name, (offset, dtype, shape) in column_layout.items()}
+    self.present = np.ndarray((2 * self.capacity, len(self.schema)), dtype=np.bool_,
+                              buffer=self.shm.buf, offset=present_offset)
+
+    end = int(self.ctrl[CTRL_END])
+    self.next_index = max(0, end - self.capacity) if from_start else end
+
+  @staticmethod
+  def latest(prefix: str, from_start: bool = False) -> Optional['ShmRingReader']:
+    """Attaches to the ring currently published by the writer with this prefix,
+    or returns None if it has not received a header yet.
+    """
+    directory = attach(prefix)
+    try:
+      directory_ctrl = np.ndarray((1,), dtype=np.uint64, buffer=directory.buf)
+      while True:
+        generation = int(directory_ctrl[0])
+        name = bytes(directory.buf[8:8 + DIRECTORY_NAME_BYTES]).rstrip(b'\0').decode('utf-8')  # type: ignore
+        if generation % 2 == 0 and int(directory_ctrl[0]) == generation:
+          break
+      del directory_ctrl
+    finally:
+      directory.close()
+    if generation == 0:
+      return None
+    return ShmRingReader(name, from_start)
+
+  @property
+  def closed(self) -> bool:
+    """Whether the writer has moved on to a new ring (after a new header), in
+    which case no more rows will arrive here.
+    """
+    return bool(self.ctrl[CTRL_CLOSED])
+
+  def read(self, max_rows: Optional[int] = None) -> Optional[RingRead]:
+    """Returns the rows written since the last read (at most max_rows, the
+    oldest first), or None if there are none.
+    """
+    end = int(self.ctrl[CTRL_END])
+    if max_rows is not None:
+      end = min(end, self.next_index + max_rows)
+    start = max(self.next_index, end - self.capacity)
+    if start >= end:
+      return None
+    lapped = start - self.next_index
+    self.next_index = end
+
+    slot = start % self.capacity
+    rows = slice(slot, slot + end - start)
+    return RingRead(start,
+                    {name: column[rows] for name, column in self.columns.items()},
+                    {column['name']: self.present[rows, i] for i, column in enumerate(self.schema)},
+                    lapped)
+
+  def overwritten(self, read: RingRead) -> int:
+    """Returns how many leading rows of a read have since been overwritten by
+    the writer (or are being written), and so may hold newer data.
+    """
+    valid_from = int(self.ctrl[CTRL_BEGIN]) - self.capacity
+    return min(len(read), max(0, valid_from - read.first_index))
+
+  def close(self) -> None:
+    self.columns = {}
+    self.present = np.zeros((0, 0), dtype=np.bool_)
+    del self.ctrl
+    self.shm.close()
@@ -0,0 +1,75 @@
+"""Sliding-window spectra (spectrograms) of numeric data, computed
+incrementally so the same code serves a live stream and a whole log.
+"""
+from typing import Optional, Sequence, Tuple
+
+import numpy as np  # type: ignore
+from numpy.lib.stride_tricks import sliding_window_view  # type: ignore
+
+
+SPECTRUM_FLOOR_DB = -240.0  # magnitude of all-zero frames, instead of -inf
+
+
+class SlidingSpectrum:
+  """Magnitude spectra, in dB relative to a full-scale sine of amplitude 1, of
+  Hann-windowed frames of window_length evenly spaced samples, starting every
+  hop samples. Samples are added in batches, and only the frames completed by
+  each batch are transformed (in a single FFT call), so a whole log is one
+  vectorized pass and a live stream costs one transform per hop.
+
+  Arguments:
+    window_length: samples per frame, at least 2
+    hop: samples between frame starts, defaults to a quarter window (75% overlap)
+  """
+  def __init__(self, window_length: int, hop: Optional[int] = None) -> None:
+    assert window_length >= 2, "window_length must be at least 2"
+    self.window_length = window_length
+    self.hop = hop if hop is not None else max(1, window_length // 4)
+    self.window = np.hanning(window_length)
+    self.scale = 2 / np.sum(self.window)
+    self.history = np.empty(window_length - 1)  # the latest samples, for frames spanning batches
+    self.reset()
+
+  def reset(self) -> None:
+    """Forgets all samples, like when the independent variable resets."""
+    self.history_length = 0
+    self.until_frame = self.window_length  # samples until the next frame is complete
+
+  def get_bins(self) -> int:
+    return self.window_length // 2 + 1
+
+  def get_frequency_edges(self, sample_interval: float) -> np.ndarray:
+    """Returns the bin edges (one more than the bins), clipped to [0, Nyquist]."""
+    resolution = 1 / (self.window_length * sample_interval)
+    edges = np.arange(self.get_bins() + 1) * resolution - resolution / 2
+    return np.clip(edges, 0, 0.5 / sample_interval)
+
+  def extend(self, values: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Adds samples, returning the indices (into values) of the last sample of
+    each frame they complete, and the spectra of those frames, one row each.
+    """
+    samples = np.asarray(values, dtype=np.float64)
+    ends = np.arange(self.until_frame - 1, len(samples), self.hop)
+    if len(ends):
+      data = np.concatenate((self.history[:self.history_length], samples))
+      starts: np.ndarray = ends + self.history_length - self.window_length + 1
+      frames = sliding_window_view(data, self.window_length)[starts]
+      magnitudes = np.abs(np.fft.rfft(frames * self.window, axis=1)) * self.scale
+      with np.errstate(divide='ignore'):
+        spectra = np.maximum(20 * np.log10(magnitudes), SPECTRUM_FLOOR_DB)
+      self.until_frame = int(ends[-1]) + self.hop + 1 - len(samples)
+    else:
+      spectra = np.empty((0, self.get_bins()))
+      self.until_frame -= len(samples)
+
+    # keep the latest window_length - 1 samples, shifting in place
+    capacity = len(self.history)
+    if len(samples) >= capacity:
+      self.history[:] = samples[len(samples) - capacity:]
+      self.history_length = capacity
+    else:
+      keep = min(self.history_length, capacity - len(samples))
+      self.history[:keep] = self.history[self.history_length - keep:self.history_length].copy()
+      self.history[keep:keep + len(samples)] = samples
+      self.history_length = keep + len(samples)
+    return ends, spectra
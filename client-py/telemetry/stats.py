@@ -0,0 +1,285 @@
+"""Streaming statistics over telemetry data, updated in constant (amortized)
+time per sample so they can keep up with the link.
+"""
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from collections import deque
+
+import math
+
+import numpy as np  # type: ignore
+
+from .parser import DataPacket, NumericArray, TelemetryData
+
+
+class WindowExtrema(object):
+  """Minimum and maximum over a sliding window of samples, maintained with
+  monotonic deques in amortized constant time per sample.
+  """
+  def __init__(self) -> None:
+    self.min_deque: Deque[Tuple[int, float]] = deque()  # of (sample number, value), values increasing
+    self.max_deque: Deque[Tuple[int, float]] = deque()  # of (sample number, value), values decreasing
+
+  def append(self, index: int, value: float) -> None:
+    while self.min_deque and self.min_deque[-1][1] >= value:
+      self.min_deque.pop()
+    self.min_deque.append((index, value))
+    while self.max_deque and self.max_deque[-1][1] <= value:
+      self.max_deque.pop()
+    self.max_deque.append((index, value))
+
+  def expire(self, first_index: int) -> None:
+    """Drops samples numbered before first_index from the window."""
+    while self.min_deque and self.min_deque[0][0] < first_index:
+      self.min_deque.popleft()
+    while self.max_deque and self.max_deque[0][0] < first_index:
+      self.max_deque.popleft()
+
+  def get_min(self) -> Optional[float]:
+    return self.min_deque[0][1] if self.min_deque else None
+
+  def get_max(self) -> Optional[float]:
+    return self.max_deque[0][1] if self.max_deque else None
+
+
+class WindowMoments:
+  """Mean and variance over a sliding window of the last `window` samples,
+  using Welford updates to add each new sample and remove the expired one.
+  Samples can be floats or (elementwise) NumPy arrays.
+  """
+  def __init__(self, window: int) -> None:
+    self.window = window
+    self.samples: Deque[Any] = deque()
+    self.mean: Any = 0.0
+    self.m2: Any = 0.0  # sum of squared differences from the mean
+
+  def append(self, value: Any) -> None:
+    if len(self.samples) == self.window:
+      expired = self.samples.popleft()
+      if self.samples:
+        delta = expired - self.mean
+        self.mean = self.mean - delta / len(self.samples)
+        self.m2 = self.m2 - delta * (expired - self.mean)
+      else:
+        self.mean, self.m2 = 0.0, 0.0
+    self.samples.append(value)
+    delta = value - self.mean
+    self.mean = self.mean + delta / len(self.samples)
+    self.m2 = self.m2 + delta * (value - self.mean)
+
+  def get_mean(self) -> Any:
+    return self.mean
+
+  def get_std(self) -> Any:
+    """Returns the population standard deviation over the window."""
+    if not self.samples:
+      return 0.0
+    return np.sqrt(np.maximum(self.m2, 0) / len(self.samples))  # m2 can drift slightly negative
+
+
+class ChannelStats:
+  """Streaming statistics for one data ID: sample count, last value, and the
+  min, max, mean and standard deviation over a sliding window. NumericArray
+  data is summarized elementwise (vectorized), then reduced to one number per
+  column for display.
+  """
+  def __init__(self, data_def: TelemetryData, window: int) -> None:
+    self.data_def = data_def
+    self.window = window
+    self.is_array = isinstance(data_def, NumericArray)
+
+    self.count = 0
+    self.last: Any = None
+    self.min_extrema = WindowExtrema()
+    self.max_extrema = WindowExtrema()  # same as min_extrema for scalars
+    self.moments = WindowMoments(window)
+
+  def append(self, value: Any) -> None:
+    if self.is_array:
+      value = np.asarray(value, dtype=np.float64)
+      self.min_extrema.append(self.count, float(value.min()))
+      self.max_extrema.append(self.count, float(value.max()))
+    else:
+      self.min_extrema.append(self.count, value)
+    self.last = value
+    self.moments.append(value)
+    self.count += 1
+    self.min_extrema.expire(self.count - self.window)
+    if self.is_array:
+      self.max_extrema.expire(self.count - self.window)
+
+  def get_min(self) -> Optional[float]:
+    return self.min_extrema.get_min()
+
+  def get_max(self) -> Optional[float]:
+    return (self.max_extrema if self.is_array else self.min_extrema).get_max()
+
+  def get_summary(self) -> Tuple[Optional[float], Optional[float], Optional[float], Optional[float], Optional[float]]:
+    """Returns (last, min, max, mean, std). For arrays, last is the mean of the
+    last frame, and mean and std are averages of the per-element values.
+    """
+    if self.last is None:
+      return (None, None, None, None, None)
+    if self.is_array:
+      return (float(self.last.mean()), self.get_min(), self.get_max(),
+              float(np.mean(self.moments.get_mean())), float(np.mean(self.moments.get_std())))
+    else:
+      return (self.last, self.get_min(), self.get_max(),
+              float(self.moments.get_mean()), float(self.moments.get_std()))
+
+
+def format_number(value: Optional[float]) -> str:
+  if value is None or (isinstance(value, float) and math.isnan(value)):
+    return '-'
+  return '%.6g' % value
+
+
+class StatsEngine:
+  """Per-data-ID streaming statistics for the data definitions of the current
+  header, with packet rates measured between calls to format_table.
+
+  Arguments:
+    window: number of samples in the sliding window of each channel
+  """
+  def __init__(self, window: int) -> None:
+    self.window = window
+    self.channels: Dict[int, ChannelStats] = {}
+    self.last_counts: Dict[int, int] = {}
+    self.last_time: Optional[float] = None
+
+  def set_data_defs(self, data_defs: Dict[int, TelemetryData]) -> None:
+    self.channels = {data_id: ChannelStats(data_def, self.window)
+                     for data_id, data_def in sorted(data_defs.items())}
+    self.last_counts = {data_id: 0 for data_id in self.channels}
+    self.last_time = None
+
+  def update(self, packet: DataPacket) -> None:
+    for data_id, value in packet.get_data_dict().items():
+      channel = self.channels.get(data_id)
+      if channel is not None:
+        channel.append(value)
+
+  def format_table(self, now: float) -> str:
+    """Returns a text table of the statistics, with rates since the previous call."""
+    rows: List[List[str]] = [['name', 'units', 'rate/s', 'last', 'min', 'max', 'mean', 'std']]
+    for data_id, channel in self.channels.items():
+      data_def = channel.data_def
+      if self.last_time is not None and now > self.last_time:
+        rate = format_number((channel.count - self.last_counts[data_id]) / (now - self.last_time))
+      else:
+        rate = '-'
+      self.last_counts[data_id] = channel.count
+      name = data_def.internal_name
+      if channel.is_array:
+        name += '[%i]' % data_def.count  # type: ignore
+      rows.append([name, data_def.units, rate] + [format_number(value) for value in channel.get_summary()])
+    self.last_time = now
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for row in rows:
+      lines.append('  '.join(cell.rjust(width) if i >= 2 else cell.ljust(width)
+                             for i, (cell, width) in enumerate(zip(row, widths))))
+    return '\n'.join(lines)
+
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class ClockEstimator:
+  """Pairs the device's time data with host receive times to estimate the
+  offset and drift between the two clocks, and from those the latency of each
+  sample. Without round-trip timing the fixed part of the link delay can't be
+  separated from the clock offset, so latencies are relative to the fastest
+  samples: they measure queuing and buffering delay on top of the minimum.
+
+  The offset is tracked as the lower envelope of (host time - device time):
+  the minimum per bucket_interval of host time, with a line fitted through the
+  last num_buckets minima (its slope is the drift) and lowered to lie under
+  all of them.
+
+  Arguments:
+    device_time_scale: seconds per unit of device time
+    bucket_interval: seconds of host time per offset minimum
+    num_buckets: number of minima the drift is fitted over
+    num_latencies: number of recent latencies percentiles are computed over
+  """
+  def __init__(self, device_time_scale: float = 1e-3, bucket_interval: float = 1.0,
+               num_buckets: int = 60, num_latencies: int = 1000) -> None:
+    self.device_time_scale = device_time_scale
+    self.bucket_interval = bucket_interval
+    self.num_buckets = num_buckets
+    self.latencies: Deque[float] = deque(maxlen=num_latencies)
+    self.reset()
+
+  def reset(self) -> None:
+    """Forgets the clock relationship, like after the device restarts."""
+    self.minima: Deque[Tuple[float, float]] = deque(maxlen=self.num_buckets)  # of (host time, offset)
+    self.bucket_start: Optional[float] = None
+    self.bucket_min: Optional[Tuple[float, float]] = None
+    self.slope = 0.0
+    self.intercept: Optional[float] = None  # offset at host time 0
+    self.last_device_time: Optional[float] = None
+
+  def add(self, device_time: float, host_time: float) -> None:
+    device_seconds = device_time * self.device_time_scale
+    if self.last_device_time is not None and device_seconds < self.last_device_time:
+      self.reset()
+    self.last_device_time = device_seconds
+
+    offset = host_time - device_seconds
+    if self.bucket_start is None or host_time - self.bucket_start >= self.bucket_interval:
+      if self.bucket_min is not None:
+        self.minima.append(self.bucket_min)
+        self.fit()
+      self.bucket_start = host_time
+      self.bucket_min = (host_time, offset)
+    elif self.bucket_min is None or offset < self.bucket_min[1]:
+      self.bucket_min = (host_time, offset)
+
+    estimate = self.get_offset(host_time)
+    if estimate is not None:
+      self.latencies.append(offset - estimate)
+
+  def fit(self) -> None:
+    times = np.array([host_time for host_time, _ in self.minima])
+    offsets = np.array([offset for _, offset in self.minima])
+    if len(self.minima) >= 2 and times[-1] > times[0]:
+      self.slope = float(np.polyfit(times - times[0], offsets, 1)[0])
+    else:
+      self.slope = 0.0
+    # lower the line to lie under all the minima
+    self.intercept = float(np.min(offsets - self.slope * times))
+
+  def get_offset(self, host_time: float) -> Optional[float]:
+    """Returns the estimated host minus device time (in seconds, including the
+    minimum link delay) at a host time, or None before the first estimate.
+    """
+    if self.intercept is None:
+      return self.bucket_min[1] if self.bucket_min is not None else None
+    return min(self.intercept + self.slope * host_time,
+               self.bucket_min[1] if self.bucket_min is not None else float('inf'))
+
+  def get_drift(self) -> float:
+    """Returns the host clock's drift relative to the device, in parts per million."""
+    return self.slope * 1e6
+
+  def get_latency_percentiles(self) -> Optional[List[float]]:
+    """Returns the LATENCY_PERCENTILES of recent latencies in seconds, or None without samples."""
+    return latency_percentiles(self.latencies)
+
+  def format(self) -> str:
+    percentiles = self.get_latency_percentiles()
+    if percentiles is None:
+      return "no latency data"
+    return "latency %s ms, drift %.0f ppm" % (format_latency_percentiles(percentiles), self.get_drift())
+
+
+def latency_percentiles(latencies: Deque[float]) -> Optional[List[float]]:
+  if not latencies:
+    return None
+  return [float(value) for value in np.percentile(np.array(latencies), LATENCY_PERCENTILES)]
+
+
+def format_latency_percentiles(percentiles: List[float]) -> str:
+  return ' '.join("p%i %.1f" % (percentile, value * 1000)
+                  for percentile, value in zip(LATENCY_PERCENTILES, percentiles))